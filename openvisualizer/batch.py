@@ -0,0 +1,514 @@
+# Copyright (c) 2010-2013, Regents of the University of California.
+# All rights reserved.
+#
+# Released under the BSD 3-Clause license as published at the link below.
+# https://openwsn.atlassian.net/wiki/display/OW/License
+
+"""
+Headless batch simulation, for parameter sweeps and performance regressions.
+
+Loads a topology, simulates it as fast as possible for a given duration (of simulated time), and writes the results
+to a JSON file: the KPIs of each mote (as computed by the ParserData of the DAG root, from the uinject packets), the
+number of events executed, the wall-clock time and the simulation speed.
+
+Neither the RPC server nor the TUN interface are started. The timeline is driven from the calling thread (see
+TimeLine.run_until): the motes are booted and run for BOOT_DURATION, the DAG root is then set, and the network runs
+until the end of the simulation. The frames written by the motes are parsed as soon as they are written, so a run
+only depends on its seed: the digest of its events (see TimeLine.set_trace) is part of the results, and the trace
+itself can be written to a file, to be compared with the one of another run.
+
+With --shards, the motes are simulated in several worker processes (see ShardedSimulation): each worker imports the
+firmware, and the one simulating the DAG root also runs the components the root talks to, and computes the KPIs. Each
+worker traces its own events, to its own trace file.
+"""
+
+import functools
+import json
+import logging.config
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+from openvisualizer.eventbus import eventbusmonitor
+from openvisualizer.jrc import jrc
+from openvisualizer.main import OpenVisualizerServer
+from openvisualizer.motehandler.moteconnector import moteconnector
+from openvisualizer.motehandler.moteprobe import emulatedmoteprobe
+from openvisualizer.motehandler.motestate import motestate
+from openvisualizer.motehandler.motestate.motestate import MoteState
+from openvisualizer.openlbr import openlbr
+from openvisualizer.opentun.opentun import OpenTun
+from openvisualizer.rpl import topology, rpl
+from openvisualizer.simengine import simengine, motehandler
+from openvisualizer.simengine.shard import ShardedSimulation, ShardError
+
+log = logging.getLogger('BatchSimulation')
+log.setLevel(logging.INFO)
+log.addHandler(logging.NullHandler())
+
+# ============================ defines =========================================
+
+# simulated time given to the motes to boot before the DAG root is set, in seconds
+BOOT_DURATION = 1.0
+
+
+class BatchError(Exception):
+    """ The batch simulation cannot be set up. """
+    pass
+
+
+# ============================ helpers =========================================
+
+def _load(topo_file, fw_path, root):
+    """
+    Checks the topology, the root and the firmware before starting anything.
+
+    :returns: The topology, the ID of the DAG root, the firmware definitions and the temporary copy of the firmware.
+    """
+
+    topo_config = OpenVisualizerServer.read_topology_file(topo_file)
+    if topo_config is None:
+        raise BatchError('could not load topology from {0}'.format(topo_file))
+
+    # the emulated motes are numbered from 1, in the order they are created
+    mote_ids = sorted([mote['id'] for mote in topo_config['motes']])
+    if mote_ids != range(1, len(mote_ids) + 1):
+        raise BatchError('the motes must be numbered from 1, not {0}'.format(mote_ids))
+
+    root = min(mote_ids) if root is None else root
+    if root not in mote_ids:
+        raise BatchError('unknown root {0}, the motes are {1}'.format(root, mote_ids))
+
+    try:
+        fw_defines = OpenVisualizerServer.extract_stack_defines(fw_path)
+    except IOError as err:
+        raise BatchError('could not read the firmware definitions: {0}'.format(err))
+
+    temp_dir = OpenVisualizerServer.copy_sim_fw(fw_path)
+    if temp_dir is None:
+        raise BatchError('failed to import simulation files from {0}'.format(fw_path))
+
+    return topo_config, root, fw_defines, temp_dir
+
+
+def _discard_frame(frame):
+    """ Frame handler of the motes without a mote probe: nothing reads their UART. """
+    pass
+
+
+def _start_components():
+    """ Starts the components the motes talk to (network prefix, security keys, routes), without any server. """
+    return (eventbusmonitor.EventBusMonitor(), openlbr.OpenLbr(False), rpl.RPL(), jrc.JRC(), topology.Topology(),
+            OpenTun.create(False))
+
+
+# ============================ batch ===========================================
+
+class BatchSimulation(object):
+    """
+    Simulates the motes of a topology file, without any server.
+
+    :param topo_file: The topology, as saved by the OpenVisualizer Server (motes and connections).
+    :param fw_path: The path to the OpenWSN firmware.
+    :param root: The ID of the DAG root, by default the lowest ID of the topology.
+    :param seed: The seed of the random draws of the simulation, drawn from the system if None.
+    :param trace: The file the trace of the events is written to, if any.
+    """
+
+    def __init__(self, topo_file, fw_path, root=None, sim_collisions=False, sim_threads=False, seed=None, trace=None):
+
+        (topo_config, root, fw_defines, temp_dir) = _load(topo_file, fw_path, root)
+
+        # store params
+        self.topo_file = topo_file
+        self.fw_path = fw_path
+        self.root = root
+        self.seed = seed
+        self.temp_dir = temp_dir
+
+        # local variables
+        self.num_events = 0
+        self.sim_time = 0
+        self.wall_time = 0
+
+        # the components the motes talk to
+        (self.ebm, self.openlbr, self.rpl, self.jrc, self.topology, self.opentun) = _start_components()
+
+        # the connections are those of the topology file, not drawn from the locations of the motes
+        self.engine = simengine.SimEngine('fully-meshed')
+        self.engine.set_as_fast_as_possible(True)
+        self.engine.set_mote_threads(sim_threads)
+        self.engine.propagation.set_collision_model(sim_collisions)
+        self.engine.set_seed(seed)
+        self.engine.timeline.set_trace(True, trace)
+
+        sys.path.append(self.temp_dir)
+        motehandler.read_notif_ids(os.path.join(self.temp_dir, 'openwsnmodule_obj.h'))
+
+        import oos_openwsn  # pylint: disable=import-error
+
+        self.mote_probes = []
+        for _ in topo_config['motes']:
+            mote_handler = motehandler.MoteHandler(oos_openwsn.OpenMote(), False)
+            self.engine.indicate_new_mote(mote_handler)
+            self.mote_probes += [emulatedmoteprobe.EmulatedMoteProbe(emulated_mote=mote_handler, inline=True)]
+
+        OpenVisualizerServer.apply_topology(self.engine, topo_config)
+
+        self.mote_connectors = [moteconnector.MoteConnector(mp, fw_defines, None) for mp in self.mote_probes]
+        self.mote_states = [motestate.MoteState(mc) for mc in self.mote_connectors]
+
+    # ======================== public ==========================================
+
+    def run(self, duration):
+        """ Boots the motes and simulates the network for duration seconds (of simulated time). """
+
+        timeline = self.engine.timeline
+        start = time.time()
+
+        now = timeline.get_current_time()
+        for mh in self.engine.moteHandlers:
+            timeline.schedule_event(now, mh.get_id(), mh.hw_supply.switch_on, mh.hw_supply.INTR_SWITCHON)
+        self.num_events += timeline.run_until(min(BOOT_DURATION, duration))
+
+        # the command is written to the UART of the root at the current (simulated) time
+        self._root_mote_state().trigger_action(MoteState.TRIGGER_DAGROOT)
+        self.num_events += timeline.run_until(duration)
+        self.sim_time = duration
+
+        self.wall_time += time.time() - start
+
+        log.info('simulated {0}s in {1:.3f}s ({2} events)'.format(duration, self.wall_time, self.num_events))
+
+    def get_results(self):
+        """ Returns the KPIs of each mote, the number of events executed and the simulation speed. """
+
+        parser_data = self._root_mote_state().mote_connector.parser.parser_data
+
+        return {
+            'topology': self.topo_file,
+            'root': self.root,
+            'seed': self.seed,
+            'motes': parser_data.get_kpis(),
+            'events': self.num_events,
+            'sim_time': self.sim_time,
+            'wall_time': self.wall_time,
+            'events_per_s': self.num_events / self.wall_time if self.wall_time else None,
+            'speed_ratio': self.sim_time / self.wall_time if self.wall_time else None,
+            'propagation': self.engine.propagation.get_stats(),
+            'trace_digest': self.engine.timeline.get_trace_digest(),
+        }
+
+    def close(self):
+        for probe in self.mote_probes:
+            probe.close()
+        self.engine.timeline.set_trace(False)
+        self.opentun.close()
+        self.rpl.close()
+        self.jrc.close()
+        OpenVisualizerServer.cleanup_temporary_files([self.temp_dir])
+
+    # ======================== private =========================================
+
+    def _root_mote_state(self):
+        port = 'emulated{0}'.format(self.root)
+        for ms in self.mote_states:
+            if ms.mote_connector.serialport == port:
+                return ms
+        raise BatchError('no emulated mote {0} for the DAG root'.format(self.root))
+
+
+class ShardedBatchSimulation(object):
+    """
+    Simulates the motes of a topology file in several worker processes, see BatchSimulation.
+
+    The topology gives all the connections.
+
+    :param shards: The number of worker processes.
+    :param trace: The path of the trace files of the workers, which get the number of their shard as extension.
+    """
+
+    def __init__(self, topo_file, fw_path, shards, root=None, sim_collisions=False, sim_threads=False, seed=None,
+                 trace=None):
+
+        (topo_config, root, fw_defines, temp_dir) = _load(topo_file, fw_path, root)
+
+        # store params
+        self.topo_file = topo_file
+        self.root = root
+        self.seed = seed
+        self.temp_dir = temp_dir
+
+        # local variables
+        self.sim_time = 0
+        self.wall_time = 0
+
+        # the workers are given the Python path, and import the firmware from it
+        sys.path.append(self.temp_dir)
+
+        try:
+            self.simulation = ShardedSimulation(
+                'openvisualizer.batch:create_firmware_mote',
+                len(topo_config['motes']),
+                num_shards=shards,
+                connections=[{'fromMote': int(co['fromMote']), 'toMote': int(co['toMote']), 'pdr': float(co['pdr'])}
+                             for co in topo_config['connections']],
+                collector='openvisualizer.batch:collect_results',
+                collision_model=sim_collisions,
+                trace=trace or True,
+                factory_args={
+                    'root': root,
+                    'notif_header': os.path.join(self.temp_dir, 'openwsnmodule_obj.h'),
+                    'fw_defines': fw_defines,
+                    'sim_threads': sim_threads,
+                    'seed': seed,
+                },
+            )
+        except ShardError as err:
+            OpenVisualizerServer.cleanup_temporary_files([self.temp_dir])
+            raise BatchError('could not start the workers: {0}'.format(err))
+
+    # ======================== public ==========================================
+
+    def run(self, duration):
+        """ Simulates the network for duration seconds (of simulated time), the DAG root is set after BOOT_DURATION. """
+
+        start = time.time()
+        self.simulation.run(duration)
+        self.sim_time += duration
+        self.wall_time += time.time() - start
+
+        log.info('simulated {0}s in {1:.3f}s'.format(duration, self.wall_time))
+
+    def get_results(self):
+        """ Returns the KPIs of each mote, the number of events executed and the simulation speed. """
+
+        stats = self.simulation.get_stats()
+        shards = [dict(s, **r) for (s, r) in zip(stats['shards'], self.simulation.collect())]
+        num_events = sum([s['events'] for s in shards])
+
+        return {
+            'topology': self.topo_file,
+            'root': self.root,
+            'seed': self.seed,
+            'motes': [s['kpis'] for s in shards if s['kpis'] is not None][0],
+            'events': num_events,
+            'sim_time': self.sim_time,
+            'wall_time': self.wall_time,
+            'events_per_s': num_events / self.wall_time if self.wall_time else None,
+            'speed_ratio': self.sim_time / self.wall_time if self.wall_time else None,
+            'windows': stats['windows'],
+            'forwarded': stats['forwarded'],
+            'shards': shards,
+        }
+
+    def close(self):
+        self.simulation.close()
+        OpenVisualizerServer.cleanup_temporary_files([self.temp_dir])
+
+
+# ============================ shards ==========================================
+
+# in the worker simulating the DAG root: the components it talks to, and its mote state
+_dagroot = None
+
+
+def create_firmware_mote(mote_id, root, notif_header, fw_defines, sim_threads=False, seed=None):
+    """
+    Mote factory of the sharded simulation, called in the worker processes: creates a mote running the firmware, and
+    switches it on at time 0.
+
+    The DAG root is set after BOOT_DURATION, by the worker simulating it. Only the DAG root has a mote probe, the frames
+    the other motes write to their UART are discarded as they are written.
+    """
+
+    global _dagroot
+
+    import oos_openwsn  # pylint: disable=import-error
+
+    engine = simengine.SimEngine()
+    if not motehandler.notif_string:
+        # first mote of this worker
+        motehandler.read_notif_ids(notif_header)
+        engine.set_mote_threads(sim_threads)
+        engine.set_seed(seed)
+
+    mote_handler = motehandler.MoteHandler(oos_openwsn.OpenMote(), False)
+    engine.timeline.schedule_event(0, mote_id, mote_handler.hw_supply.switch_on, mote_handler.hw_supply.INTR_SWITCHON)
+
+    if mote_id == root:
+        probe = emulatedmoteprobe.EmulatedMoteProbe(emulated_mote=mote_handler, inline=True)
+        mote_state = motestate.MoteState(moteconnector.MoteConnector(probe, fw_defines, None))
+        _dagroot = (_start_components(), probe, mote_state)
+
+        # the command is written to the UART of the root at that (simulated) time
+        engine.timeline.schedule_event(
+            BOOT_DURATION,
+            None,
+            functools.partial(mote_state.trigger_action, MoteState.TRIGGER_DAGROOT),
+            'dagroot',
+        )
+    else:
+        mote_handler.bsp_uart.set_frame_handler(_discard_frame)
+
+    return mote_handler
+
+
+def collect_results(engine):
+    """ Collector of the sharded simulation: the KPIs, if the worker simulates the DAG root, and the trace digest. """
+
+    return {
+        'kpis': _dagroot[2].mote_connector.parser.parser_data.get_kpis() if _dagroot else None,
+        'propagation': engine.propagation.get_stats(),
+        'trace_digest': engine.timeline.get_trace_digest(),
+    }
+
+
+# ============================ main ============================================
+
+def _add_parser_args(parser):
+    parser.add_argument(
+        '--load-topology',
+        dest='topo_file',
+        type=str,
+        required=True,
+        help='The topology to simulate (motes numbered from 1, and connections), as saved by the OpenVisualizer '
+             'Server.',
+    )
+
+    parser.add_argument(
+        '--duration',
+        dest='duration',
+        type=float,
+        required=True,
+        help='Simulated time, in seconds.',
+    )
+
+    parser.add_argument(
+        '--output',
+        dest='output',
+        type=str,
+        default='results.json',
+        help='The JSON file the results are written to.',
+    )
+
+    parser.add_argument(
+        '--fw-path',
+        dest='fw_path',
+        type=str,
+        help='Provide the path to the OpenWSN firmware. This option overrides the optional OPENWSN_FW_BASE environment '
+             'variable.',
+    )
+
+    parser.add_argument(
+        '--root',
+        dest='root',
+        type=int,
+        help='The ID of the DAG root, by default the lowest ID of the topology.',
+    )
+
+    parser.add_argument(
+        '--seed',
+        dest='seed',
+        type=int,
+        help='Seed of the random draws of the simulation (links, frame losses, locations and drifts).',
+    )
+
+    parser.add_argument(
+        '--trace',
+        dest='trace',
+        type=str,
+        help='Write the trace of the executed events to this file, to compare it with the one of another run. With '
+             '--shards, each worker writes its own file, with the number of its shard as extension.',
+    )
+
+    parser.add_argument(
+        '--sim-threads',
+        dest='sim_threads',
+        default=False,
+        action='store_true',
+        help='Run each simulated mote in its own thread instead of in the calling thread.',
+    )
+
+    parser.add_argument(
+        '--sim-collisions',
+        dest='sim_collisions',
+        default=False,
+        action='store_true',
+        help='Corrupt the frames received while other motes transmit on the same channel (SINR below the capture '
+             'threshold).',
+    )
+
+    parser.add_argument(
+        '--shards',
+        dest='shards',
+        type=int,
+        help='Simulate the motes in this number of worker processes.',
+    )
+
+    parser.add_argument(
+        '-l', '--lconf',
+        dest='lconf',
+        action='store',
+        help='Provide a logging configuration.',
+    )
+
+
+def main():
+    """ Entry point for the headless batch simulation. """
+
+    parser = ArgumentParser()
+    _add_parser_args(parser)
+    args = parser.parse_args()
+
+    if args.lconf:
+        logging.config.fileConfig(args.lconf)
+    else:
+        logging.basicConfig(level=logging.WARNING)
+
+    fw_path = os.path.expanduser(args.fw_path) if args.fw_path else os.environ.get('OPENWSN_FW_BASE')
+    if fw_path is None:
+        log.critical("Neither OPENWSN_FW_BASE or '--fw-path' was specified.")
+        sys.exit(1)
+
+    try:
+        if args.shards:
+            batch = ShardedBatchSimulation(
+                topo_file=os.path.expanduser(args.topo_file),
+                fw_path=fw_path,
+                shards=args.shards,
+                root=args.root,
+                sim_collisions=args.sim_collisions,
+                sim_threads=args.sim_threads,
+                seed=args.seed,
+                trace=args.trace,
+            )
+        else:
+            batch = BatchSimulation(
+                topo_file=os.path.expanduser(args.topo_file),
+                fw_path=fw_path,
+                root=args.root,
+                sim_collisions=args.sim_collisions,
+                sim_threads=args.sim_threads,
+                seed=args.seed,
+                trace=args.trace,
+            )
+    except BatchError as err:
+        log.critical(err)
+        sys.exit(1)
+
+    try:
+        batch.run(args.duration)
+        results = batch.get_results()
+    finally:
+        batch.close()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+
+    log.info('results written to {0}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
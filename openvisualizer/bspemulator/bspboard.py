@@ -39,10 +39,8 @@ class BspBoard(BspModule):
             # log the activity
             self.log.debug('cmd_sleep')
 
-            self.motehandler.cpu_done.release()
-
             # block the mote until CPU is released by ISR
-            self.motehandler.cpu_running.acquire()
+            self.motehandler.cpu_sleep()
 
         except Exception as err:
             self.log.critical(err)
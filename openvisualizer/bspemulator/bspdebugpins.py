@@ -36,6 +36,7 @@ class BspDebugPins(BspModule):
 
         if self.vcdlog:
             self.vcdLogger = vcdlogger.VcdLogger()
+            self.vcdLogger.add_mote(self.motehandler.get_id())
 
     # ======================== public ==========================================
 
@@ -34,7 +34,7 @@ class BspEui64(BspModule):
         my_id = self.motehandler.get_id()
 
         # format my EUI64
-        my_eui64 = [0x14, 0x15, 0x92, 0xcc, 0x00, 0x00, ((my_id >> 8) & 0xff), ((my_id >> 0) & 0xff)]
+        my_eui64 = self.engine.id_manager.get_eui64(my_id)
 
         # log the activity
         if self.log.isEnabledFor(logging.DEBUG):
@@ -29,10 +29,18 @@ class RadioState:
 
 
 class BspRadio(BspModule, EventBusClient):
-    """ Emulates the 'radio' BSP module """
+    """
+    Emulates the 'radio' BSP module
+
+    A frame starts DELAY_TX after radio_txNow. Its start and end are announced to the propagation model right away,
+    which is what lets the shards of a sharded simulation run DELAY_TX ahead of each other.
+    """
 
     _name = 'BspRadio'
 
+    # delay between radio_txNow and the start of the frame, in ns
+    DELAY_TX = 214000
+
     INTR_STARTOFFRAME_MOTE = 'radio.startofframe_fromMote'
     INTR_ENDOFFRAME_MOTE = 'radio.endofframe_fromMote'
     INTR_STARTOFFRAME_PROPAGATION = 'radio.startofframe_fromPropagation'
@@ -54,7 +62,8 @@ class BspRadio(BspModule, EventBusClient):
         self.is_rf_on = False  # radio is off
         self.tx_buf = []
         self.rx_buf = []
-        self.delay_tx = 0.000214
+        self.rx_from = None  # mote whose frame is being received
+        self.delay_tx = self.DELAY_TX
         self.rssi = -50
         self.lqi = 100
         self.crc_passes = True
@@ -187,16 +196,25 @@ class BspRadio(BspModule, EventBusClient):
         self._change_state(RadioState.TRANSMITTING)
 
         # get current time
-        current_time = self.timeline.get_current_time()
+        current_time = self.timeline.get_current_time_ns()
 
         # calculate when the "start of frame" event will take place
         start_of_frame_time = current_time + self.delay_tx
 
+        # the frame and its airtime are known from now on
+        self.propagation.announce_transmission(
+            self.motehandler.get_id(),
+            self.tx_buf,
+            self.frequency,
+            start_of_frame_time,
+            start_of_frame_time + BspRadio._packet_length_to_duration(len(self.tx_buf)),
+        )
+
         # schedule "start of frame" event
-        self.timeline.schedule_event(start_of_frame_time,
-                                     self.motehandler.get_id(),
-                                     self.intr_start_of_frame_from_mote,
-                                     self.INTR_STARTOFFRAME_MOTE)
+        self.timeline.schedule_event_ns(start_of_frame_time,
+                                        self.motehandler.get_id(),
+                                        self.intr_start_of_frame_from_mote,
+                                        self.INTR_STARTOFFRAME_MOTE)
 
     def cmd_rx_enable(self):
         """ Emulates: void radio_rxEnable() """
@@ -258,9 +276,9 @@ class BspRadio(BspModule, EventBusClient):
         )
 
         # schedule the "end of frame" event
-        current_time = self.timeline.get_current_time()
+        current_time = self.timeline.get_current_time_ns()
         end_of_frame_time = current_time + BspRadio._packet_length_to_duration(len(self.tx_buf))
-        self.timeline.schedule_event(
+        self.timeline.schedule_event_ns(
             end_of_frame_time,
             self.motehandler.get_id(),
             self.intr_end_of_frame_from_mote,
@@ -331,30 +349,36 @@ class BspRadio(BspModule, EventBusClient):
             self._change_state(RadioState.RECEIVING)
 
             self.rx_buf = packet
+            self.rx_from = mote_id
+            self.crc_passes = True
 
             # log
             if self.log.isEnabledFor(logging.DEBUG):
                 self.log.debug('rx_buf={0}'.format(self.rx_buf))
 
             # schedule start of frame
-            self.timeline.schedule_event(
-                self.timeline.get_current_time(),
+            self.timeline.schedule_event_ns(
+                self.timeline.get_current_time_ns(),
                 self.motehandler.get_id(),
                 self.intr_start_of_frame_from_propagation,
                 self.INTR_STARTOFFRAME_PROPAGATION,
             )
 
-    def indicate_tx_end(self, mote_id):
+    def indicate_tx_end(self, mote_id, crc_passes=True):
 
         if self.log.isEnabledFor(logging.DEBUG):
-            self.log.debug('indicate_tx_end from mote_id={0}'.format(mote_id))
+            self.log.debug('indicate_tx_end from mote_id={0} crc_passes={1}'.format(mote_id, crc_passes))
 
-        if self.is_initialized and self.state == RadioState.RECEIVING:
+        # the end of another frame (which started while receiving) does not end the reception
+        if self.is_initialized and self.state == RadioState.RECEIVING and mote_id == self.rx_from:
             self._change_state(RadioState.LISTENING)
 
+            self.rx_from = None
+            self.crc_passes = crc_passes
+
             # schedule end of frame
-            self.timeline.schedule_event(
-                self.timeline.get_current_time(),
+            self.timeline.schedule_event_ns(
+                self.timeline.get_current_time_ns(),
                 self.motehandler.get_id(),
                 self.intr_end_of_frame_from_propagation,
                 self.INTR_ENDOFFRAME_PROPAGATION,
@@ -364,7 +388,8 @@ class BspRadio(BspModule, EventBusClient):
 
     @staticmethod
     def _packet_length_to_duration(num_bytes):
-        return float(num_bytes * 8) / 250000.0
+        """ Returns the time needed to send num_bytes at 250kbps, in ns. """
+        return num_bytes * 8 * 1000000000 // 250000
 
     def _change_state(self, new_state):
         self.state = new_state
@@ -56,7 +56,7 @@ class BspSctimer(bspmodule.BspModule):
         overflow_time = self.hw_crystal.get_time_in(self.ROLLOVER)
 
         # schedule overflow event
-        self.timeline.schedule_event(
+        self.timeline.schedule_event_ns(
             at_time=overflow_time,
             mote_id=self.motehandler.get_id(),
             cb=self.intr_overflow,
@@ -97,10 +97,10 @@ class BspSctimer(bspmodule.BspModule):
             compare_time = self.hw_crystal.get_time_in(ticks_before_event)
 
             # schedule compare event
-            self.timeline.schedule_event(compare_time,
-                                         self.motehandler.get_id(),
-                                         self.intr_compare,
-                                         self.INTR_COMPARE)
+            self.timeline.schedule_event_ns(compare_time,
+                                            self.motehandler.get_id(),
+                                            self.intr_compare,
+                                            self.INTR_COMPARE)
 
             # the compare is now scheduled
             self.compare_armed = True
@@ -173,7 +173,7 @@ class BspSctimer(bspmodule.BspModule):
 
         # schedule overflow event
 
-        self.timeline.schedule_event(
+        self.timeline.schedule_event_ns(
             at_time=overflow_time,
             mote_id=self.motehandler.get_id(),
             cb=self.intr_overflow,
@@ -197,7 +197,7 @@ class BspSctimer(bspmodule.BspModule):
         # Note: the intr_overflow will fire every self.ROLLOVER
         next_overflow_time = self.hw_crystal.get_time_in(self.ROLLOVER)
         self.log.debug('next_overflow_time=' + str(next_overflow_time))
-        self.timeline.schedule_event(
+        self.timeline.schedule_event_ns(
             at_time=next_overflow_time,
             mote_id=self.motehandler.get_id(),
             cb=self.intr_overflow,
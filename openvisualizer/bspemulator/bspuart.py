@@ -4,6 +4,7 @@
 # Released under the BSD 3-Clause license as published at the link below.
 # https://openwsn.atlassian.net/wiki/display/OW/License
 
+import Queue
 import logging
 import threading
 
@@ -11,7 +12,18 @@ from openvisualizer.bspemulator.bspmodule import BspModule
 
 
 class BspUart(BspModule):
-    """ Emulates the 'uart' BSP module """
+    """
+    Emulates the 'uart' BSP module
+
+    The bytes written by the mote are gathered until the end of their HDLC frame, and the frame is then handed to the
+    mote probe through a queue, without waiting for it to be read. The frames written to the mote are received as a
+    whole, in one event at the time their last byte has gone through the UART: the RX interrupt is then raised for
+    each of their bytes.
+
+    With a frame handler (set_frame_handler), the frames written by the mote are handed to it right away, in the
+    thread running the mote, instead of going through the queue: what OpenVisualizer receives, and the commands it
+    sends back, then no longer depend on when the mote probe thread runs.
+    """
 
     _name = 'BspUart'
 
@@ -23,6 +35,7 @@ class BspUart(BspModule):
     XON = 0x11
     XONXOFF_ESCAPE = 0x12
     XONXOFF_MASK = 0x10
+    HDLC_FLAG = 0x7e
 
     def __init__(self, motehandler):
         # initialize the parent
@@ -33,15 +46,12 @@ class BspUart(BspModule):
         self.interrupts_enabled = False
         self.tx_interrupt_flag = False
         self.rx_interrupt_flag = False
-        self.uart_rx_buffer = []
-        self.uart_rx_buffer_sem = threading.Semaphore()
-        self.uart_rx_buffer_sem.acquire()
-        self.uart_rx_buffer_lock = threading.Lock()
-        self.uart_tx_buffer = []  # the bytes to be sent over UART
+        self.uart_rx_buffer = []  # the bytes of the frame the mote is writing
+        self.uart_rx_queue = Queue.Queue()  # the frames written by the mote, to be read by the mote probe
+        self.frame_handler = None  # called with each frame written by the mote, instead of queueing it
+        self.uart_tx_buffer = []  # the frames to be sent over UART
         self.uart_tx_next = None  # the byte that was just signaled to mote
         self.uart_tx_buffer_lock = threading.Lock()
-        self.wait_for_done_reading = threading.Lock()
-        self.wait_for_done_reading.acquire()
         self.f_xon_xoff_escaping = False
         self.xon_xoff_escaped_byte = 0
 
@@ -50,40 +60,36 @@ class BspUart(BspModule):
     # === interact with UART
 
     def read(self):
-        """ Read a byte from the mote. """
+        """ Read the bytes written by the mote, waits for at least one frame. """
 
-        # wait for something to appear in the RX buffer
-        self.uart_rx_buffer_sem.acquire()
+        return_val = self.uart_rx_queue.get()
+        while True:
+            try:
+                return_val += self.uart_rx_queue.get_nowait()
+            except Queue.Empty:
+                break
 
-        # copy uart_rx_buffer
-        with self.uart_rx_buffer_lock:
-            assert len(self.uart_rx_buffer) > 0
-            return_val = [chr(b) for b in self.uart_rx_buffer]
-            self.uart_rx_buffer = []
+        return [chr(b) for b in return_val]
 
-        # return that element
-        return return_val
+    def set_frame_handler(self, frame_handler):
+        """ Hands the frames written by the mote to frame_handler (given the bytes, as read returns them). """
+        self.frame_handler = frame_handler
 
     def write(self, bytes_to_write):
-        """ Write a string of bytes to the mote. """
+        """ Write a string of bytes (a frame) to the mote, from any thread. """
 
         assert len(bytes_to_write)
 
-        if len(self.uart_tx_buffer) != 0:
-            return 0
-
         with self.uart_tx_buffer_lock:
-            self.uart_tx_buffer = [ord(b) for b in bytes_to_write]
+            self.uart_tx_buffer.append([ord(b) for b in bytes_to_write])
+            first_frame = len(self.uart_tx_buffer) == 1
 
-        self.engine.pause()
-        self._schedule_next_tx()
-        self.engine.resume()
+        # the reception of the first frame is scheduled by the thread executing the events, the next ones by intr_rx
+        if first_frame:
+            self.timeline.call_soon(self._start_tx)
 
         return len(bytes_to_write)
 
-    def done_reading(self):
-        self.wait_for_done_reading.release()
-
     # === commands
 
     def cmd_init(self):
@@ -147,27 +153,21 @@ class BspUart(BspModule):
         self.tx_interrupt_flag = True
 
         # calculate the time at which the byte will have been sent
-        done_sending_time = self.timeline.get_current_time() + float(1.0 / float(self.BAUDRATE))
+        done_sending_time = self.timeline.get_current_time_ns() + self._duration(1)
 
         # schedule uart TX interrupt in 1/BAUDRATE seconds
-        self.timeline.schedule_event(done_sending_time, self.motehandler.get_id(), self.intr_tx, self.INTR_TX)
+        self.timeline.schedule_event_ns(done_sending_time, self.motehandler.get_id(), self.intr_tx, self.INTR_TX)
 
         if byte_to_write == self.XON or byte_to_write == self.XOFF or byte_to_write == self.XONXOFF_ESCAPE:
             self.f_xon_xoff_escaping = True
             self.xon_xoff_escaped_byte = byte_to_write
             # add to receive buffer
-            with self.uart_rx_buffer_lock:
-                self.uart_rx_buffer += [self.XONXOFF_ESCAPE]
+            self.uart_rx_buffer += [self.XONXOFF_ESCAPE]
         else:
-            # add to receive buffer
-            with self.uart_rx_buffer_lock:
-                self.uart_rx_buffer += [byte_to_write]
-
-        # release the semaphore indicating there is something in RX buffer
-        self.uart_rx_buffer_sem.release()
-
-        # wait for the moteProbe to be done reading
-        self.wait_for_done_reading.acquire()
+            # add to receive buffer, hand the frame to the mote probe once complete
+            self.uart_rx_buffer += [byte_to_write]
+            if byte_to_write == self.HDLC_FLAG and len(self.uart_rx_buffer) > 1:
+                self._flush_rx_buffer()
 
     def cmd_set_cts(self, state):
         """ Emulates: void uart_setCTS(bool state) """
@@ -180,23 +180,13 @@ class BspUart(BspModule):
         self.tx_interrupt_flag = True
 
         # calculate the time at which the byte will have been sent
-        done_sending_time = self.timeline.get_current_time() + float(1.0 / float(self.BAUDRATE))
+        done_sending_time = self.timeline.get_current_time_ns() + self._duration(1)
 
         # schedule uart TX interrupt in 1/BAUDRATE seconds
-        self.timeline.schedule_event(done_sending_time, self.motehandler.get_id(), self.intr_tx, self.INTR_TX)
-
-        # add to receive buffer
-        with self.uart_rx_buffer_lock:
-            if state:
-                self.uart_rx_buffer += [self.XON]
-            else:
-                self.uart_rx_buffer += [self.XOFF]
-
-        # release the semaphore indicating there is something in RX buffer
-        self.uart_rx_buffer_sem.release()
+        self.timeline.schedule_event_ns(done_sending_time, self.motehandler.get_id(), self.intr_tx, self.INTR_TX)
 
-        # wait for the moteProbe to be done reading
-        self.wait_for_done_reading.acquire()
+        # flow control is handed to the mote probe right away
+        self._hand_over([self.XON] if state else [self.XOFF])
 
     def cmd_write_circular_buffer_fastsim(self, buf):
         """ Emulates: void uart_writeCircularBuffer_FASTSIM(uint8_t* buffer, uint8_t len) """
@@ -221,26 +211,20 @@ class BspUart(BspModule):
         self.tx_interrupt_flag = True
 
         # calculate the time at which the buffer will have been sent
-        done_sending_time = self.timeline.get_current_time() + float(float(len(buf)) / float(self.BAUDRATE))
+        done_sending_time = self.timeline.get_current_time_ns() + self._duration(len(buf))
 
         # schedule uart TX interrupt in len(buffer)/BAUDRATE seconds
-        self.timeline.schedule_event(done_sending_time, self.motehandler.get_id(), self.intr_tx, self.INTR_TX)
+        self.timeline.schedule_event_ns(done_sending_time, self.motehandler.get_id(), self.intr_tx, self.INTR_TX)
 
         # add to receive buffer
-        with self.uart_rx_buffer_lock:
-            i = 0
-            while i != len(buf):
-                if buf[i] == self.XON or buf[i] == self.XOFF or buf[i] == self.XONXOFF_ESCAPE:
-                    new_item = (self.XONXOFF_ESCAPE, buf[i] ^ self.XONXOFF_MASK)
-                    buf[i:i + 1] = new_item
-                i += 1
-            self.uart_rx_buffer += buf
-
-        # release the semaphore indicating there is something in RX buffer
-        self.uart_rx_buffer_sem.release()
-
-        # wait for the moteProbe to be done reading
-        self.wait_for_done_reading.acquire()
+        i = 0
+        while i != len(buf):
+            if buf[i] == self.XON or buf[i] == self.XOFF or buf[i] == self.XONXOFF_ESCAPE:
+                new_item = (self.XONXOFF_ESCAPE, buf[i] ^ self.XONXOFF_MASK)
+                buf[i:i + 1] = new_item
+            i += 1
+        self.uart_rx_buffer += buf
+        self._flush_rx_buffer()
 
     def cmd_read_byte(self):
         """ Emulates: uint8_t uart_readByte()"""
@@ -269,20 +253,13 @@ class BspUart(BspModule):
             self.tx_interrupt_flag = True
 
             # calculate the time at which the byte will have been sent
-            done_sending_time = self.timeline.get_current_time() + float(1.0 / float(self.BAUDRATE))
+            done_sending_time = self.timeline.get_current_time_ns() + self._duration(1)
 
             # schedule uart TX interrupt in 1/BAUDRATE seconds
-            self.timeline.schedule_event(done_sending_time, self.motehandler.get_id(), self.intr_tx, self.INTR_TX)
+            self.timeline.schedule_event_ns(done_sending_time, self.motehandler.get_id(), self.intr_tx, self.INTR_TX)
 
             # add to receive buffer
-            with self.uart_rx_buffer_lock:
-                self.uart_rx_buffer += [self.xon_xoff_escaped_byte ^ self.XONXOFF_MASK]
-
-            # release the semaphore indicating there is something in RX buffer
-            self.uart_rx_buffer_sem.release()
-
-            # wait for the moteProbe to be done reading
-            self.wait_for_done_reading.acquire()
+            self.uart_rx_buffer += [self.xon_xoff_escaped_byte ^ self.XONXOFF_MASK]
 
         else:
             # send interrupt to mote
@@ -292,7 +269,7 @@ class BspUart(BspModule):
         return False
 
     def intr_rx(self):
-        """ Interrupt to indicate to mote it received a byte from the UART. """
+        """ Interrupt to indicate to mote it received a frame from the UART, one byte at a time. """
 
         # log the activity
         if self.log.isEnabledFor(logging.DEBUG):
@@ -300,31 +277,52 @@ class BspUart(BspModule):
 
         with self.uart_tx_buffer_lock:
 
-            # make sure there is a byte to TX
+            # make sure there is a frame to TX
             assert len(self.uart_tx_buffer)
 
-            # get the byte that is being transmitted
-            self.uart_tx_next = self.uart_tx_buffer.pop(0)
+            # get the frame that was transmitted
+            frame = self.uart_tx_buffer.pop(0)
 
-            # schedule the next interrupt, if any bytes left
+            # schedule the next interrupt, if any frames left
             if len(self.uart_tx_buffer):
                 self._schedule_next_tx()
 
-        # send RX interrupt to mote
-        self.motehandler.mote.uart_isr_rx()
+        # send an RX interrupt to mote for each byte
+        for byte in frame:
+            self.uart_tx_next = byte
+            self.motehandler.mote.uart_isr_rx()
 
         # do *not* kick the scheduler
         return False
 
     # ======================== private =========================================
 
+    def _duration(self, num_bytes):
+        """ Returns the time needed to send num_bytes, in ns (rounded up). """
+        return -(-num_bytes * self.timeline.NS_PER_S // self.BAUDRATE)
+
+    def _flush_rx_buffer(self):
+        (frame, self.uart_rx_buffer) = (self.uart_rx_buffer, [])
+        self._hand_over(frame)
+
+    def _hand_over(self, frame):
+        if self.frame_handler is not None:
+            self.frame_handler([chr(b) for b in frame])
+        else:
+            self.uart_rx_queue.put(frame)
+
+    def _start_tx(self):
+        with self.uart_tx_buffer_lock:
+            self._schedule_next_tx()
+
     def _schedule_next_tx(self):
+        """ Schedules the reception of the next frame, when its last byte will have gone through the UART. """
 
-        # calculate time at which byte will get out
-        time_next_tx = self.timeline.get_current_time() + float(1.0 / float(self.BAUDRATE))
+        # calculate time at which the frame will get out
+        time_next_tx = self.timeline.get_current_time_ns() + self._duration(len(self.uart_tx_buffer[0]))
 
         # schedule that event
-        self.timeline.schedule_event(
+        self.timeline.schedule_event_ns(
             time_next_tx,
             self.motehandler.get_id(),
             self.intr_rx,
@@ -6,13 +6,19 @@
 # https://openwsn.atlassian.net/wiki/display/OW/License
 
 import logging
-import random
+from fractions import gcd
 
 from openvisualizer.bspemulator.hwmodule import HwModule
 
 
 class HwCrystal(HwModule):
-    """ Emulates the mote's crystal. """
+    """
+    Emulates the mote's crystal.
+
+    Times are integer nanoseconds on the timeline. The period of a tick, drift included, is kept as an exact fraction
+    of nanoseconds (period_num / period_den), computed once per mote: the tick k happens at the first nanosecond at or
+    after ts_tick + k * period, so that timestamps are always aligned to an integer number of ticks and never drift.
+    """
 
     _name = 'HwCrystal'
 
@@ -29,14 +35,17 @@ class HwCrystal(HwModule):
         self.max_drift = self.MAXDRIFT
 
         # local variables
-        self.drift = float(random.uniform(-self.max_drift, self.max_drift))
+        rng = self.engine.get_random('crystal', self.motehandler.get_id())
+        self.drift = float(rng.uniform(-self.max_drift, self.max_drift))
 
-        # the duration of one tick. Since it is constant, it is only calculated once by _getPeriod(). Therefore, do not
-        # use directly, rather use property period
-        self._period = None
+        # the duration of one tick in ns, drift included, as the fraction period_num / period_den
+        self.period_num = int(round(self.timeline.NS_PER_S * (1000000 + self.drift)))
+        self.period_den = self.frequency * 1000000
+        divisor = gcd(self.period_num, self.period_den)
+        self.period_num //= divisor
+        self.period_den //= divisor
 
-        # ts_tick is a timestamp associated with any tick in the past. Since the period is constant, it is used to
-        # ensure alignement of timestamps to an integer number of ticks.
+        # ts_tick is the timestamp of the tick 0, when the crystal started. All the ticks are counted from it.
         self.ts_tick = None
 
     # ======================== public ==========================================
@@ -44,8 +53,8 @@ class HwCrystal(HwModule):
     def start(self):
         """ Start the crystal. """
 
-        # get the timestamp of a
-        self.ts_tick = self.timeline.get_current_time()
+        # get the timestamp of the first tick
+        self.ts_tick = self.timeline.get_current_time_ns()
 
         # log
         if self.log.isEnabledFor(logging.DEBUG):
@@ -53,9 +62,9 @@ class HwCrystal(HwModule):
 
     def get_time_last_tick(self):
         """
-        Return the timestamp of the last tick.
+        Return the timestamp of the last tick (the nearest one).
 
-        :returns: The timestamp of the last tick.
+        :returns: The timestamp of the last tick, in ns.
         """
 
         '''
@@ -76,22 +85,14 @@ class HwCrystal(HwModule):
         # make sure crystal has been started
         assert self.ts_tick is not None
 
-        current_time = self.timeline.get_current_time()
-        time_since_last = current_time - self.ts_tick
-
-        ticks_since_last = round(float(time_since_last) / float(self.period))
-        time_last_tick = self.ts_tick + ticks_since_last * self.period
-
-        self.ts_tick = time_last_tick
-
-        return time_last_tick
+        return self._tick_time(self._tick(self.timeline.get_current_time_ns()))
 
     def get_time_in(self, num_ticks):
         """
         Return the time it will be in a given number of ticks.
 
         :param num_ticks: The number of ticks of interest.
-        :returns: The time it will be in a given number of ticks.
+        :returns: The time it will be in a given number of ticks, in ns.
         """
 
         '''
@@ -114,15 +115,13 @@ class HwCrystal(HwModule):
         assert self.ts_tick is not None
         assert num_ticks >= 0
 
-        time_last_tick = self.get_time_last_tick()
-
-        return time_last_tick + num_ticks * self.period
+        return self._tick_time(self._tick(self.timeline.get_current_time_ns()) + num_ticks)
 
     def get_ticks_since(self, event_time):
         """
         Return the number of ticks since some timestamp.
 
-        :param event_time: The time of the event of interest.
+        :param event_time: The time of the event of interest, in ns.
         :returns: The number of ticks since the time passed.
         """
 
@@ -145,29 +144,20 @@ class HwCrystal(HwModule):
         assert self.ts_tick is not None
 
         # get the current time
-        current_time = self.timeline.get_current_time()
+        current_time = self.timeline.get_current_time_ns()
 
         # make sure that event_time passed is in the past
         assert (event_time <= current_time)
 
-        # get the time of the last tick
-        time_last_tick = self.get_time_last_tick()
-
         # return the number of ticks
-        if time_last_tick < event_time:
-            return_val = 0
-        else:
-            return_val = int(float(time_last_tick - event_time) / float(self.period))
-
-        return return_val
+        return max(self._tick(current_time) - self._tick(event_time), 0)
 
     # ======================== private =========================================
 
-    @property
-    def period(self):
-
-        if self._period is None:
-            self._period = float(1) / float(self.frequency)  # nominal period
-            self._period += float(self.drift / 1000000.0) * float(self._period)  # apply drift
+    def _tick(self, ts):
+        """ Returns the number of the tick nearest to a timestamp. """
+        return ((ts - self.ts_tick) * 2 * self.period_den + self.period_num) // (2 * self.period_num)
 
-        return self._period
+    def _tick_time(self, tick):
+        """ Returns the timestamp of a tick, the first nanosecond at or after it. """
+        return self.ts_tick + -(-tick * self.period_num // self.period_den)
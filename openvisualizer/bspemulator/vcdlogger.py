@@ -1,13 +1,28 @@
 import os
+import shutil
 import threading
 
 
 class VcdLogger(object):
+    """
+    Logs the debug pins of the emulated motes to a VCD file.
+
+    The variables of all the motes created before the first pin toggle (BspDebugPins registers its mote with
+    add_mote) are declared in the header, which is written along with that first toggle; the value changes are then
+    streamed to the file through a large buffer. Only a mote added later requires the file to be rewritten, to insert
+    its variables in the header. The identifiers of the variables are made of as many printable characters as needed.
+    """
+
     ACTIVITY_DUR = 1000  # 1000ns=1us
     FILENAME = 'debugpins.vcd'
     FILENAME_SWAP = 'debugpins.vcd.swap'
     ENDVAR_LINE = '$upscope $end\n'
     ENDDEF_LINE = '$enddefinitions $end\n'
+    BUFFER_SIZE = 1024 * 1024
+
+    # printable characters allowed in identifiers
+    ID_FIRST_CHAR = ord('!')
+    ID_NUM_CHARS = ord('~') - ord('!') + 1
 
     # ======================== singleton pattern ===============================
 
@@ -31,24 +46,12 @@ class VcdLogger(object):
         self._init = True
 
         # local variables
-        self.f = open(self.FILENAME, 'w')
+        self.f = None  # opened with the first value change
         self.sig_name = {}
         self.last_ts = {}
-        self.data_lock = threading.RLock()
-        self.enabled = False
-        self.sig_char = ord('!')
-
-        # create header
-        header = []
-        header += ['$timescale 1ns $end\n']
-        header += ['$scope module logic $end\n']
-        # variables will be declared here by self._addMote()
-        header += [self.ENDVAR_LINE]
-        header += [self.ENDDEF_LINE]
-        header = ''.join(header)
-
-        # write header
-        self.f.write(header)
+        self.data_lock = threading.Lock()
+        self.enabled = True
+        self.num_sigs = 0
 
     # ======================== public ==========================================
 
@@ -58,43 +61,55 @@ class VcdLogger(object):
         with self.data_lock:
             self.enabled = enabled
 
+    def add_mote(self, mote):
+        """ Declares the variables of a mote, so that they are part of the header. """
+
+        with self.data_lock:
+            if mote not in self.sig_name:
+                self._add_mote(mote)
+
     def log(self, ts, mote, signal, state):
 
         assert signal in self.SIGNAMES
         assert state in [True, False]
 
-        # stop here if not enables
         with self.data_lock:
+
+            # stop here if not enables
             if not self.enabled:
                 return
 
-        # translate state to val
-        if state:
-            val = 1
-        else:
-            val = 0
-
-        with self.data_lock:
-
             # add mote if needed
             if mote not in self.sig_name:
                 self._add_mote(mote)
 
+            if self.f is None:
+                self._write_header()
+
             # format
-            output = []
             ts_temp = int(ts * 1000000) * 1000
-            if ((mote, signal) in self.last_ts) and self.last_ts[(mote, signal)] == ts:
+            if self.last_ts.get((mote, signal)) == ts:
                 ts_temp += self.ACTIVITY_DUR
-            output += ['#{0}\n'.format(ts_temp)]
-            output += ['{0}{1}\n'.format(val, self.sig_name[mote][signal])]
-            output = ''.join(output)
 
             # write
-            self.f.write(output)
+            self.f.write('#{0}\n{1}{2}\n'.format(ts_temp, 1 if state else 0, self.sig_name[mote][signal]))
 
             # remember ts
             self.last_ts[(mote, signal)] = ts
 
+    def flush(self):
+        """ Writes the buffered value changes to the file. """
+
+        with self.data_lock:
+            if self.f is not None:
+                self.f.flush()
+
+    def close(self):
+        with self.data_lock:
+            if self.f is not None:
+                self.f.close()
+                self.f = None
+
     # ======================== private =========================================
 
     def _add_mote(self, mote):
@@ -103,37 +118,67 @@ class VcdLogger(object):
         # === populate sig_name
         self.sig_name[mote] = {}
         for signal in self.SIGNAMES:
-            self.sig_name[mote][signal] = chr(self.sig_char)
-            self.sig_char += 1
+            self.sig_name[mote][signal] = self._identifier(self.num_sigs)
+            self.num_sigs += 1
+
+        # the header was written already, insert the variables
+        if self.f is not None:
+            self._insert_mote(mote)
+
+    def _identifier(self, index):
+        """ Returns the identifier of the index-th variable: '!' to '~', then '!!' and so on. """
+
+        identifier = ''
+        while True:
+            identifier = chr(self.ID_FIRST_CHAR + index % self.ID_NUM_CHARS) + identifier
+            index = index // self.ID_NUM_CHARS - 1
+            if index < 0:
+                return identifier
+
+    def _declarations(self, motes):
+        return ''.join(['$var wire 1 {0} {1}_{2} $end\n'.format(self.sig_name[mote][signal], mote, signal)
+                        for mote in motes for signal in self.SIGNAMES])
+
+    def _initial_values(self, motes):
+        return '#0\n' + ''.join(['0{0}\n'.format(self.sig_name[mote][signal])
+                                 for mote in motes for signal in self.SIGNAMES])
+
+    def _write_header(self):
+        motes = sorted(self.sig_name)
+
+        header = []
+        header += ['$timescale 1ns $end\n']
+        header += ['$scope module logic $end\n']
+        header += [self._declarations(motes)]
+        header += [self.ENDVAR_LINE]
+        header += [self.ENDDEF_LINE]
+        header += [self._initial_values(motes)]
+
+        self.f = open(self.FILENAME, 'w', self.BUFFER_SIZE)
+        self.f.write(''.join(header))
+
+    def _insert_mote(self, mote):
+        """ Rewrites the file, with the variables of a mote added to the header. """
 
         # === close FILENAME
         self.f.close()
 
         # === FILENAME -> FILENAME_SWAP
-        fswap = open(self.FILENAME_SWAP, 'w')
-        for line in open(self.FILENAME, 'r'):
-            # declare variables
-            if line == self.ENDVAR_LINE:
-                for signal in self.SIGNAMES:
-                    fswap.write(
-                        '$var wire 1 {0} {1}_{2} $end\n'.format(
-                            self.sig_name[mote][signal],
-                            mote,
-                            signal,
-                        ),
-                    )
-            # print line
-            fswap.write(line)
-            # initialize variables
-            if line == self.ENDDEF_LINE:
-                for signal in self.SIGNAMES:
-                    fswap.write('#0\n')
-                    fswap.write('0{0}\n'.format(self.sig_name[mote][signal]))
-        fswap.close()
+        with open(self.FILENAME, 'r', self.BUFFER_SIZE) as f, open(self.FILENAME_SWAP, 'w', self.BUFFER_SIZE) as fswap:
+            for line in iter(f.readline, ''):
+                # declare variables
+                if line == self.ENDVAR_LINE:
+                    fswap.write(self._declarations([mote]))
+                # print line
+                fswap.write(line)
+                # initialize variables, then copy the value changes as they are
+                if line == self.ENDDEF_LINE:
+                    fswap.write(self._initial_values([mote]))
+                    shutil.copyfileobj(f, fswap, self.BUFFER_SIZE)
 
         # === FILENAME_SWAP -> FILENAME
         os.remove(self.FILENAME)
         os.rename(self.FILENAME_SWAP, self.FILENAME)
 
         # === re-open FILENAME
-        self.f = open(self.FILENAME, 'a')
+        self.f = open(self.FILENAME, 'a', self.BUFFER_SIZE)
@@ -343,6 +343,16 @@ def neighbors(proxy, mote, refresh_rate):
     start_view(proxy, mote, refresh_rate)
 
 
+@click.command()
+@click.option('--refresh-rate', default=1.0, help='Set the refresh rate of the view (in seconds)', type=float,
+              show_default=True)
+@click.argument("mote", nargs=1, type=str, required=False, default='all')
+@pass_proxy
+def daostats(proxy, mote, refresh_rate):
+    """Per-node DAO statistics (loss, inter-arrival time, parent changes and route depth)."""
+    start_view(proxy, mote, refresh_rate)
+
+
 cli.add_command(shutdown)
 # cli.add_command(list_methods)
 cli.add_command(wireshark_debug)
@@ -357,4 +367,5 @@ view.add_command(schedule)
 view.add_command(motestatus)
 view.add_command(msf)
 view.add_command(neighbors)
+view.add_command(daostats)
 view.add_command(web)
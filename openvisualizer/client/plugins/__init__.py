@@ -1,5 +1,6 @@
 # import all the view plugins
 
+from . import daostats      # noqa: F401
 from . import macstats      # noqa: F401
 from . import motestatus    # noqa: F401
 from . import msf           # noqa: F401
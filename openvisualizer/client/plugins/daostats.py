@@ -0,0 +1,72 @@
+from __future__ import print_function
+
+import logging
+
+from openvisualizer.client.plugins.plugin import Plugin
+from openvisualizer.client.view import View
+
+
+@Plugin.record_view("daostats")
+class DaoStats(View):
+    def __init__(self, proxy, mote_id, refresh_rate):
+        super(DaoStats, self).__init__(proxy, mote_id, refresh_rate)
+
+        self.title = 'daostats'
+
+        # the last group of the node addresses, in hexadecimal
+        self.node_id = None
+        if self.mote_id != 'all':
+            try:
+                self.node_id = int(self.mote_id, 16)
+            except ValueError:
+                self.error_msg = "Invalid mote '{}', give the end of its address in hexadecimal or 'all'".format(
+                    self.mote_id)
+                self.close()
+
+    def fetch(self):
+        return self.rpc_server.get_dao_stats()
+
+    def render(self, ms=None):
+        super(DaoStats, self).render()
+
+        yb = self.term.bold_yellow
+        n = self.term.normal
+
+        nodes = sorted(ms.items(), key=lambda item: int(item[0].split(':')[-1], 16))
+        if self.node_id is not None:
+            nodes = [(node, stats) for node, stats in nodes if int(node.split(':')[-1], 16) == self.node_id]
+
+        if len(nodes) == 0:
+            print(self.term.red_bold + 'No DAO received yet' + self.term.normal)
+            return
+
+        header = '|{:^22s}|{:^8s}|{:^8s}|{:^8s}|{:^10s}|{:^10s}|{:^10s}|{:^9s}|{:^10s}|{:^7s}|'.format(
+            'NODE', 'RX', 'MISSED', 'LOSS', 'W-LOSS', 'IAT AVG', 'IAT MAX', 'PAR. CHG', 'CHG/HOUR', 'DEPTH')
+        line = ''.join(['-'] * len(header))
+
+        print(line)
+        print(yb + header + n)
+        print(line)
+
+        for node, stats in nodes:
+            inter_arrival = stats['inter_arrival']
+            print('|{:^22s}|{:^8d}|{:^8d}|{:^8s}|{:^10s}|{:^10s}|{:^10s}|{:^9d}|{:^10s}|{:^7s}|'.format(
+                node,
+                stats['rx'],
+                stats['missed'],
+                '{:.1%}'.format(stats['loss']),
+                '{:.1%}'.format(stats['window_loss']),
+                '{:.1f}s'.format(inter_arrival['avg']) if inter_arrival else '-',
+                '{:.1f}s'.format(inter_arrival['max']) if inter_arrival else '-',
+                stats['parent_changes'],
+                '{:.2f}'.format(stats['parent_change_rate']) if stats['parent_change_rate'] is not None else '-',
+                str(stats['depth']) if stats['depth'] is not None else '-',
+            ))
+
+        print(line)
+
+    def run(self):
+        logging.debug("Enabling blessed fullscreen")
+        with self.term.fullscreen(), self.term.cbreak(), self.term.hidden_cursor():
+            super(DaoStats, self).run()
+        logging.debug("Exiting blessed fullscreen")
@@ -30,7 +30,7 @@ class View(threading.Thread):
     def run(self):
         while not self.quit:
             try:
-                mote_state = self.rpc_server.get_mote_state(self.mote_id)
+                mote_state = self.fetch()
             except Fault as err:
                 logging.error("Caught fault from server")
                 self.close()
@@ -50,6 +50,10 @@ class View(threading.Thread):
 
         logging.info("Returning from thread")
 
+    def fetch(self):
+        """ Retrieves the data to render from the server. """
+        return self.rpc_server.get_mote_state(self.mote_id)
+
     @abstractmethod
     def render(self, ms=None):
         print(self.term.home + self.term.clear())
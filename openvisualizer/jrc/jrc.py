@@ -10,6 +10,8 @@ import binascii
 import logging.handlers
 import os
 import threading
+import time
+from collections import OrderedDict, deque
 
 import cbor
 import json
@@ -32,20 +34,148 @@ log.addHandler(logging.NullHandler())
 class JRC(object):
     def __init__(self):
         coap_resource = JoinResource()
-        self.coap_server = CoapServer(coap_resource, ContextHandler(coap_resource).security_context_lookup)
+        self.context_handler = ContextHandler(coap_resource)
+        self.coap_server = CoapServer(coap_resource, self.context_handler.security_context_lookup)
 
     def close(self):
         self.coap_server.close()
+        self.context_handler.close()
+
+    def get_stats(self):
+        """ Returns the join statistics and the state of the OSCORE context cache. """
+        stats = self.coap_server.coap_resource.get_stats()
+        stats.update(self.context_handler.get_stats())
+        return stats
 
 
 # ======================== Security Context Handler =========================
+class WriteBehindSecurityContext(Oscoap.SecurityContext):
+    """
+    OSCORE security context which keeps its replay window in memory, and reserves its sequence numbers in blocks.
+
+    The default security context rewrites its JSON file on every request and response. This one only marks itself as
+    dirty when its replay window changes, the ContextHandler writes it back to disk periodically, on eviction from its
+    cache and when closing. The sequence numbers are reserved SEQUENCE_NUMBER_BLOCK at a time: the end of a block is
+    written to disk before any of its numbers is used, so a context reloaded after a crash never reuses a sequence
+    number (and thus an AEAD nonce).
+
+    The replay window is not protected this way: the changes since the last write (at most FLUSH_PERIOD seconds of
+    ContextHandler) are lost if the process crashes, and a request replayed within that window is then accepted again
+    after a restart.
+    """
+
+    # number of sequence numbers reserved (and written to disk) at once
+    SEQUENCE_NUMBER_BLOCK = 64
+
+    def __init__(self, securityContextFilePath):  # noqa: N803
+        Oscoap.SecurityContext.__init__(self, securityContextFilePath)
+        self.dirty = False
+
+        # last sequence number used, the context (and its file) holds the end of the reserved block
+        self.sequence_number = self.securityContext['sequenceNumber']
+
+    def replayWindowUpdate(self, sequenceNumber, reset=False):  # noqa: N802, N803
+        # same update as the parent, without writing the context to its file: this is left to persist()
+        assert sequenceNumber > min(self.securityContext['replayWindow'])
+        assert sequenceNumber not in self.securityContext['replayWindow']
+
+        with self.lock:
+            replay_window = self.securityContext['replayWindow']
+            if len(replay_window) == self.REPLAY_WINDOW_SIZE:
+                replay_window.remove(min(replay_window))
+
+            if reset is False:
+                replay_window.append(sequenceNumber)
+            else:
+                self.securityContext['replayWindow'] = [sequenceNumber]
+            self.dirty = True
+
+    def getSequenceNumber(self):  # noqa: N802
+        with self.lock:
+            if self.sequence_number >= self.securityContext['sequenceNumber']:
+                self._reserve_sequence_numbers()
+            self.sequence_number += 1
+            return self.sequence_number
+
+    def persist(self):
+        """ Write the context back to its file, if it changed since it was last written. """
+        with self.lock:
+            if not self.dirty:
+                return
+
+            # written under the lock, so that an older state never overwrites a reserved block of sequence numbers
+            try:
+                with open(self.securityContextFilePath, "w") as context_file:
+                    json.dump(self.securityContext, context_file, indent=4, sort_keys=True)
+                self.dirty = False
+            except IOError as err:
+                log.error("could not persist OSCORE context {0}: {1}".format(self.securityContextFilePath, err))
+
+    def _reserve_sequence_numbers(self):
+        reserved = self.securityContext['sequenceNumber']
+        block = min(self.SEQUENCE_NUMBER_BLOCK, self.aeadAlgorithm.maxSequenceNumber - reserved)
+
+        # the parent increments the sequence number, checks it against the maximum and writes the context through
+        self.securityContext['sequenceNumber'] += max(block - 1, 0)
+        try:
+            Oscoap.SecurityContext.getSequenceNumber(self)
+        except Exception:
+            self.securityContext['sequenceNumber'] = reserved
+            raise
+        self.dirty = False
+
+
 class ContextHandler(object):
     # value of the OSCORE Master Secret from 6TiSCH TD
     master_secret = "DEADBEEFCAFEDEADBEEFCAFEDEADBEEF"
     master_salt = ""
 
+    # maximum number of OSCORE contexts kept in memory
+    CONTEXT_CACHE_SIZE = 1024
+
+    # period (in seconds) at which modified contexts are written back to disk
+    FLUSH_PERIOD = 5
+
     def __init__(self, join_resource):
         self.join_resource = join_resource
+        self.join_resource.context_handler = self
+
+        # LRU cache of security contexts, indexed by EUI64
+        self.contexts = OrderedDict()
+        self.contexts_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        # write modified contexts back to disk in the background
+        self.go_on = threading.Event()
+        self.flush_thread = threading.Thread(target=self._flush_loop, name='ContextHandlerFlush')
+        self.flush_thread.daemon = True
+        self.flush_thread.start()
+
+    def close(self):
+        self.go_on.set()
+        self.flush_thread.join()
+        self.flush()
+
+    def flush(self):
+        """ Write all modified security contexts to disk. """
+        with self.contexts_lock:
+            contexts = self.contexts.values()
+
+        for context in contexts:
+            context.persist()
+
+    def add_context(self, eui64, context):
+        """ Cache the security context of a node which joined, called by the join resource. """
+        self._cache_context(eui64, context, replace=True)
+
+    def get_stats(self):
+        with self.contexts_lock:
+            return {
+                'cached_contexts': len(self.contexts),
+                'context_cache_hits': self.cache_hits,
+                'context_cache_misses': self.cache_misses,
+            }
 
     # ======================== Context Handler needs to be registered =============================
     def security_context_lookup(self, kid, kid_context):
@@ -54,30 +184,39 @@ class ContextHandler(object):
         sender_id = "JRC"
         recipient_id = ""
 
-        # if eui-64 is found in the list of joined nodes, return the appropriate context
-        # this is important for replay protection
-        for dictionary in self.join_resource.joinedNodes:
-            if dictionary['eui64'] == eui64:
-                try:
-                    log.verbose("Node {0} found in joinedNodes. Returning context {1}.".format(
-                        format_ipv6_addr(dictionary['eui64']), str(dictionary['context'])))
-                except TypeError:
-                    log.error("Type-error in conversion of {}".format(dictionary['eui64']))
-
-                return dictionary['context']
-
-        # if eui-64 is not found, create a new tentative context but only add it to the list of joined nodes in the GET
-        # handler of the join resource
+        self.join_resource.indicate_join_request(eui64)
+
         file_path = os.path.abspath(os.path.join(user_data_dir('openvisualizer'), "oscore_context_{0}.json".
                                                  format(binascii.hexlify(eui64))))
+
+        # if eui-64 is found in the cache, return the appropriate context
+        # this is important for replay protection
+        with self.contexts_lock:
+            context = self.contexts.pop(eui64, None)
+            if context is not None:
+                self.contexts[eui64] = context
+                self.cache_hits += 1
+                return context
+            self.cache_misses += 1
+
+        if self.join_resource.is_joined(eui64):
+            # joined node whose context was evicted from the cache, reload its persisted state
+            log.verbose("Node {0} found in joinedNodes. Loading context from {1}.".format(
+                binascii.hexlify(eui64), file_path))
+            context = WriteBehindSecurityContext(securityContextFilePath=file_path)
+            return self._cache_context(eui64, context, replace=False)
+
+        # if eui-64 is not found, create a new tentative context but only add it to the cache in the POST handler of the
+        # join resource, once the node joined (a pledge restarting its join gets a fresh context)
         if not os.path.exists(os.path.dirname(file_path)):
             os.makedirs(os.path.dirname(file_path))
 
         log.verbose("New node: {0}. Creating new OSCORE context in {1}.".
                     format(format_ipv6_addr(Utils.str2buf(eui64)), file_path))
 
-        # FIXME: until persistency is implemented in firmware, we need to overwrite the security context for each run
-        # FIXME: this is a security issue as AEAD nonces get reused and should not be used in a production environment
+        # FIXME: until persistency is implemented in firmware, we need to overwrite the security context for each
+        # FIXME: run, this is a security issue as AEAD nonces get reused and should not be used in a production
+        # FIXME: environment
         self.security_context_create_overwrite(file_path,
                                                binascii.hexlify(eui64),
                                                self.master_salt,
@@ -85,9 +224,7 @@ class ContextHandler(object):
                                                binascii.hexlify(sender_id),
                                                binascii.hexlify(recipient_id))
 
-        context = Oscoap.SecurityContext(securityContextFilePath=file_path)
-
-        return context
+        return WriteBehindSecurityContext(securityContextFilePath=file_path)
 
     # create and return a security context file
     @staticmethod
@@ -107,12 +244,34 @@ class ContextHandler(object):
         with open(file_path, "w") as context_file:
             json.dump(ctx_dict, context_file, indent=4, sort_keys=True)
 
+    def _cache_context(self, eui64, context, replace):
+        evicted = []
+        with self.contexts_lock:
+            if replace:
+                self.contexts.pop(eui64, None)
+            # another request from the same node may have raced us, keep the context already in the cache
+            context = self.contexts.setdefault(eui64, context)
+            while len(self.contexts) > self.CONTEXT_CACHE_SIZE:
+                evicted += [self.contexts.popitem(last=False)[1]]
+
+        for evicted_context in evicted:
+            evicted_context.persist()
+
+        return context
+
+    def _flush_loop(self):
+        while not self.go_on.wait(self.FLUSH_PERIOD):
+            self.flush()
+
 
 # ======================== Interface with OpenVisualizer ======================================
 class CoapServer(EventBusClient):
     # link-local prefix
     LINK_LOCAL_PREFIX = [0xfe, 0x80, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
 
+    # CoAP client sessions unused for this long (in seconds) are closed
+    SESSION_IDLE_TIMEOUT = 60
+
     def __init__(self, coap_resource, context_handler=None):
         # log
         log.debug("create instance")
@@ -126,7 +285,8 @@ class CoapServer(EventBusClient):
         self.coap_server.addSecurityContextHandler(context_handler)
         self.coap_server.maxRetransmit = 1
 
-        self.coap_client = None
+        # CoAP client session of each mote, indexed by the mote's IPv6 address
+        self.sessions = {}
 
         self.dagroot_eui64 = None
 
@@ -157,11 +317,25 @@ class CoapServer(EventBusClient):
         # local variables
         self.stateLock = threading.Lock()
 
+        # close the idle sessions (and their sockets) in the background
+        self.go_on = threading.Event()
+        self.purge_thread = threading.Thread(target=self._purge_loop, name='CoapServerPurge')
+        self.purge_thread.daemon = True
+        self.purge_thread.start()
+
     # ======================== public ==========================================
 
     def close(self):
-        # nothing to do
-        pass
+        self.go_on.set()
+        self.purge_thread.join()
+
+        with self.stateLock:
+            sessions = self.sessions.values()
+            self.sessions = {}
+
+        for session in sessions:
+            session.close()
+        self.coap_server.close()
 
     # ======================== private =========================================
 
@@ -224,36 +398,64 @@ class CoapServer(EventBusClient):
     def _receive_from_mesh(self, sender, signal, data):
         """
         Receive packet from the mesh destined for jrc's CoAP server.
-        Forwards the packet to the virtual CoAP server running in test mode (PyDispatcher).
+        Forwards the packet to the virtual CoAP server running in test mode (PyDispatcher), through the CoAP client
+        session of the sending mote.
         """
 
-        sender = format_ipv6_addr(data[0])
-        # FIXME pass source port within the signal and open coap client at this port
-        self.coap_client = \
-            coap.coap(ipAddress=sender, udpPort=Defs.DEFAULT_UDP_PORT, testing=True,
-                      receiveCallback=self._receive_from_coap)
+        session = self._get_session(format_ipv6_addr(data[0]))
         # low level forward of the CoAP message
-        self.coap_client.socketUdp.sendUdp(destIp='', destPort=Defs.DEFAULT_UDP_PORT, msg=data[1])
+        session.client.socketUdp.sendUdp(destIp='', destPort=Defs.DEFAULT_UDP_PORT, msg=data[1])
         return True
 
-    def _receive_from_coap(self, timestamp, sender, data):
+    def _get_session(self, ip_address):
+        """ Returns the CoAP client session of a mote, creating it if needed. """
+
+        with self.stateLock:
+            session = self.sessions.get(ip_address)
+            if session is None:
+                # FIXME pass source port within the signal and open coap client at this port
+                session = CoapSession(ip_address, self._receive_from_coap)
+                self.sessions[ip_address] = session
+            session.last_used = time.time()
+
+        return session
+
+    def _purge_sessions(self):
+        """ Closes the sessions unused for more than SESSION_IDLE_TIMEOUT. """
+
+        now = time.time()
+        expired = []
+
+        with self.stateLock:
+            for (addr, session) in self.sessions.items():
+                if now - session.last_used > self.SESSION_IDLE_TIMEOUT:
+                    expired += [self.sessions.pop(addr)]
+
+        for session in expired:
+            log.debug("closing idle CoAP session of {0}".format(session.ip_address))
+            session.close()
+
+    def _purge_loop(self):
+        while not self.go_on.wait(self.SESSION_IDLE_TIMEOUT / 2):
+            self._purge_sessions()
+
+    def _receive_from_coap(self, session, sender, data):
         """
         Receive CoAP response and forward it to the mesh network.
         Appends UDP and IPv6 headers to the CoAP message and forwards it on the Eventbus towards the mesh.
         """
-        self.coap_client.close()
 
         # UDP
         udp_len = len(data) + 8
 
         udp = Utils.int2buf(sender[1], 2)  # src port
-        udp += Utils.int2buf(self.coap_client.udpPort, 2)  # dest port
+        udp += Utils.int2buf(session.client.udpPort, 2)  # dest port
         udp += [udp_len >> 8, udp_len & 0xff]  # length
         udp += [0x00, 0x00]  # checksum
         udp += data
 
         # destination address of the packet is CoAP client's IPv6 address (address of the mote)
-        dst_ipv6_address = Utils.ipv6AddrString2Bytes(self.coap_client.ipAddress)
+        dst_ipv6_address = session.ipv6_address
         assert len(dst_ipv6_address) == 16
         # source address of the packet is DAG root's IPV6 address
         # use the same prefix (link-local or global) as in the destination address
@@ -285,10 +487,46 @@ class CoapServer(EventBusClient):
         self.dispatch(signal='v6ToMesh', data=ip)
 
 
+class CoapSession(object):
+    """
+    CoAP client through which the requests of a single mote are relayed to the JRC's CoAP server.
+
+    A session is kept open for as long as the mote talks to the JRC, so that consecutive requests do not need to
+    recreate a CoAP client (and its socket and thread). Each session has its own client address, so concurrent joins
+    from different motes never share state.
+    """
+
+    def __init__(self, ip_address, callback):
+        self.ip_address = ip_address
+        self.ipv6_address = Utils.ipv6AddrString2Bytes(ip_address)
+        self.callback = callback
+        self.last_used = time.time()
+        self.client = coap.coap(ipAddress=ip_address, udpPort=Defs.DEFAULT_UDP_PORT, testing=True,
+                                receiveCallback=self._receive)
+
+    def close(self):
+        self.client.close()
+
+    def _receive(self, timestamp, sender, data):
+        self.callback(self, sender, data)
+
+
 # ==================== Implementation of CoAP join resource =====================
 class JoinResource(coapResource.coapResource):
+    # number of join latencies kept for the statistics
+    LATENCY_WINDOW = 256
+
     def __init__(self):
-        self.joinedNodes = []
+        # registry of joined nodes, indexed by EUI64
+        self.joinedNodes = {}
+        self.join_requests = {}
+        self.join_latencies = deque(maxlen=self.LATENCY_WINDOW)
+        self.join_count = 0
+        self.rejoin_count = 0
+        self.stats_lock = threading.Lock()
+
+        # set by the ContextHandler, which caches the security contexts of the joined nodes
+        self.context_handler = None
 
         self.networkKey = Utils.str2buf(os.urandom(16))  # random key every time OpenVisualizer is initialized
         self.networkKeyIndex = 0x01  # L2 key index
@@ -298,6 +536,36 @@ class JoinResource(coapResource.coapResource):
 
         self.addSecurityBinding((None, [Defs.METHOD_POST]))  # security context should be returned by the callback
 
+    def is_joined(self, eui64):
+        with self.stats_lock:
+            return eui64 in self.joinedNodes
+
+    def indicate_join_request(self, eui64):
+        """ Record the reception time of the first join request of a node, called when its context is looked up. """
+        now = time.time()
+        with self.stats_lock:
+            self.join_requests.setdefault(eui64, now)
+
+    def get_stats(self):
+        with self.stats_lock:
+            latencies = list(self.join_latencies)
+            stats = {
+                'joined_nodes': len(self.joinedNodes),
+                'joins': self.join_count,
+                'rejoins': self.rejoin_count,
+            }
+
+        if latencies:
+            stats['join_latency'] = {
+                'min': min(latencies),
+                'max': max(latencies),
+                'avg': sum(latencies) / len(latencies),
+            }
+        else:
+            stats['join_latency'] = None
+
+        return stats
+
     def POST(self, options=[], payload=[]):  # noqa: N802
 
         log.verbose("received JRC join request")
@@ -313,21 +581,24 @@ class JoinResource(coapResource.coapResource):
         object_security = Oscoap.objectSecurityOptionLookUp(options)
 
         if object_security:
-            # we need to add the pledge to a list of joined nodes, if not present already
+            # we need to add the pledge to the registry of joined nodes, if not present already
             eui64 = Utils.buf2str(object_security.kidContext)
-            found = False
-            for node in self.joinedNodes:
-                if node['eui64'] == eui64:
-                    found = True
-                    break
-
-            if not found:
-                self.joinedNodes += [
-                    {
-                        'eui64': eui64,  # remove last prepended byte
-                        'context': object_security.context,
-                    },
-                ]
+            now = time.time()
+
+            with self.stats_lock:
+                if eui64 in self.joinedNodes:
+                    self.rejoin_count += 1
+                else:
+                    self.join_count += 1
+                self.joinedNodes[eui64] = {'joined': now}
+
+                # from the first join request of the node
+                started = self.join_requests.pop(eui64, None)
+                if started is not None:
+                    self.join_latencies.append(now - started)
+
+            if self.context_handler is not None:
+                self.context_handler.add_context(eui64, object_security.context)
 
             # return the Join Response regardless of whether it is a first or Nth join attempt
             return Defs.COAP_RC_2_04_CHANGED, [], resp_payload
@@ -28,6 +28,7 @@ import verboselogs
 from iotlabcli.parser import common
 
 from openvisualizer import PACKAGE_NAME, WINDOWS_COLORS, UNIX_COLORS, DEFAULT_LOGGING_CONF, APPNAME
+from openvisualizer.bspemulator import vcdlogger
 from openvisualizer.eventbus import eventbusmonitor
 from openvisualizer.eventbus.eventbusclient import EventBusClient
 from openvisualizer.jrc import jrc
@@ -121,7 +122,8 @@ class OpenVisualizerServer(SimpleXMLRPCServer, EventBusClient):
     def __init__(self, host, port, simulator_mode, debug, vcdlog,
                  use_page_zero, sim_topology, testbed_motes, mqtt_broker,
                  opentun, fw_path, auto_boot, root, port_mask, baudrate,
-                 topo_file, iotlab_motes, iotlab_passwd, iotlab_user):
+                 topo_file, iotlab_motes, iotlab_passwd, iotlab_user, tun_queues=1, fast_sim=False,
+                 sim_threads=False, sim_collisions=False, sim_seed=None, sim_inline=False):
 
         # store params
         self.host = host
@@ -178,7 +180,7 @@ class OpenVisualizerServer(SimpleXMLRPCServer, EventBusClient):
         self.mote_probes = []
 
         # create opentun call last since indicates prefix
-        self.opentun = OpenTun.create(opentun)
+        self.opentun = OpenTun.create(opentun, queues=tun_queues)
 
         if self.debug and opentun:
             self.ebm.wireshark_debug_enabled = True
@@ -187,9 +189,14 @@ class OpenVisualizerServer(SimpleXMLRPCServer, EventBusClient):
 
         if self.simulator_mode:
             self.simengine = simengine.SimEngine(self.sim_topology)
+            self.simengine.set_as_fast_as_possible(fast_sim)
+            self.simengine.set_mote_threads(sim_threads)
+            self.simengine.propagation.set_collision_model(sim_collisions)
+            if sim_seed is not None:
+                self.simengine.set_seed(sim_seed)
             self.simengine.start()
 
-            self.temp_dir = self.copy_sim_fw()
+            self.temp_dir = self.copy_sim_fw(self.fw_path)
 
             if self.temp_dir is None:
                 log.critical("failed to import simulation files! Exiting now!")
@@ -204,7 +211,8 @@ class OpenVisualizerServer(SimpleXMLRPCServer, EventBusClient):
             for _ in range(self.simulator_mode):
                 mote_handler = motehandler.MoteHandler(oos_openwsn.OpenMote(), self.vcdlog)
                 self.simengine.indicate_new_mote(mote_handler)
-                self.mote_probes += [emulatedmoteprobe.EmulatedMoteProbe(emulated_mote=mote_handler)]
+                self.mote_probes += [emulatedmoteprobe.EmulatedMoteProbe(emulated_mote=mote_handler,
+                                                                         inline=sim_inline)]
 
             # load the saved topology from the topology file
             if self.topo_file:
@@ -227,7 +235,7 @@ class OpenVisualizerServer(SimpleXMLRPCServer, EventBusClient):
 
         # create a MoteConnector for each MoteProbe
         try:
-            fw_defines = self.extract_stack_defines()
+            fw_defines = self.extract_stack_defines(self.fw_path)
         except IOError as err:
             log.critical("could not updated firmware definitions: {}".format(err))
             os.kill(os.getpid(), signal.SIGTERM)
@@ -265,7 +273,13 @@ class OpenVisualizerServer(SimpleXMLRPCServer, EventBusClient):
             self.register_function(self.create_motes_connection)
             self.register_function(self.update_motes_connection)
             self.register_function(self.delete_motes_connection)
+            self.register_function(self.update_motes_connections)
             self.register_function(self.retrieve_routing_path)
+            self.register_function(self.get_dao_stats)
+            self.register_function(self.get_topology_stats)
+            self.register_function(self.get_jrc_stats)
+            self.register_function(self.get_tun_stats)
+            self.register_function(self.get_sim_stats)
 
             # boot all simulated motes
             if self.simulator_mode and self.auto_boot:
@@ -295,7 +309,7 @@ class OpenVisualizerServer(SimpleXMLRPCServer, EventBusClient):
 
     def load_motes_from_topology_file(self):
         """ Import the number of motes from the topology file. """
-        topo_config = self._load_saved_topology()
+        topo_config = self.read_topology_file(self.topo_file)
         if topo_config is None:
             return
 
@@ -312,30 +326,11 @@ class OpenVisualizerServer(SimpleXMLRPCServer, EventBusClient):
 
         log.success("loading topology from file.")
 
-        topo_config = self._load_saved_topology()
+        topo_config = self.read_topology_file(self.topo_file)
         if topo_config is None:
             return
 
-        # delete each connections automatically established during motes creation
-        connections_to_delete = self.simengine.propagation.retrieve_connections()
-        for co in connections_to_delete:
-            from_mote = int(co['fromMote'])
-            to_mote = int(co['toMote'])
-            self.simengine.propagation.delete_connection(from_mote, to_mote)
-
-        motes = topo_config['motes']
-        for mote in motes:
-            mh = self.simengine.get_mote_handler_by_id(mote['id'])
-            mh.set_location(mote['lat'], mote['lon'])
-
-        # implements new connections
-        connect = topo_config['connections']
-        for co in connect:
-            from_mote = int(co['fromMote'])
-            to_mote = int(co['toMote'])
-            pdr = float(co['pdr'])
-            self.simengine.propagation.create_connection(from_mote, to_mote)
-            self.simengine.propagation.update_connection(from_mote, to_mote, pdr)
+        self.apply_topology(self.simengine, topo_config)
 
         try:
             # recover dagroot
@@ -343,19 +338,35 @@ class OpenVisualizerServer(SimpleXMLRPCServer, EventBusClient):
         except KeyError:
             pass
 
-    def _load_saved_topology(self):
+    @staticmethod
+    def apply_topology(engine, topo_config):
+        """ Moves the simulated motes and replaces their connections, as given by a topology loaded from a file. """
+
+        motes = topo_config['motes']
+        for mote in motes:
+            mh = engine.get_mote_handler_by_id(mote['id'])
+            mh.set_location(mote['lat'], mote['lon'])
+
+        # replace the connections automatically established during motes creation, at once
+        engine.propagation.set_connections([
+            {'fromMote': int(co['fromMote']), 'toMote': int(co['toMote']), 'pdr': float(co['pdr'])}
+            for co in topo_config['connections']
+        ])
+
+    @staticmethod
+    def read_topology_file(topo_file):
         """ Check if we can find the file locally, if not search the example directory. """
 
-        local_path = '/'.join(('topologies', str(self.topo_file)))
+        local_path = '/'.join(('topologies', str(topo_file)))
 
         try:
-            if os.path.isfile(self.topo_file):
-                filename = self.topo_file
+            if os.path.isfile(topo_file):
+                filename = topo_file
                 f = open(filename, 'r')
             elif pkg_resources.resource_exists(PACKAGE_NAME, local_path):
                 f = pkg_resources.resource_stream(PACKAGE_NAME, local_path)
             else:
-                log.error('could not open file: {}'.format(self.topo_file))
+                log.error('could not open file: {}'.format(topo_file))
                 return
 
             topo_config = json.load(f)
@@ -366,7 +377,8 @@ class OpenVisualizerServer(SimpleXMLRPCServer, EventBusClient):
 
         return topo_config
 
-    def copy_sim_fw(self):
+    @staticmethod
+    def copy_sim_fw(fw_path):
         """
         Copy simulation files from build folder in openwsn-fw to a temporary directory.
         The latter is subsequently added to the python path.
@@ -381,13 +393,13 @@ class OpenVisualizerServer(SimpleXMLRPCServer, EventBusClient):
         host = hosts[index]
 
         # in openwsn-fw, directory containing 'openwsnmodule_obj.h'
-        inc_dir = os.path.join(self.fw_path, 'bsp', 'boards', 'python')
+        inc_dir = os.path.join(fw_path, 'bsp', 'boards', 'python')
         if not os.path.exists(inc_dir):
             log.critical("path '{}' does not exist".format(inc_dir))
             return
 
         # in openwsn-fw, directory containing extension library
-        lib_dir = os.path.join(self.fw_path, 'build', 'python_gcc', 'projects', 'common')
+        lib_dir = os.path.join(fw_path, 'build', 'python_gcc', 'projects', 'common')
         if not os.path.exists(lib_dir):
             log.critical("path '{}' does not exist".format(lib_dir))
             return
@@ -443,14 +455,15 @@ class OpenVisualizerServer(SimpleXMLRPCServer, EventBusClient):
 
         return temp_dir
 
-    def extract_stack_defines(self):
+    @staticmethod
+    def extract_stack_defines(fw_path):
         """ Extract firmware definitions for the OpenVisualizer parser from the OpenWSN-FW files. """
         log.info('extracting firmware definitions.')
         definitions = {
-            "components": extract_component_codes(os.path.join(self.fw_path, 'inc', 'opendefs.h')),
-            "log_descriptions": extract_log_descriptions(os.path.join(self.fw_path, 'inc', 'opendefs.h')),
-            "sixtop_returncodes": extract_6top_rcs(os.path.join(self.fw_path, 'openstack', '02b-MAChigh', 'sixtop.h')),
-            "sixtop_states": extract_6top_states(os.path.join(self.fw_path, 'openstack', '02b-MAChigh', 'sixtop.h')),
+            "components": extract_component_codes(os.path.join(fw_path, 'inc', 'opendefs.h')),
+            "log_descriptions": extract_log_descriptions(os.path.join(fw_path, 'inc', 'opendefs.h')),
+            "sixtop_returncodes": extract_6top_rcs(os.path.join(fw_path, 'openstack', '02b-MAChigh', 'sixtop.h')),
+            "sixtop_states": extract_6top_states(os.path.join(fw_path, 'openstack', '02b-MAChigh', 'sixtop.h')),
         }
 
         return definitions
@@ -471,6 +484,8 @@ class OpenVisualizerServer(SimpleXMLRPCServer, EventBusClient):
 
         if self.simulator_mode:
             OpenVisualizerServer.cleanup_temporary_files([self.temp_dir])
+            if self.vcdlog:
+                vcdlogger.VcdLogger().close()
 
         os.kill(os.getpid(), signal.SIGTERM)
 
@@ -659,6 +674,23 @@ class OpenVisualizerServer(SimpleXMLRPCServer, EventBusClient):
         self.simengine.propagation.delete_connection(from_mote, to_mote)
         return True
 
+    def update_motes_connections(self, connections):
+        """
+        Creates, updates or deletes several connections at once (a PDR of 0 deletes the connection), the simulated
+        motes either see all the changes or none.
+
+        :param connections: A JSON list of {'fromMote': ..., 'toMote': ..., 'pdr': ...}.
+        """
+        log.debug('RPC: {}'.format(self.update_motes_connections.__name__))
+
+        if not self.simulator_mode:
+            return False
+
+        self.simengine.propagation.update_connections([
+            (int(co['fromMote']), int(co['toMote']), float(co['pdr'])) for co in json.loads(connections)
+        ])
+        return True
+
     def retrieve_routing_path(self, destination):
         route = self._dispatch_and_get_result(signal='getSourceRoute', data=destination)
         route = [r[-1] for r in route]
@@ -666,6 +698,39 @@ class OpenVisualizerServer(SimpleXMLRPCServer, EventBusClient):
 
         return data
 
+    def get_dao_stats(self):
+        """ Returns the per-node DAO statistics (inter-arrival time, loss, parent changes and route depth). """
+        log.debug('RPC: {}'.format(self.get_dao_stats.__name__))
+
+        return self.rpl.get_dao_stats()
+
+    def get_topology_stats(self):
+        """ Returns the DODAG statistics (number of nodes, maximum depth, detected loops and unroutable lookups). """
+        log.debug('RPC: {}'.format(self.get_topology_stats.__name__))
+
+        return self.topology.get_stats()
+
+    def get_jrc_stats(self):
+        """ Returns the JRC statistics (joined nodes, join latency and OSCORE context cache usage). """
+        log.debug('RPC: {}'.format(self.get_jrc_stats.__name__))
+
+        return self.jrc.get_stats()
+
+    def get_tun_stats(self):
+        """ Returns the TUN interface statistics (packets/s and queue depths). """
+        log.debug('RPC: {}'.format(self.get_tun_stats.__name__))
+
+        return self.opentun.get_stats()
+
+    def get_sim_stats(self):
+        """ Returns the simulation speed (events/s and simulated time vs wall-clock time) and frame counters. """
+        log.debug('RPC: {}'.format(self.get_sim_stats.__name__))
+
+        if not self.simulator_mode:
+            return {}
+
+        return self.simengine.get_speed_stats()
+
     def get_mote_dict(self):
         """ Returns a dictionary with key-value entry: (mote_id: serialport) """
         log.debug('RPC: {}'.format(self.get_mote_dict.__name__))
@@ -746,6 +811,51 @@ def _add_parser_args(parser):
         help='Force a predefined topology (linear or fully-meshed). Only available in simulation mode.',
     )
 
+    parser.add_argument(
+        '--fast-sim',
+        dest='fast_sim',
+        default=False,
+        action='store_true',
+        help='Run the simulation as fast as possible, without pacing the events. Only available in simulation mode.',
+    )
+
+    parser.add_argument(
+        '--sim-threads',
+        dest='sim_threads',
+        default=False,
+        action='store_true',
+        help='Run each simulated mote in its own thread instead of in the timeline thread. Only available in '
+             'simulation mode.',
+    )
+
+    parser.add_argument(
+        '--sim-collisions',
+        dest='sim_collisions',
+        default=False,
+        action='store_true',
+        help='Corrupt the frames received while other motes transmit on the same channel (SINR below the capture '
+             'threshold). Only available in simulation mode.',
+    )
+
+    parser.add_argument(
+        '--sim-seed',
+        dest='sim_seed',
+        type=int,
+        action='store',
+        help='Seed the random draws of the simulation (links, frame losses, locations and drifts). Only available '
+             'in simulation mode.',
+    )
+
+    parser.add_argument(
+        '--sim-inline',
+        dest='sim_inline',
+        default=False,
+        action='store_true',
+        help='Parse the frames of the simulated motes as soon as they are written, in the thread running the mote, '
+             'instead of in one thread per mote probe. With --sim-seed, two runs then execute the same events. Only '
+             'available in simulation mode.',
+    )
+
     parser.add_argument(
         '--root',
         dest='set_root',
@@ -809,6 +919,15 @@ def _add_parser_args(parser):
         help='Use a TUN device to route packets to the Internet.',
     )
 
+    parser.add_argument(
+        '--tun-queues',
+        dest='tun_queues',
+        default=1,
+        type=int,
+        action='store',
+        help='Number of queues of the TUN device, each served by its own thread (Linux only, requires --opentun).',
+    )
+
     parser.add_argument(
         '-H',
         '--host',
@@ -936,12 +1055,20 @@ def main():
             options.append('simulation topology     = {0}'.format('Pister-hack'))
 
         options.append('auto-boot sim motes     = {0}'.format(args.auto_boot))
+        options.append('as fast as possible     = {0}'.format(args.fast_sim))
+        options.append('one thread per mote     = {0}'.format(args.sim_threads))
+        options.append('collision model         = {0}'.format(args.sim_collisions))
+        if args.sim_seed is not None:
+            options.append('random seed             = {0}'.format(args.sim_seed))
+        options.append('inline frame parsing    = {0}'.format(args.sim_inline))
 
     if args.set_root:
         options.append('set root                = {0}'.format(args.set_root))
 
     if args.opentun:
         options.append('opentun                 = {0}'.format('True'))
+        if args.tun_queues > 1:
+            options.append('tun queues              = {0}'.format(args.tun_queues))
         if args.debug:
             options.append('wireshark debug         = {0}'.format(True))
 
@@ -988,6 +1115,12 @@ def main():
         iotlab_motes=args.iotlab_motes,
         iotlab_user=args.username,
         iotlab_passwd=args.password,
+        tun_queues=args.tun_queues,
+        fast_sim=args.fast_sim,
+        sim_threads=args.sim_threads,
+        sim_collisions=args.sim_collisions,
+        sim_seed=args.sim_seed,
+        sim_inline=args.sim_inline,
     )
 
     try:
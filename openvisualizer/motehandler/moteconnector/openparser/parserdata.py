@@ -180,8 +180,43 @@ class ParserData(parser.Parser):
         # header
         return event_type, (source, data)
 
+    def get_kpis(self):
+        """
+        Returns the KPIs of each mote which sent uinject packets to this (DAG root) mote: the number of packets
+        received, the PDR, the average latency (in slots), the average cells usage and the average duty cycle.
+        """
+
+        kpis = {}
+        for src_id in self.avg_kpi.keys():
+            self._update_kpi(src_id)
+            mote_data = self.avg_kpi[src_id]
+            kpis[src_id] = {
+                'received': len(mote_data['counter']),
+                'pdr': mote_data['avg_pdr'],
+                'avg_latency': mote_data['avg_latency'],
+                'avg_cells_usage': mote_data['avg_cellsUsage'],
+                'avg_duty_cycle': sum(mote_data['dutyCycle']) / len(mote_data['dutyCycle']),
+            }
+
+        return kpis
+
     # ======================== private =========================================
 
+    def _update_kpi(self, src_id):
+        """ Computes the averages of the KPIs of a mote, from the packets received so far. """
+
+        mote_data = self.avg_kpi[src_id]
+
+        mote_data['avg_cellsUsage'] = \
+            float(sum(mote_data['numCellsUsedTx']) / len(mote_data['numCellsUsedTx'])) / float(64)
+
+        mote_data['avg_latency'] = sum(mote_data['latency']) / len(mote_data['latency'])
+
+        mote_data['counter'].sort()  # sort the counter before calculating
+
+        mote_data['avg_pdr'] = \
+            float(len(set(mote_data['counter']))) / float(1 + mote_data['counter'][-1] - mote_data['counter'][0])
+
     @staticmethod
     def _asn_diference(init, end):
 
@@ -200,18 +235,7 @@ class ParserData(parser.Parser):
 
         payload = {'token': 123}
 
-        mote_data = self.avg_kpi[src_id]
-
-        self.avg_kpi[src_id]['avg_cellsUsage'] = \
-            float(sum(mote_data['numCellsUsedTx']) / len(mote_data['numCellsUsedTx'])) / float(64)
-
-        self.avg_kpi[src_id]['avg_latency'] = \
-            sum(self.avg_kpi[src_id]['latency']) / len(self.avg_kpi[src_id]['latency'])
-
-        mote_data['counter'].sort()  # sort the counter before calculating
-
-        self.avg_kpi[src_id]['avg_pdr'] = \
-            float(len(set(mote_data['counter']))) / float(1 + mote_data['counter'][-1] - mote_data['counter'][0])
+        self._update_kpi(src_id)
 
         avg_pdr_all = 0.0
         avg_latency_all = 0.0
@@ -19,7 +19,12 @@ log.addHandler(logging.NullHandler())
 # ============================ class ===================================
 
 class EmulatedMoteProbe(MoteProbe):
-    def __init__(self, emulated_mote):
+    """
+    Reads the frames of an emulated mote from its UART. Inline, the frames are parsed as soon as the mote writes them,
+    in the thread running the mote, rather than by the thread of the probe.
+    """
+
+    def __init__(self, emulated_mote, inline=False):
         self.emulated_mote = emulated_mote
         self._serial = None
 
@@ -30,6 +35,9 @@ class EmulatedMoteProbe(MoteProbe):
         # initialize the parent class
         MoteProbe.__init__(self, portname=name, daemon=True)
 
+        if inline:
+            self.emulated_mote.bsp_uart.set_frame_handler(self._parse_bytes)
+
     # ======================== private =================================
 
     def _send_data(self, data):
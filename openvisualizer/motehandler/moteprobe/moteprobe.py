@@ -93,8 +93,6 @@ class MoteProbe(threading.Thread):
                     break
                 else:
                     self._parse_bytes(rx_bytes)
-                if hasattr(self, 'emulated_mote'):
-                    self.serial.done_reading()
             log.warning('{}; exit loop'.format(self._portname))
         except Exception as err:
             err_msg = format_crash_message(self.name, err)
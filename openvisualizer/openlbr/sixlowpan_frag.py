@@ -5,6 +5,7 @@
 # https://openwsn.atlassian.net/wiki/display/OW/License
 
 import logging
+import threading
 
 from openvisualizer.utils import buf2int, hex2buf
 
@@ -30,6 +31,9 @@ class Fragmentor(object):
 
     * *https://tools.ietf.org/html/rfc4944*
       Transmission of IPv6 Packets over IEEE 802.15.4 Networks.
+
+    Packets can be fragmented and reassembled from several threads at once: each datagram takes its own tag, and the
+    reassembly buffer is only accessed under the data lock.
     """
 
     FRAG1_DISPATCH = 0xC0
@@ -46,60 +50,62 @@ class Fragmentor(object):
     FRAGN_HDR_SIZE = 5
 
     def __init__(self, tag=1):
+        self.data_lock = threading.Lock()
         self.reassemble_buffer = dict()
 
         self.datagram_tag = tag
 
     def do_reassemble(self, lowpan_pkt):
-        reassembled_pkt = None
-
-        # parse fragmentation header
-        dispatch = lowpan_pkt[0] & self.FRAG_DISPATCH_MASK
-        datagram_size = buf2int(lowpan_pkt[:2]) & self.FRAG_SIZE_MASK
-
-        if dispatch not in [self.FRAG1_DISPATCH, self.FRAGN_DISPATCH]:
-            return lowpan_pkt
-
-        # extract fragmentation tag
-        datagram_tag = buf2int(lowpan_pkt[2:4])
-
-        if dispatch == self.FRAG1_DISPATCH:
-            payload = lowpan_pkt[4:]
-            offset = 0
-        else:
-            payload = lowpan_pkt[5:]
-            offset = lowpan_pkt[4]
-
-        if datagram_tag in self.reassemble_buffer:
-            entry = self.reassemble_buffer[datagram_tag]
-            entry.recvd_bytes += len(payload)
-            entry.fragments.append((offset, payload))
-        else:
-            new_entry = ReassembleEntry(datagram_size, len(payload), [(offset, payload)])
-            self.reassemble_buffer[datagram_tag] = new_entry
-
-        # check if we can reassemble
-        num_of_frags = 0
-        used_tag = None
-        for tag, entry in self.reassemble_buffer.items():
-            if entry.total_bytes == entry.recvd_bytes:
-                frags = sorted(entry.fragments, key=lambda frag: frag[0])
-                used_tag = tag
-                num_of_frags = len(frags)
-                reassembled_pkt = []
-
-                for frag in frags:
-                    reassembled_pkt.extend(frag[1])
-                break
-
-        if used_tag is not None:
-            del self.reassemble_buffer[used_tag]
-
-        if reassembled_pkt is not None:
-            log.success("[GATEWAY] Reassembled {} frags with tag {} into an IPv6 packet of size {}".format(
-                num_of_frags, used_tag, len(reassembled_pkt)))
-
-        return reassembled_pkt
+        with self.data_lock:
+            reassembled_pkt = None
+
+            # parse fragmentation header
+            dispatch = lowpan_pkt[0] & self.FRAG_DISPATCH_MASK
+            datagram_size = buf2int(lowpan_pkt[:2]) & self.FRAG_SIZE_MASK
+
+            if dispatch not in [self.FRAG1_DISPATCH, self.FRAGN_DISPATCH]:
+                return lowpan_pkt
+
+            # extract fragmentation tag
+            datagram_tag = buf2int(lowpan_pkt[2:4])
+
+            if dispatch == self.FRAG1_DISPATCH:
+                payload = lowpan_pkt[4:]
+                offset = 0
+            else:
+                payload = lowpan_pkt[5:]
+                offset = lowpan_pkt[4]
+
+            if datagram_tag in self.reassemble_buffer:
+                entry = self.reassemble_buffer[datagram_tag]
+                entry.recvd_bytes += len(payload)
+                entry.fragments.append((offset, payload))
+            else:
+                new_entry = ReassembleEntry(datagram_size, len(payload), [(offset, payload)])
+                self.reassemble_buffer[datagram_tag] = new_entry
+
+            # check if we can reassemble
+            num_of_frags = 0
+            used_tag = None
+            for tag, entry in self.reassemble_buffer.items():
+                if entry.total_bytes == entry.recvd_bytes:
+                    frags = sorted(entry.fragments, key=lambda frag: frag[0])
+                    used_tag = tag
+                    num_of_frags = len(frags)
+                    reassembled_pkt = []
+
+                    for frag in frags:
+                        reassembled_pkt.extend(frag[1])
+                    break
+
+            if used_tag is not None:
+                del self.reassemble_buffer[used_tag]
+
+            if reassembled_pkt is not None:
+                log.success("[GATEWAY] Reassembled {} frags with tag {} into an IPv6 packet of size {}".format(
+                    num_of_frags, used_tag, len(reassembled_pkt)))
+
+            return reassembled_pkt
 
     def do_fragment(self, ip6_pkt):
         fragment_list = []
@@ -108,12 +114,16 @@ class Fragmentor(object):
         if len(ip6_pkt) <= self.MAX_FRAGMENT_SIZE + self.FRAGN_HDR_SIZE:
             return [ip6_pkt]
 
+        # take the tag of this set of fragments, and increment it for the next one
+        with self.data_lock:
+            tag = self.datagram_tag
+            self.datagram_tag = (self.datagram_tag + 1) & 0xffff
+        datagram_tag = hex2buf("{:04x}".format(tag))
+
         while len(ip6_pkt) > 0:
             frag_header = []
             fragment = []
 
-            datagram_tag = hex2buf("{:04x}".format(self.datagram_tag))
-
             if len(ip6_pkt) > self.MAX_FRAGMENT_SIZE:
                 frag_len = self.MAX_FRAGMENT_SIZE
             else:
@@ -139,10 +149,7 @@ class Fragmentor(object):
 
             ip6_pkt = ip6_pkt[frag_len:]
 
-        # increment the tag for the new set of fragments
-        self.datagram_tag += 1
-
         log.info("[GATEWAY] Fragmenting incoming IPv6 packet (size: {}) into {} fragments with tag {}".format(
-            original_length, len(fragment_list), self.datagram_tag - 1))
+            original_length, len(fragment_list), tag))
 
         return fragment_list
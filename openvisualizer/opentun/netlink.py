@@ -0,0 +1,262 @@
+# Copyright (c) 2010-2013, Regents of the University of California.
+# All rights reserved.
+#
+# Released under the BSD 3-Clause license as published at the link below.
+# https://openwsn.atlassian.net/wiki/display/OW/License
+
+"""
+Minimal rtnetlink client, used to configure the TUN interface (link state, IPv6 addresses and routes) without
+spawning ip(8) processes.
+"""
+
+import errno
+import logging
+import os
+import socket
+import struct
+
+log = logging.getLogger('RtNetlink')
+log.setLevel(logging.ERROR)
+log.addHandler(logging.NullHandler())
+
+# ============================ defines =========================================
+
+NETLINK_ROUTE = 0
+
+# message types
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+
+# message flags
+NLM_F_REQUEST = 0x001
+NLM_F_ACK = 0x004
+NLM_F_DUMP = 0x300
+NLM_F_REPLACE = 0x100
+NLM_F_CREATE = 0x400
+
+# attributes
+IFLA_IFNAME = 3
+IFLA_TXQLEN = 13
+IFLA_STATS64 = 23
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+RTA_DST = 1
+RTA_OIF = 4
+RTA_PRIORITY = 6
+
+IFF_UP = 0x1
+IFA_F_NODAD = 0x02
+RT_TABLE_MAIN = 254
+RTPROT_BOOT = 3
+RT_SCOPE_UNIVERSE = 0
+RTN_UNICAST = 1
+
+AF_INET6 = 10
+
+NLMSGHDR = struct.Struct('=LHHLL')
+NLMSGERR = struct.Struct('=i')
+RTATTR = struct.Struct('=HH')
+IFINFOMSG = struct.Struct('=BxHiII')
+IFADDRMSG = struct.Struct('=BBBBI')
+RTMSG = struct.Struct('=BBBBBBBBI')
+# first counters of struct rtnl_link_stats64
+LINK_STATS64 = struct.Struct('=8Q')
+LINK_STATS64_FIELDS = ['rx_packets', 'tx_packets', 'rx_bytes', 'tx_bytes', 'rx_errors', 'tx_errors', 'rx_dropped',
+                       'tx_dropped']
+
+PROC_IPV6_FORWARDING = '/proc/sys/net/ipv6/conf/all/forwarding'
+
+
+class NetlinkError(EnvironmentError):
+    """ Error returned by the kernel for a netlink request. """
+    pass
+
+
+# ============================ helpers =========================================
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _attr(attr_type, value):
+    length = RTATTR.size + len(value)
+    return RTATTR.pack(length, attr_type) + value + '\x00' * (_align(length) - length)
+
+
+def _parse_attrs(data):
+    attrs = {}
+    offset = 0
+    while offset + RTATTR.size <= len(data):
+        (length, attr_type) = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        attrs[attr_type] = data[offset + RTATTR.size:offset + length]
+        offset += _align(length)
+    return attrs
+
+
+def _to_bytes(addr):
+    """ Accepts an IPv6 address as a list of 16 bytes or as a packed string. """
+    if isinstance(addr, str):
+        return addr
+    return str(bytearray(addr))
+
+
+# ============================ main class ======================================
+
+class RtNetlink(object):
+    """
+    A route netlink socket.
+
+    All requests are acknowledged by the kernel and raise a NetlinkError on failure. Adding an address or a route which
+    already exists, or removing one which does not, is not an error: configuring an interface twice leaves it in the
+    same state.
+    """
+
+    RECV_BUFFER = 65536
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        self.sock.bind((0, 0))
+        self.seq = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # ======================== public ==========================================
+
+    def close(self):
+        self.sock.close()
+
+    def link_index(self, ifname):
+        """ Returns the index of the interface called ifname. """
+        msg = IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0) + _attr(IFLA_IFNAME, ifname + '\x00')
+        for (_, payload) in self._request(RTM_GETLINK, 0, msg):
+            return IFINFOMSG.unpack_from(payload)[2]
+        raise NetlinkError(errno.ENODEV, 'no interface {0}'.format(ifname))
+
+    def link_up(self, index):
+        self._request(RTM_NEWLINK, 0, IFINFOMSG.pack(socket.AF_UNSPEC, 0, index, IFF_UP, IFF_UP))
+
+    def set_tx_queue_len(self, index, length):
+        """ Sets the number of packets the transmit queue of an interface holds (txqueuelen). """
+        msg = IFINFOMSG.pack(socket.AF_UNSPEC, 0, index, 0, 0) + _attr(IFLA_TXQLEN, struct.pack('=I', length))
+        self._request(RTM_NEWLINK, 0, msg)
+
+    def get_link_stats(self, index):
+        """ Returns the packet, byte, error and drop counters of an interface, as a dictionary. """
+        for (_, payload) in self._request(RTM_GETLINK, 0, IFINFOMSG.pack(socket.AF_UNSPEC, 0, index, 0, 0)):
+            stats = _parse_attrs(payload[IFINFOMSG.size:]).get(IFLA_STATS64)
+            if stats is not None:
+                return dict(zip(LINK_STATS64_FIELDS, LINK_STATS64.unpack_from(stats)))
+        raise NetlinkError(errno.ENODEV, 'no statistics for interface {0}'.format(index))
+
+    def add_address(self, index, addr, prefix_len):
+        """ Adds (or updates) an IPv6 address, usable immediately (no duplicate address detection). """
+        msg = IFADDRMSG.pack(AF_INET6, prefix_len, IFA_F_NODAD, RT_SCOPE_UNIVERSE, index)
+        msg += _attr(IFA_LOCAL, _to_bytes(addr)) + _attr(IFA_ADDRESS, _to_bytes(addr))
+        self._request(RTM_NEWADDR, NLM_F_CREATE | NLM_F_REPLACE, msg, ignore=(errno.EEXIST,))
+
+    def delete_address(self, index, addr, prefix_len):
+        msg = IFADDRMSG.pack(AF_INET6, prefix_len, 0, RT_SCOPE_UNIVERSE, index)
+        msg += _attr(IFA_LOCAL, _to_bytes(addr)) + _attr(IFA_ADDRESS, _to_bytes(addr))
+        self._request(RTM_DELADDR, 0, msg, ignore=(errno.EADDRNOTAVAIL, errno.ENOENT, errno.ENODEV))
+
+    def get_addresses(self, index):
+        """ Returns the IPv6 addresses of an interface, as a list of (packed address, prefix length). """
+        addresses = []
+        for (_, payload) in self._request(RTM_GETADDR, NLM_F_DUMP, IFADDRMSG.pack(AF_INET6, 0, 0, 0, 0)):
+            (family, prefix_len, _, _, if_index) = IFADDRMSG.unpack_from(payload)
+            if family != AF_INET6 or if_index != index:
+                continue
+            attrs = _parse_attrs(payload[IFADDRMSG.size:])
+            addr = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+            if addr is not None:
+                addresses.append((addr, prefix_len))
+        return addresses
+
+    def add_route(self, index, dst, prefix_len, metric=None):
+        """ Adds (or updates) an IPv6 route through an interface. """
+        self._request(RTM_NEWROUTE, NLM_F_CREATE | NLM_F_REPLACE, self._route(index, dst, prefix_len, metric),
+                      ignore=(errno.EEXIST,))
+
+    def delete_route(self, index, dst, prefix_len, metric=None):
+        self._request(RTM_DELROUTE, 0, self._route(index, dst, prefix_len, metric), ignore=(errno.ESRCH,))
+
+    def get_routes(self, index):
+        """ Returns the IPv6 routes through an interface, as a list of (packed destination, prefix length). """
+        routes = []
+        msg = RTMSG.pack(AF_INET6, 0, 0, 0, 0, 0, 0, 0, 0)
+        for (_, payload) in self._request(RTM_GETROUTE, NLM_F_DUMP, msg):
+            (family, dst_len, _, _, table, _, _, _, _) = RTMSG.unpack_from(payload)
+            attrs = _parse_attrs(payload[RTMSG.size:])
+            oif = attrs.get(RTA_OIF)
+            if family != AF_INET6 or table != RT_TABLE_MAIN or oif is None or struct.unpack('=I', oif)[0] != index:
+                continue
+            routes.append((attrs.get(RTA_DST, '\x00' * 16), dst_len))
+        return routes
+
+    @staticmethod
+    def enable_ipv6_forwarding():
+        with open(PROC_IPV6_FORWARDING, 'w') as f:
+            f.write('1')
+
+    # ======================== private =========================================
+
+    @staticmethod
+    def _route(index, dst, prefix_len, metric):
+        msg = RTMSG.pack(AF_INET6, prefix_len, 0, 0, RT_TABLE_MAIN, RTPROT_BOOT, RT_SCOPE_UNIVERSE, RTN_UNICAST, 0)
+        msg += _attr(RTA_DST, _to_bytes(dst)) + _attr(RTA_OIF, struct.pack('=I', index))
+        if metric is not None:
+            msg += _attr(RTA_PRIORITY, struct.pack('=I', metric))
+        return msg
+
+    def _request(self, msg_type, flags, payload, ignore=()):
+        """
+        Sends a request and collects the answer.
+
+        Requests which are not dumps are always acknowledged, so the answer ends with either the acknowledgement (an
+        error message with error code 0) or the end of the dump.
+
+        :returns: The list of (message type, payload) received before the acknowledgement or the end of the dump.
+        """
+
+        self.seq += 1
+        flags |= NLM_F_REQUEST | (0 if flags & NLM_F_DUMP == NLM_F_DUMP else NLM_F_ACK)
+        self.sock.send(NLMSGHDR.pack(NLMSGHDR.size + len(payload), msg_type, flags, self.seq, 0) + payload)
+
+        messages = []
+        while True:
+            data = self.sock.recv(self.RECV_BUFFER)
+            offset = 0
+            while offset + NLMSGHDR.size <= len(data):
+                (length, answer_type, _, seq, _) = NLMSGHDR.unpack_from(data, offset)
+                if length < NLMSGHDR.size:
+                    raise NetlinkError(errno.EBADMSG, 'malformed netlink message')
+                body = data[offset + NLMSGHDR.size:offset + length]
+                offset += _align(length)
+
+                if seq != self.seq:
+                    continue
+
+                if answer_type == NLMSG_DONE:
+                    return messages
+
+                if answer_type == NLMSG_ERROR:
+                    error = -NLMSGERR.unpack_from(body)[0]
+                    if error == 0 or error in ignore:
+                        return messages
+                    raise NetlinkError(error, os.strerror(error))
+
+                messages.append((answer_type, body))
@@ -86,8 +86,15 @@ class OpenTun(EventBusClient):
         return decorator
 
     @classmethod
-    def create(cls, opentun=False):
-        """ Module-based Factory method to create instance based on operating system. """
+    def create(cls, opentun=False, queues=1):
+        """
+        Module-based Factory method to create instance based on operating system.
+
+        :param queues: Number of queues of the TUN interface, each served by its own thread (only supported on Linux).
+        """
+
+        if queues > 1 and not sys.platform.startswith('linux'):
+            log.warning('multi-queue tun interfaces are only supported on Linux, using a single queue')
 
         if not opentun:
             return cls.os_support['null']()
@@ -96,7 +103,7 @@ class OpenTun(EventBusClient):
             return cls.os_support['win32']()
 
         elif sys.platform.startswith('linux'):
-            return cls.os_support['linux']()
+            return cls.os_support['linux'](queues=queues)
 
         elif sys.platform.startswith('darwin'):
             return cls.os_support['darwin']()
@@ -107,30 +114,36 @@ class OpenTun(EventBusClient):
     def close(self):
 
         if self.tun_read_thread:
-
             self.tun_read_thread.close()
+            self._unblock_read_thread()
 
-            # Send a packet to OpenTun interface to break out of blocking read.
-            attempts = 0
-            while self.tun_read_thread.isAlive() and attempts < 3:
-                attempts += 1
-                try:
-                    log.info('Closing tun interface')
-                    log.debug('Sending UDP packet to close OpenTun')
-                    sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
-                    # Destination must route through the TUN host, but not be the host itself.
-                    # OK if host does not really exist.
-                    dst = self.IPV6PREFIX + self.IPV6HOST
-                    dst[15] += 1
-                    # Payload and destination port are arbitrary
-                    sock.sendto('stop', (format_ipv6_addr(dst), 18004))
-                    # Give thread some time to exit
-                    time.sleep(0.05)
-                except Exception as err:
-                    log.error('Unable to send UDP to close tun_read_thread: {0}'.format(str(err)))
+    def get_stats(self):
+        """ Returns the statistics of the TUN interface (packet counts and rates, queue depths). """
+        return {'active': self.tun_if is not None}
 
     # ======================== private =========================================
 
+    def _unblock_read_thread(self):
+        """ Waits for the read thread to exit, sending packets to the TUN interface to break its blocking read. """
+
+        attempts = 0
+        while self.tun_read_thread.isAlive() and attempts < 3:
+            attempts += 1
+            try:
+                log.info('Closing tun interface')
+                log.debug('Sending UDP packet to close OpenTun')
+                sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+                # Destination must route through the TUN host, but not be the host itself.
+                # OK if host does not really exist.
+                dst = self.IPV6PREFIX + self.IPV6HOST
+                dst[15] += 1
+                # Payload and destination port are arbitrary
+                sock.sendto('stop', (format_ipv6_addr(dst), 18004))
+                # Give thread some time to exit
+                time.sleep(0.05)
+            except Exception as err:
+                log.error('Unable to send UDP to close tun_read_thread: {0}'.format(str(err)))
+
     def _get_network_prefix_notif(self, sender, signal, data):
         return self.IPV6PREFIX
 
@@ -146,6 +159,12 @@ class OpenTun(EventBusClient):
         # dispatch to EventBus
         self.dispatch(signal='v6ToMesh', data=data)
 
+    def _v6_to_mesh_batch_notif(self, packets):
+        """ Called with the list of packets read from the TUN interface in one go. """
+
+        for p in packets:
+            self._v6_to_mesh_notif(p)
+
     @abc.abstractmethod
     def _create_tun_if(self):
         """
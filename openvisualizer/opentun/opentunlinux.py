@@ -4,78 +4,330 @@
 # Released under the BSD 3-Clause license as published at the link below.
 # https://openwsn.atlassian.net/wiki/display/OW/License
 
+import errno
 import logging
 import os
+import Queue
+import select
+import socket
 import struct
 import sys
 import threading
+import time
 
+from openvisualizer.opentun.netlink import NetlinkError, RtNetlink
 from openvisualizer.opentun.opentun import OpenTun
 from openvisualizer.utils import format_buf, format_crash_message, format_ipv6_addr, format_critical_message
 
 if sys.platform.startswith('linux'):
-    from fcntl import ioctl  # pylint: disable=import-error
+    from fcntl import ioctl, fcntl, F_GETFL, F_SETFL  # pylint: disable=import-error
 
 log = logging.getLogger('OpenTunLinux')
 log.setLevel(logging.ERROR)
 log.addHandler(logging.NullHandler())
 
 
+# ============================ helpers =========================================
+
+def _set_non_blocking(fd):
+    fcntl(fd, F_SETFL, fcntl(fd, F_GETFL) | os.O_NONBLOCK)
+
+
 # ============================ helper classes ==================================
 
+class TunRate(object):
+    """ Packet counter which also reports the packet rate measured over the last completed interval. """
+
+    INTERVAL = 1.0
+
+    def __init__(self):
+        self.total = 0
+        self.rate = 0.0
+        self._count = 0
+        self._start = time.time()
+
+    def add(self, count):
+        self.total += count
+        self._count += count
+
+        now = time.time()
+        if now - self._start >= self.INTERVAL:
+            self.rate = self._count / (now - self._start)
+            self._count = 0
+            self._start = now
+
+
 class TunReadThread(threading.Thread):
     """
-    Thread which continuously reads input from a TUN interface. When data is received from the interface, it calls a
-    callback configured during instantiation.
+    Thread which continuously reads input from a TUN interface (or from one queue of a multi-queue TUN interface).
+
+    The TUN file descriptor is non-blocking: on each wakeup, the thread drains all packets that are ready (up to
+    BATCH_SIZE) and hands them over in batches to TunDispatchThreads through bounded queues. The 6LoWPAN processing
+    therefore never delays the reads, and when it cannot keep up, whole batches are dropped (and counted as rx_dropped).
+    The kernel queue of the interface still overflows when the thread itself is not scheduled for a while, e.g. during
+    a burst from a local sender on a single CPU: OpenTunLinux enlarges that queue, and reports its drops separately.
+
+    With several dispatch threads, packets are distributed by hashing their destination address, so that all the
+    packets towards one destination are processed by the same thread, in order.
+
+    The thread blocks in select on the TUN file descriptor and on the read end of a pipe: closing the thread writes to
+    the pipe, which wakes it up immediately, without any traffic on the interface.
     """
 
     ETHERNET_MTU = 1500
     IPv6_HEADER_LENGTH = 40
 
-    def __init__(self, tun_if, callback):
+    # maximum number of packets read per wakeup
+    BATCH_SIZE = 64
+    # offset of the IPv6 destination address, behind the tun ID octets
+    DST_ADDR_OFFSET = 4 + 24
+
+    def __init__(self, tun_if, callback=None, dispatch_threads=None, name='TunReadThread'):
 
         # store params
         self.tun_if = tun_if
-        self.callback = callback
 
         # local variables
         self.goOn = True
+        self.rx = TunRate()
+        self.batches = 0
+        self.dropped = 0
+        self.max_queue_depth = 0
+        (self.wakeup_r, self.wakeup_w) = os.pipe()
+
+        _set_non_blocking(self.tun_if)
+        if dispatch_threads is None:
+            self.dispatch_threads = [TunDispatchThread(callback)]
+            self.own_dispatch_threads = True
+        else:
+            self.dispatch_threads = dispatch_threads
+            self.own_dispatch_threads = False
 
         # initialize parent
         super(TunReadThread, self).__init__()
 
         # give this thread a name
-        self.name = 'TunReadThread'
+        self.name = name
 
         # start myself
         self.start()
 
     def run(self):
         try:
-            while self.goOn:
+            while True:
 
                 # wait for data
+                ready, _, _ = select.select([self.tun_if, self.wakeup_r], [], [])
+                if self.wakeup_r in ready:
+                    break
+
+                batch = self._drain()
+                if not batch:
+                    continue
+
+                self.rx.add(len(batch))
+                self.batches += 1
+
+                if len(self.dispatch_threads) == 1:
+                    self._hand_over(self.dispatch_threads[0], batch)
+                else:
+                    flows = {}
+                    for p in batch:
+                        flows.setdefault(self._flow(p), []).append(p)
+                    for (flow, packets) in flows.items():
+                        self._hand_over(self.dispatch_threads[flow], packets)
+        except Exception as err:
+            err_msg = format_crash_message(self.name, err)
+            log.critical(err_msg)
+            sys.exit(1)
+        finally:
+            os.close(self.wakeup_r)
+
+    # ======================== public ==========================================
+
+    def close(self):
+        if self.goOn:
+            self.goOn = False
+            try:
+                os.write(self.wakeup_w, 'x')
+            except OSError:
+                # the thread has already exited
+                pass
+            os.close(self.wakeup_w)
+        if self.own_dispatch_threads:
+            for dispatch_thread in self.dispatch_threads:
+                dispatch_thread.close()
+
+    def get_stats(self):
+        return {
+            'rx_packets': self.rx.total,
+            'rx_packets_per_s': self.rx.rate,
+            'rx_batches': self.batches,
+            'rx_dropped': self.dropped,
+            'queue_depth': sum([t.queue.qsize() for t in self.dispatch_threads]),
+            'max_queue_depth': self.max_queue_depth,
+        }
+
+    # ======================== private =========================================
+
+    def _drain(self):
+        """ Reads all packets ready on the interface, returns them as a list of strings. """
+
+        batch = []
+        while len(batch) < self.BATCH_SIZE:
+            try:
                 p = os.read(self.tun_if, self.ETHERNET_MTU)
+            except OSError as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not p:
+                break
+            batch.append(p)
+        return batch
+
+    def _flow(self, p):
+        """ Index of the dispatch thread in charge of the destination of a packet. """
+        return hash(p[self.DST_ADDR_OFFSET:self.DST_ADDR_OFFSET + 16]) % len(self.dispatch_threads)
+
+    def _hand_over(self, dispatch_thread, packets):
+        try:
+            dispatch_thread.queue.put_nowait(packets)
+        except Queue.Full:
+            self.dropped += len(packets)
+            log.warning('dropping {0} packets captured on tun interface, queue full'.format(len(packets)))
+        self.max_queue_depth = max(self.max_queue_depth, dispatch_thread.queue.qsize())
 
-                # convert input from a string to a byte list
-                p = [ord(b) for b in p]
 
-                # debug info
-                log.debug('packet captured on tun interface: {0}'.format(format_buf(p)))
+class TunDispatchThread(threading.Thread):
+    """
+    Thread which takes the batches of packets captured by TunReadThreads and calls the callback configured during
+    instantiation with the list of IPv6 packets of each batch.
+    """
 
-                # remove tun ID octets
-                p = p[4:]
+    IPv6_HEADER_LENGTH = 40
+    TUN_HEADER_LENGTH = 4
 
-                # make sure it's an IPv6 packet (i.e., starts with 0x6x)
-                if (p[0] & 0xf0) != 0x60:
-                    continue
+    # maximum number of batches waiting to be processed
+    QUEUE_SIZE = 64
+
+    def __init__(self, callback, name='TunDispatchThread'):
+
+        # store params
+        self.callback = callback
+
+        # local variables
+        self.goOn = True
+        self.queue = Queue.Queue(maxsize=self.QUEUE_SIZE)
+
+        # initialize parent
+        super(TunDispatchThread, self).__init__()
+
+        # give this thread a name
+        self.name = name
+        self.daemon = True
+
+        # start myself
+        self.start()
+
+    def run(self):
+        try:
+            while self.goOn:
+                batch = self.queue.get()
+                if batch is None:
+                    break
+
+                packets = []
+                for p in batch:
+                    # convert input from a string to a byte list, without the tun ID octets
+                    p = bytearray(p)[self.TUN_HEADER_LENGTH:]
+
+                    # make sure it's an IPv6 packet (i.e., starts with 0x6x)
+                    if len(p) < self.IPv6_HEADER_LENGTH or (p[0] & 0xf0) != 0x60:
+                        continue
+
+                    # cut at length of IPv6 packet
+                    p = list(p[:self.IPv6_HEADER_LENGTH + 256 * p[4] + p[5]])
+
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug('packet captured on tun interface: {0}'.format(format_buf(p)))
+
+                    packets.append(p)
+
+                if packets:
+                    # call the callback
+                    self.callback(packets)
+        except Exception as err:
+            err_msg = format_crash_message(self.name, err)
+            log.critical(err_msg)
+            sys.exit(1)
 
-                # because of the nature of tun for Windows, p contains ETHERNET_MTU
-                # bytes. Cut at length of IPv6 packet.
-                p = p[:self.IPv6_HEADER_LENGTH + 256 * p[4] + p[5]]
+    # ======================== public ==========================================
+
+    def close(self):
+        self.goOn = False
+        try:
+            self.queue.put_nowait(None)
+        except Queue.Full:
+            pass
+
+
+class TunWriteThread(threading.Thread):
+    """
+    Thread which writes the packets queued by the EventBus to a TUN interface.
+
+    Senders only enqueue the packet, the thread writes all the packets queued since its last wakeup in one go. A TUN
+    interface takes exactly one packet per write, so each packet is written with a single os.write of the TUN header
+    and the packet.
+    """
+
+    # maximum number of packets waiting to be written
+    QUEUE_SIZE = 1024
+    # maximum number of packets written per wakeup
+    BATCH_SIZE = 64
+
+    def __init__(self, tun_if):
+
+        # store params
+        self.tun_if = tun_if
+
+        # local variables
+        self.goOn = True
+        self.queue = Queue.Queue(maxsize=self.QUEUE_SIZE)
+        self.tx = TunRate()
+        self.batches = 0
+        self.dropped = 0
+        self.errors = 0
+
+        # initialize parent
+        super(TunWriteThread, self).__init__()
+
+        # give this thread a name
+        self.name = 'TunWriteThread'
+        self.daemon = True
+
+        # start myself
+        self.start()
 
-                # call the callback
-                self.callback(p)
+    def run(self):
+        try:
+            while self.goOn:
+                p = self.queue.get()
+                batch = []
+                while p is not None:
+                    batch.append(p)
+                    if len(batch) == self.BATCH_SIZE:
+                        break
+                    try:
+                        p = self.queue.get_nowait()
+                    except Queue.Empty:
+                        break
+                else:
+                    # closing
+                    self.goOn = False
+
+                if batch:
+                    self._write(batch)
         except Exception as err:
             err_msg = format_crash_message(self.name, err)
             log.critical(err_msg)
@@ -83,11 +335,56 @@ class TunReadThread(threading.Thread):
 
     # ======================== public ==========================================
 
+    def write(self, p):
+        """ Queues a packet (a string including the TUN header) for writing, returns False if it was dropped. """
+        try:
+            self.queue.put_nowait(p)
+        except Queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
     def close(self):
         self.goOn = False
+        try:
+            self.queue.put_nowait(None)
+        except Queue.Full:
+            pass
+
+    def get_stats(self):
+        return {
+            'tx_packets': self.tx.total,
+            'tx_packets_per_s': self.tx.rate,
+            'tx_batches': self.batches,
+            'tx_dropped': self.dropped,
+            'tx_errors': self.errors,
+            'tx_queue_depth': self.queue.qsize(),
+        }
 
     # ======================== private =========================================
 
+    def _write(self, batch):
+        written = 0
+        for p in batch:
+            try:
+                os.write(self.tun_if, p)
+                written += 1
+            except OSError as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    # the kernel queue of the interface is full, wait until it drains
+                    select.select([], [self.tun_if], [], 0.1)
+                    try:
+                        os.write(self.tun_if, p)
+                        written += 1
+                        continue
+                    except OSError as err:
+                        pass
+                self.errors += 1
+                log.critical(format_critical_message(err))
+
+        self.tx.add(written)
+        self.batches += 1
+
 
 # ============================ main class ======================================
 
@@ -99,44 +396,112 @@ class OpenTunLinux(OpenTun):
     VIRTUAL_TUN_ID = [0x00, 0x00, 0x86, 0xdd]
 
     IFF_TUN = 0x0001
+    IFF_MULTI_QUEUE = 0x0100
     TUN_SET_IFF = 0x400454ca
-
-    def __init__(self):
+    # maximum number of queues of a TUN interface (MAX_TAP_QUEUES in the kernel)
+    MAX_QUEUES = 256
+    # packets held by each queue of the interface until they are read (txqueuelen, 500 by default)
+    TX_QUEUE_LEN = 4096
+    # seconds to wait for each thread to exit on close
+    CLOSE_TIMEOUT = 1.0
+
+    LINK_LOCAL_PREFIX = [0xfe, 0x80, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
+    # the motes are routed through the TUN interface, at <prefix>:1415:9200::/96
+    MOTE_ROUTE_SUFFIX = [0x14, 0x15, 0x92, 0x00, 0x00, 0x00, 0x00, 0x00]
+
+    def __init__(self, queues=1):
         # log
         log.debug("create instance")
 
+        if not 1 <= queues <= self.MAX_QUEUES:
+            raise ValueError('the number of tun queues must be between 1 and {0}'.format(self.MAX_QUEUES))
+
+        # local variables
+        self.num_queues = queues
+        self.tun_queues = []
+        self.tun_read_threads = []
+        self.dispatch_threads = []
+        self.ifname = None
+        self.if_index = None
+        self.netlink = None
+        self.tun_header = str(bytearray(self.VIRTUAL_TUN_ID))
+        self.tun_write_thread = None
+
         # initialize parent class
         super(OpenTunLinux, self).__init__()
 
+        if self.tun_if:
+            self.tun_write_thread = TunWriteThread(self.tun_if)
+
     # ======================== public ==========================================
 
+    def close(self):
+        """ Stops all the threads, then removes the TUN interface. """
+
+        super(OpenTunLinux, self).close()
+
+        for dispatch_thread in self.dispatch_threads:
+            dispatch_thread.close()
+
+        if self.tun_write_thread:
+            self.tun_write_thread.close()
+            self.tun_write_thread.join(self.CLOSE_TIMEOUT)
+
+        if self.netlink:
+            try:
+                self._unconfigure_prefix(OpenTun.IPV6PREFIX)
+            except EnvironmentError as err:
+                log.warning('Could not remove the configuration of {0} ({1})'.format(self.ifname, err))
+            self.netlink.close()
+            self.netlink = None
+
+        # the (non-persistent) interface disappears with its last file descriptor
+        if not [t for t in self.tun_read_threads if t.isAlive()]:
+            self._close_tun_queues()
+
+    def get_stats(self):
+        stats = super(OpenTunLinux, self).get_stats()
+        stats['queues'] = len(self.tun_queues)
+        if len(self.tun_read_threads) == 1:
+            stats.update(self.tun_read_threads[0].get_stats())
+        elif self.tun_read_threads:
+            queue_stats = [t.get_stats() for t in self.tun_read_threads]
+            for key in ['rx_packets', 'rx_packets_per_s', 'rx_batches', 'rx_dropped']:
+                stats[key] = sum([q[key] for q in queue_stats])
+            stats['queue_depth'] = sum([t.queue.qsize() for t in self.dispatch_threads])
+            stats['max_queue_depth'] = max([q['max_queue_depth'] for q in queue_stats])
+            stats['rx_packets_per_queue'] = [q['rx_packets'] for q in queue_stats]
+        if self.tun_write_thread:
+            stats.update(self.tun_write_thread.get_stats())
+
+        # packets routed to the interface while its queue was full, before any read thread saw them
+        netlink = self.netlink
+        if netlink:
+            try:
+                stats['kernel_dropped'] = netlink.get_link_stats(self.if_index)['tx_dropped']
+            except EnvironmentError as err:
+                log.warning('Could not read the statistics of {0} ({1})'.format(self.ifname, err))
+        return stats
+
     # ======================== private =========================================
 
     def _v6_to_internet_notif(self, sender, signal, data):
         """
         Called when receiving data from the EventBus.
 
-        This function forwards the data to the the TUN interface.
+        This function queues the data for the TUN interface.
         Read from tun interface and forward to 6lowPAN
         """
 
         # abort if not tun interface
-        if not self.tun_if:
+        if not self.tun_write_thread:
             return
 
-        # add tun header
-        data = self.VIRTUAL_TUN_ID + data
-
-        # convert data to string
-        data = ''.join([chr(b) for b in data])
-
-        try:
-            # write over tuntap interface
-            os.write(self.tun_if, data)
+        # add tun header and convert data to string
+        if self.tun_write_thread.write(self.tun_header + str(bytearray(data))):
             log.debug("data dispatched to tun correctly {0}, {1}".format(signal, sender))
-        except Exception as err:
-            err_msg = format_critical_message(err)
-            log.critical(err_msg)
+        else:
+            log.warning("dropping packet to tun interface, queue full")
 
     def _create_tun_if(self):
         """
@@ -148,51 +513,129 @@ class OpenTunLinux(OpenTun):
         try:
             # =====
             log.info("opening tun interface")
-            return_val = os.open("/dev/net/tun", os.O_RDWR)
-            ifs = ioctl(return_val, self.TUN_SET_IFF, struct.pack("16sH", "tun%d", self.IFF_TUN))
-            ifname = ifs[:16].strip("\x00")
-
-            # =====
-            log.debug("configuring the IPv6 address")
-            prefix_str = format_ipv6_addr(OpenTun.IPV6PREFIX)
-            host_str = format_ipv6_addr(OpenTun.IPV6HOST)
-
-            _ = os.system('ip tuntap add dev ' + ifname + ' mode tun user root')
-            _ = os.system('ip link set ' + ifname + ' up')
-            _ = os.system('ip -6 addr add ' + prefix_str + ':' + host_str + '/64 dev ' + ifname)
-            _ = os.system('ip -6 addr add fe80::' + host_str + '/64 dev ' + ifname)
+            self._open_tun_queues()
+        except IOError as err:
+            # happens when not root
+            log.warning('Could not created tun interface. Are you root? ({0})'.format(err))
+            self._close_tun_queues()
+            return None
+        return_val = self.tun_queues[0]
 
-            # =====
-            log.debug("adding a static route route")
-            # added 'metric 1' for router-compatibility constraint
-            # (show ping packet on wireshark but don't send to mote at all)
-            os.system('ip -6 route add ' + prefix_str + ':1415:9200::/96 dev ' + ifname + ' metric 1')
-            # trying to set a gateway for this route
-            # os.system('ip -6 route add ' + prefixStr + '::/64 via ' + IPv6Prefix + ':' + hostStr + '/64')
+        try:
+            self.netlink = RtNetlink()
+            self.if_index = self.netlink.link_index(self.ifname)
+            self.netlink.set_tx_queue_len(self.if_index, self.TX_QUEUE_LEN)
+            self.netlink.link_up(self.if_index)
+            self._configure_prefix(OpenTun.IPV6PREFIX)
 
             # =====
             log.debug("enabling IPv6 forwarding")
-            os.system('echo 1 > /proc/sys/net/ipv6/conf/all/forwarding')
+            self.netlink.enable_ipv6_forwarding()
+        except (EnvironmentError, socket.error) as err:
+            log.error('Could not configure tun interface {0} ({1})'.format(self.ifname, err))
+            if self.netlink:
+                self.netlink.close()
+                self.netlink = None
+            self._close_tun_queues()
+            return None
+
+        # =====
+        log.info('created virtual interface {0}: {1}'.format(
+            self.ifname, ', '.join(['{0}/{1}'.format(format_ipv6_addr(list(bytearray(a))), p)
+                                    for (a, p) in self.netlink.get_addresses(self.if_index)])))
+
+        # =====start radvd
+        # os.system('radvd start')
 
-            # =====
-            log.info('created following virtual interfaces')
-            os.system('ip addr show ' + ifname)
+        return return_val
+
+    def _open_tun_queues(self):
+        """
+        Opens the queues of the TUN interface: with more than one queue, each file descriptor attached to the interface
+        (created by the first one) is a separate queue, the kernel spreads the flows sent to the interface over them.
+        """
 
-            # =====start radvd
-            # os.system('radvd start')
+        if self.num_queues > 1:
+            flags = self.IFF_TUN | self.IFF_MULTI_QUEUE
+            try:
+                self.tun_queues.append(self._open_tun_queue("tun%d", flags))
+            except IOError as err:
+                if err.errno != errno.EINVAL:
+                    raise
+                log.warning('multi-queue tun interfaces are not supported, using a single queue')
+                self.num_queues = 1
+        if self.num_queues == 1:
+            self.tun_queues.append(self._open_tun_queue("tun%d", self.IFF_TUN))
+            return
 
-        except IOError as err:
-            # happens when not root
-            log.warning('Could not created tun interface. Are you root? ({0})'.format(err))
-            return_val = None
+        while len(self.tun_queues) < self.num_queues:
+            self.tun_queues.append(self._open_tun_queue(self.ifname, flags))
 
-        return return_val
+    def _open_tun_queue(self, ifname, flags):
+        fd = os.open("/dev/net/tun", os.O_RDWR)
+        try:
+            ifs = ioctl(fd, self.TUN_SET_IFF, struct.pack("16sH", ifname, flags))
+        except IOError:
+            os.close(fd)
+            raise
+        self.ifname = ifs[:16].strip("\x00")
+        return fd
+
+    def _close_tun_queues(self):
+        for fd in self.tun_queues:
+            os.close(fd)
+        self.tun_queues = []
+
+    def _unblock_read_thread(self):
+        """ Closing the read threads wakes them up, wait for all of them to exit. """
+
+        for tun_read_thread in self.tun_read_threads:
+            tun_read_thread.close()
+        for tun_read_thread in self.tun_read_threads:
+            tun_read_thread.join(self.CLOSE_TIMEOUT)
+
+    def _configure_prefix(self, prefix):
+        """ Adds the addresses of the host and the route towards the motes for a prefix, then verifies them. """
+
+        # =====
+        log.debug("configuring the IPv6 address")
+        addresses = [(prefix + OpenTun.IPV6HOST, 64), (self.LINK_LOCAL_PREFIX + OpenTun.IPV6HOST, 64)]
+        for (addr, prefix_len) in addresses:
+            self.netlink.add_address(self.if_index, addr, prefix_len)
+
+        # =====
+        log.debug("adding a static route route")
+        # added 'metric 1' for router-compatibility constraint
+        # (show ping packet on wireshark but don't send to mote at all)
+        self.netlink.add_route(self.if_index, prefix + self.MOTE_ROUTE_SUFFIX, 96, metric=1)
+
+        # =====
+        configured = self.netlink.get_addresses(self.if_index)
+        for (addr, prefix_len) in addresses:
+            if (str(bytearray(addr)), prefix_len) not in configured:
+                raise NetlinkError(errno.EADDRNOTAVAIL, 'address {0}/{1} missing on {2}'.format(
+                    format_ipv6_addr(addr), prefix_len, self.ifname))
+
+        if (str(bytearray(prefix + self.MOTE_ROUTE_SUFFIX)), 96) not in self.netlink.get_routes(self.if_index):
+            raise NetlinkError(errno.ENETUNREACH, 'route to the motes missing on {0}'.format(self.ifname))
+
+    def _unconfigure_prefix(self, prefix):
+        self.netlink.delete_route(self.if_index, prefix + self.MOTE_ROUTE_SUFFIX, 96, metric=1)
+        self.netlink.delete_address(self.if_index, prefix + OpenTun.IPV6HOST, 64)
 
     def _create_tun_read_thread(self):
         """
         Creates and starts the thread to read messages arriving from the
-        TUN interface.
+        TUN interface, or one thread per queue of a multi-queue interface (the first one is returned).
         """
-        return TunReadThread(self.tun_if, self._v6_to_mesh_notif)
+        if len(self.tun_queues) == 1:
+            self.tun_read_threads = [TunReadThread(self.tun_if, self._v6_to_mesh_batch_notif)]
+        else:
+            self.dispatch_threads = [TunDispatchThread(self._v6_to_mesh_batch_notif, 'TunDispatchThread{0}'.format(i))
+                                     for i in range(len(self.tun_queues))]
+            self.tun_read_threads = [TunReadThread(fd, dispatch_threads=self.dispatch_threads,
+                                                   name='TunReadThread{0}'.format(i))
+                                     for (i, fd) in enumerate(self.tun_queues)]
+        return self.tun_read_threads[0]
 
     # ======================== helpers =========================================
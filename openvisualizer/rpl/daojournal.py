@@ -0,0 +1,130 @@
+# Copyright (c) 2010-2013, Regents of the University of California.
+# All rights reserved.
+#
+# Released under the BSD 3-Clause license as published at the link below.
+# https://openwsn.atlassian.net/wiki/display/OW/License
+
+"""
+Module which keeps an append-only journal of the received DAO sequence numbers.
+"""
+
+import logging
+import os
+import threading
+
+log = logging.getLogger('DaoJournal')
+log.setLevel(logging.ERROR)
+log.addHandler(logging.NullHandler())
+
+
+class DaoJournal(object):
+    """
+    Writes one compact '<node> <sequence> <timestamp>' line per received DAO.
+
+    Records are collected in a write buffer and only handed to the file once the buffer is full (or on flush/close).
+    When the journal file grows beyond max_bytes, it is rotated to '<filename>.1', '<filename>.2', ... up to
+    backup_count old journals.
+    """
+
+    DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+    DEFAULT_BACKUP_COUNT = 3
+    DEFAULT_BUFFER_RECORDS = 64
+
+    def __init__(self, filename, max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT,
+                 buffer_records=DEFAULT_BUFFER_RECORDS):
+
+        # store params
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.buffer_records = buffer_records
+
+        # local variables
+        self.data_lock = threading.Lock()
+        self.buffer = []
+        self.file = None
+        self.file_size = 0
+        self.failed = False
+
+    # ======================== public ==========================================
+
+    def record(self, node, seq, timestamp):
+        """
+        Add a DAO record to the journal.
+
+        :param node: String representation of the DAO source.
+        :param seq: RPL DAO sequence number.
+        :param timestamp: Reception time (seconds since the epoch).
+        """
+
+        with self.data_lock:
+            if self.failed:
+                return
+
+            self.buffer.append('{0} {1} {2:.3f}\n'.format(node, seq, timestamp))
+
+            if len(self.buffer) >= self.buffer_records:
+                self._flush()
+
+    def flush(self):
+        with self.data_lock:
+            self._flush()
+
+    def close(self):
+        with self.data_lock:
+            self._flush()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    # ======================== private =========================================
+
+    def _flush(self):
+        if not self.buffer or self.failed:
+            return
+
+        chunk = ''.join(self.buffer)
+        self.buffer = []
+
+        try:
+            if self.file is None:
+                self._open()
+            elif self.max_bytes > 0 and self.file_size + len(chunk) > self.max_bytes:
+                self._rotate()
+
+            self.file.write(chunk)
+            self.file.flush()
+            self.file_size += len(chunk)
+        except (IOError, OSError) as err:
+            log.error("could not write DAO journal: {}".format(err))
+            # stop journaling rather than retrying (and failing) on every DAO
+            self.failed = True
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def _open(self):
+        self.file = open(self.filename, 'a')
+        self.file.seek(0, os.SEEK_END)
+        self.file_size = self.file.tell()
+
+    def _rotate(self):
+        self.file.close()
+        self.file = None
+
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                src = '{0}.{1}'.format(self.filename, i)
+                dst = '{0}.{1}'.format(self.filename, i + 1)
+                if os.path.exists(src):
+                    if os.path.exists(dst):
+                        os.remove(dst)
+                    os.rename(src, dst)
+            dst = '{0}.1'.format(self.filename)
+            if os.path.exists(dst):
+                os.remove(dst)
+            os.rename(self.filename, dst)
+        else:
+            os.remove(self.filename)
+
+        self._open()
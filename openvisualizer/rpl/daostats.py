@@ -0,0 +1,125 @@
+# Copyright (c) 2010-2013, Regents of the University of California.
+# All rights reserved.
+#
+# Released under the BSD 3-Clause license as published at the link below.
+# https://openwsn.atlassian.net/wiki/display/OW/License
+
+"""
+Module which keeps incremental per-node DAO statistics (inter-arrival time, loss, parent changes, route depth).
+"""
+
+from collections import deque
+
+
+class DaoStats(object):
+    """
+    Statistics about the DAOs received from a single node.
+
+    All statistics are updated incrementally on each DAO. Totals are plain counters, windowed statistics are computed
+    over the last WINDOW DAOs only, so the memory used per node is constant no matter how long the network runs.
+    """
+
+    # number of DAOs kept in the rolling windows
+    WINDOW = 64
+
+    # DAO sequence numbers are 8-bit lollipop counters
+    SEQ_MODULO = 256
+    # a forward step larger than this is treated as a reordering/reboot, not as loss
+    SEQ_MAX_GAP = 127
+
+    def __init__(self):
+        self.rx_count = 0
+        self.missed_count = 0
+        self.duplicate_count = 0
+        self.reset_count = 0
+        self.parent_changes = 0
+
+        self.last_seq = None
+        self.last_rx = None
+        self.parent = None
+        self.depth = None
+
+        # rolling windows
+        self.inter_arrivals = deque(maxlen=self.WINDOW)
+        self.missed = deque(maxlen=self.WINDOW)
+        self.parent_changed = deque(maxlen=self.WINDOW)
+        self.depths = deque(maxlen=self.WINDOW)
+
+    # ======================== public ==========================================
+
+    def update(self, seq, parent, depth, timestamp):
+        """
+        Account for a newly received DAO.
+
+        :param seq: RPL DAO sequence number.
+        :param parent: Preferred parent announced in the DAO (tuple), or None.
+        :param depth: Number of hops between the node and the DAG root, or None if unknown.
+        :param timestamp: Reception time (seconds since the epoch).
+        """
+
+        self.rx_count += 1
+
+        if self.last_rx is not None:
+            self.inter_arrivals.append(timestamp - self.last_rx)
+        self.last_rx = timestamp
+
+        missed = 0
+        if self.last_seq is not None:
+            step = (seq - self.last_seq) % self.SEQ_MODULO
+            if step == 0:
+                self.duplicate_count += 1
+            elif step > self.SEQ_MAX_GAP:
+                self.reset_count += 1
+            else:
+                missed = step - 1
+        self.last_seq = seq
+        self.missed_count += missed
+        self.missed.append(missed)
+
+        changed = 0
+        if parent is not None:
+            if self.parent is not None and parent != self.parent:
+                changed = 1
+            self.parent = parent
+        self.parent_changes += changed
+        self.parent_changed.append(changed)
+
+        self.depth = depth
+        if depth is not None:
+            self.depths.append(depth)
+
+    def to_dict(self):
+        """ Summary of the statistics, using only types that can be marshalled over XML-RPC. """
+
+        window_rx = len(self.missed)
+        window_missed = sum(self.missed)
+
+        if self.inter_arrivals:
+            inter_arrival = {
+                'last': self.inter_arrivals[-1],
+                'min': min(self.inter_arrivals),
+                'max': max(self.inter_arrivals),
+                'avg': sum(self.inter_arrivals) / len(self.inter_arrivals),
+            }
+        else:
+            inter_arrival = None
+
+        # parent changes per hour, over the time span covered by the window
+        span = sum(self.inter_arrivals)
+        parent_change_rate = 3600.0 * sum(self.parent_changed) / span if span > 0 else None
+
+        return {
+            'rx': self.rx_count,
+            'missed': self.missed_count,
+            'duplicates': self.duplicate_count,
+            'resets': self.reset_count,
+            'loss': float(self.missed_count) / (self.missed_count + self.rx_count),
+            'window_loss': float(window_missed) / (window_missed + window_rx) if window_rx else 0.0,
+            'last_seq': self.last_seq,
+            'last_rx': self.last_rx,
+            'inter_arrival': inter_arrival,
+            'parent_changes': self.parent_changes,
+            'parent_change_rate': parent_change_rate,
+            'depth': self.depth,
+            'avg_depth': float(sum(self.depths)) / len(self.depths) if self.depths else None,
+        }
@@ -16,11 +16,15 @@ Module which coordinates rpl DIO and DAO messages.
 import logging
 import os
 import threading
+import time
+from collections import deque
 
 from appdirs import user_data_dir
 
 from openvisualizer.eventbus import eventbusclient
 from openvisualizer.rpl import sourceroute
+from openvisualizer.rpl.daojournal import DaoJournal
+from openvisualizer.rpl.daostats import DaoStats
 from openvisualizer.utils import format_addr, format_buf, format_ipv6_addr
 
 log = logging.getLogger('RPL')
@@ -32,6 +36,17 @@ class RPL(eventbusclient.EventBusClient):
     _TARGET_INFORMATION_TYPE = 0x05
     _TRANSIT_INFORMATION_TYPE = 0x06
 
+    # lengths (in bytes) of the DAO base object and of the options we parse
+    _DAO_HEADER_LENGTH = 20
+    _TRANSIT_INFORMATION_LENGTH = 22
+    _TARGET_INFORMATION_LENGTH = 20
+
+    # number of DAO sequence numbers remembered per node
+    DAO_SEQ_HISTORY = 256
+
+    # name of the DAO sequence journal in the user data directory
+    DAO_JOURNAL_FILE = 'dao_sequence.txt'
+
     # Period between successive DIOs, in seconds.
     DIO_PERIOD = 10
 
@@ -87,12 +102,21 @@ class RPL(eventbusclient.EventBusClient):
         self.source_route = sourceroute.SourceRoute()
         self.latency_stats = {}
         self.parents_dao_seq = {}
+        self.dao_journal = DaoJournal(os.path.join(user_data_dir('openvisualizer'), self.DAO_JOURNAL_FILE))
 
     # ======================== public ==========================================
 
     def close(self):
-        # nothing to do
-        pass
+        self.dao_journal.close()
+
+    def get_dao_stats(self):
+        """
+        Returns the DAO statistics of each node that sent a DAO.
+
+        :returns: A dictionary mapping the node address to its statistics (see DaoStats.to_dict).
+        """
+        with self.state_lock:
+            return {node: stats.to_dict() for node, stats in self.latency_stats.items()}
 
     # ======================== private =========================================
 
@@ -186,7 +210,6 @@ class RPL(eventbusclient.EventBusClient):
         Indicate a new DAO was received.
         This function parses the received packet, and if valid, updates the information needed to compute source routes.
         """
-        dao = []
         # retrieve source and destination
         try:
             source = tup[0]
@@ -194,94 +217,97 @@ class RPL(eventbusclient.EventBusClient):
                 source = source[len(source) - 8:]
             dao = tup[1]
         except IndexError:
-            log.warning("DAO too short ({0} bytes), no space for destination and source".format(len(dao)))
+            log.warning("DAO too short, no space for destination and source")
             return
 
         # log
-        output = []
-        output += ['received DAO:']
-        output += ['- source :      {0}'.format(format_addr(source))]
-        output += ['- dao :         {0}'.format(format_buf(dao))]
-        output = '\n'.join(output)
-        log.debug(output)
-
-        # retrieve DAO header
-        dao_header = {}
-        dao_transit_information = {}
-        dao_target_information = {}
-
-        try:
-            # rpl header
-            dao_header['RPL_InstanceID'] = dao[0]
-            dao_header['RPL_flags'] = dao[1]
-            dao_header['RPL_Reserved'] = dao[2]
-            dao_header['RPL_DAO_Sequence'] = dao[3]
-            # DODAGID
-            dao_header['DODAGID'] = dao[4:20]
-
-            dao = dao[20:]
-            # retrieve transit information header and parents
-            parents = []
-            children = []
-
-            while len(dao) > 0:
-                if dao[0] == self._TRANSIT_INFORMATION_TYPE:
-                    # transit information option
-                    dao_transit_information['Transit_information_type'] = dao[0]
-                    dao_transit_information['Transit_information_length'] = dao[1]
-                    dao_transit_information['Transit_information_flags'] = dao[2]
-                    dao_transit_information['Transit_information_path_control'] = dao[3]
-                    dao_transit_information['Transit_information_path_sequence'] = dao[4]
-                    dao_transit_information['Transit_information_path_lifetime'] = dao[5]
-                    # address of the parent
-                    _ = dao[6:14]  # prefix
-                    parents += [dao[14:22]]
-                    dao = dao[22:]
-                elif dao[0] == self._TARGET_INFORMATION_TYPE:
-                    dao_target_information['Target_information_type'] = dao[0]
-                    dao_target_information['Target_information_length'] = dao[1]
-                    dao_target_information['Target_information_flags'] = dao[2]
-                    dao_target_information['Target_information_prefix_length'] = dao[3]
-                    # address of the child
-                    _ = dao[4:12]  # prefix
-                    children += [dao[12:20]]
-                    dao = dao[20:]
-                else:
-                    log.warning("DAO with wrong Option {0}. Neither Transit nor Target.".format(dao[0]))
-                    return
-        except IndexError:
+        if log.isEnabledFor(logging.DEBUG):
+            output = []
+            output += ['received DAO:']
+            output += ['- source :      {0}'.format(format_addr(source))]
+            output += ['- dao :         {0}'.format(format_buf(dao))]
+            output = '\n'.join(output)
+            log.debug(output)
+
+        # retrieve DAO header (RPLInstanceID, flags, reserved, DAOSequence, DODAGID)
+        if len(dao) < self._DAO_HEADER_LENGTH:
             log.warning("DAO too short ({0} bytes), no space for DAO header".format(len(dao)))
             return
 
+        dao_sequence = dao[3]
+
+        # walk the options in place, collecting parents (transit information) and children (target information)
+        parents = []
+        children = []
+
+        offset = self._DAO_HEADER_LENGTH
+        while offset < len(dao):
+            option_type = dao[offset]
+            if option_type == self._TRANSIT_INFORMATION_TYPE:
+                option_length = self._TRANSIT_INFORMATION_LENGTH
+                # address of the parent, after type, length, flags, path control, sequence, lifetime and prefix
+                address_offset = offset + 14
+            elif option_type == self._TARGET_INFORMATION_TYPE:
+                option_length = self._TARGET_INFORMATION_LENGTH
+                # address of the child, after type, length, flags, prefix length and prefix
+                address_offset = offset + 12
+            else:
+                log.warning("DAO with wrong Option {0}. Neither Transit nor Target.".format(option_type))
+                return
+
+            if offset + option_length > len(dao):
+                log.warning("DAO too short ({0} bytes), no space for option {1}".format(len(dao), option_type))
+                return
+
+            if option_type == self._TRANSIT_INFORMATION_TYPE:
+                parents += [dao[address_offset:address_offset + 8]]
+            else:
+                children += [dao[address_offset:address_offset + 8]]
+
+            offset += option_length
+
         # log
-        output = []
-        output += [
-            'received RPL DAO from {0}:{1}'.format(format_ipv6_addr(self.network_prefix), format_ipv6_addr(source))]
-        output += ['- parents:']
-        for p in parents:
-            output += ['   {0}:{1}'.format(format_ipv6_addr(self.network_prefix), format_ipv6_addr(p))]
-        output += ['- children:']
-        for p in children:
-            output += ['   {0}:{1}'.format(format_ipv6_addr(self.network_prefix), format_ipv6_addr(p))]
-        output = '\n\t'.join(output)
-        log.info(output)
+        if log.isEnabledFor(logging.INFO):
+            output = []
+            output += [
+                'received RPL DAO from {0}:{1}'.format(format_ipv6_addr(self.network_prefix),
+                                                       format_ipv6_addr(source))]
+            output += ['- parents:']
+            for p in parents:
+                output += ['   {0}:{1}'.format(format_ipv6_addr(self.network_prefix), format_ipv6_addr(p))]
+            output += ['- children:']
+            for p in children:
+                output += ['   {0}:{1}'.format(format_ipv6_addr(self.network_prefix), format_ipv6_addr(p))]
+            output = '\n\t'.join(output)
+            log.info(output)
 
         node = format_ipv6_addr(source)
-        if not (node in self.parents_dao_seq.keys()):
-            self.parents_dao_seq[node] = [dao_header['RPL_DAO_Sequence']]
-        else:
-            self.parents_dao_seq[node].append(dao_header['RPL_DAO_Sequence'])
+        with self.state_lock:
+            if node not in self.parents_dao_seq:
+                self.parents_dao_seq[node] = deque(maxlen=self.DAO_SEQ_HISTORY)
+            self.parents_dao_seq[node].append(dao_sequence)
 
-        try:
-            with open(os.path.join(user_data_dir('openvisualizer'), 'dao_sequence.txt'), 'a') as f:
-                f.write(str(self.parents_dao_seq) + '\n')
-        except IOError as err:
-            log.error("Permission error: {}".format(err))
+        now = time.time()
+        self.dao_journal.record(node, dao_sequence, now)
 
         # if you get here, the DAO was parsed correctly
 
         # update parents information with parents collected -- calls topology module.
         self.dispatch(signal='updateParents', data=(tuple(source), parents))
 
-        # with self.data_lock:
-        #    self.parents.update({tuple(source):parents})
+        # update the DAO statistics, the depth is only known once the topology has been updated
+        try:
+            depth = self._dispatch_and_get_result(signal='getDepth', data=tuple(source))
+        except SystemError:
+            # unknown depth
+            depth = None
+
+        with self.state_lock:
+            if node not in self.latency_stats:
+                self.latency_stats[node] = DaoStats()
+            self.latency_stats[node].update(
+                dao_sequence,
+                tuple(parents[0]) if parents else None,
+                depth,
+                now,
+            )
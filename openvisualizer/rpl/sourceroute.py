@@ -29,7 +29,6 @@ class SourceRoute(EventBusClient):
 
         # local variables
         self.dataLock = threading.Lock()
-        self.parents = {}
 
         # initialize parent class
         super(SourceRoute, self).__init__(name='SourceRoute', registrations=[])
@@ -40,16 +39,17 @@ class SourceRoute(EventBusClient):
         """
         Retrieve the source route to a given mote.
 
+        The route is computed by the topology, which guarantees it is loop-free and ends at the DAG root.
+
         :param dest_addr: [in] The EUI64 address of the final destination.
 
-        :returns: The source route, a list of EUI64 address, ordered from destination to source.
+        :returns: The source route, a list of EUI64 address, ordered from destination to source. The list is empty if
+            there is no valid route to the destination.
         """
 
-        source_route = []
         with self.dataLock:
             try:
-                parents = self._dispatch_and_get_result(signal='getParents', data=None)
-                self._get_source_route_internal(dest_addr, source_route, parents)
+                source_route = self._dispatch_and_get_result(signal='getRoute', data=dest_addr)
             except Exception as err:
                 log.error(err)
                 raise
@@ -58,31 +58,4 @@ class SourceRoute(EventBusClient):
 
     # ======================== private =========================================
 
-    def _get_source_route_internal(self, dest_addr, source_route, parents):
-
-        if not dest_addr:
-            # no more parents
-            return
-
-        if not parents.get(tuple(dest_addr)):
-            # this node does not have a list of parents
-            return
-
-        # first time add destination address
-        if dest_addr not in source_route:
-            source_route += [dest_addr]
-
-        # pick a parent
-        parent = parents.get(tuple(dest_addr))[0]
-
-        # avoid loops
-        if parent not in source_route:
-            source_route += [parent]
-
-            # add non empty parents recursively
-            nextparent = self._get_source_route_internal(parent, source_route, parents)
-
-            if nextparent:
-                source_route += [nextparent]
-
     # ======================== helpers =========================================
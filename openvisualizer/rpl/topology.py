@@ -18,6 +18,7 @@ import threading
 import time
 
 from openvisualizer.eventbus.eventbusclient import EventBusClient
+from openvisualizer.utils import format_addr
 
 log = logging.getLogger('Topology')
 log.setLevel(logging.ERROR)
@@ -25,6 +26,14 @@ log.addHandler(logging.NullHandler())
 
 
 class Topology(EventBusClient):
+    """
+    Keeps the DODAG as announced by the DAOs.
+
+    Besides the announced parents, the topology keeps an index of the children of each preferred parent and the depth
+    of each node, i.e. the number of hops to the top of its branch. Both are updated on each parent update, which is
+    also when loops are detected: nodes which are part of (or attached below) a loop have no depth and are not
+    routable. Looking up a source route therefore costs O(depth) and never returns a looping route.
+    """
 
     def __init__(self):
 
@@ -35,8 +44,15 @@ class Topology(EventBusClient):
         self.data_lock = threading.Lock()
         self.parents = {}
         self.parents_last_seen = {}
+        self.children = {}
+        self.depths = {}
+        self.dagroot = None
         self.NODE_TIMEOUT_THRESHOLD = 900
 
+        # statistics
+        self.loops_detected = 0
+        self.unroutable_lookups = 0
+
         super(Topology, self).__init__(
             name='topology',
             registrations=[
@@ -50,6 +66,26 @@ class Topology(EventBusClient):
                     'signal': 'getParents',
                     'callback': self.get_parents,
                 },
+                {
+                    'sender': self.WILDCARD,
+                    'signal': 'getRoute',
+                    'callback': self.get_route,
+                },
+                {
+                    'sender': self.WILDCARD,
+                    'signal': 'getDepth',
+                    'callback': self.get_depth,
+                },
+                {
+                    'sender': self.WILDCARD,
+                    'signal': 'registerDagRoot',
+                    'callback': self._register_dagroot_notif,
+                },
+                {
+                    'sender': self.WILDCARD,
+                    'signal': 'unregisterDagRoot',
+                    'callback': self._unregister_dagroot_notif,
+                },
             ],
         )
 
@@ -58,6 +94,67 @@ class Topology(EventBusClient):
     def get_parents(self, sender, signal, data):
         return self.parents
 
+    def get_route(self, sender, signal, data):
+        """
+        Retrieve the route from a node to the top of its branch.
+
+        :param data: The EUI64 address of the node.
+
+        :returns: A list of EUI64 addresses, ordered from the node to the DAG root, or an empty list when the node is
+            unknown, part of a loop or not attached to the DAG root.
+        """
+
+        node = tuple(data) if data else None
+
+        with self.data_lock:
+            if not self.parents.get(node):
+                # this node does not have a list of parents
+                return []
+
+            if self.depths.get(node) is None:
+                self.unroutable_lookups += 1
+                log.debug("no loop-free route to {0}".format(format_addr(node)))
+                return []
+
+            route = [list(node)]
+            hop = node
+            while self.parents.get(hop):
+                hop = tuple(self.parents[hop][0])
+                route += [list(hop)]
+
+            if self.dagroot is not None and hop != self.dagroot:
+                self.unroutable_lookups += 1
+                log.debug("route to {0} ends at {1}, not at the DAG root".format(format_addr(node), format_addr(hop)))
+                return []
+
+        return route
+
+    def get_depth(self, sender, signal, data):
+        """
+        Returns the depth of a node from the index, without walking its route.
+
+        :param data: The EUI64 address of the node.
+
+        :returns: The number of hops to the top of the branch of the node, or None when the node is unknown, part of a
+            loop or at the top of its branch.
+        """
+
+        with self.data_lock:
+            return self.depths.get(tuple(data)) or None
+
+    def get_stats(self):
+        """ Returns the size and consistency statistics of the DODAG. """
+
+        with self.data_lock:
+            depths = [d for d in self.depths.values() if d is not None]
+            return {
+                'nodes': len(self.parents),
+                'max_depth': max(depths) if depths else 0,
+                'looped_nodes': len(self.depths) - len(depths),
+                'loops_detected': self.loops_detected,
+                'unroutable_lookups': self.unroutable_lookups,
+            }
+
     def get_dag(self):
         states = []
         edges = []
@@ -82,8 +179,24 @@ class Topology(EventBusClient):
         """ inserts parent information into the parents dictionary """
         with self.data_lock:
             # data[0] == source address, data[1] == list of parents
-            self.parents.update({data[0]: data[1]})
-            self.parents_last_seen.update({data[0]: time.time()})
+            node = tuple(data[0])
+            old_parent = self._preferred_parent(node)
+            self.parents.update({node: data[1]})
+            self.parents_last_seen.update({node: time.time()})
+            new_parent = self._preferred_parent(node)
+
+            if new_parent != old_parent:
+                self._unlink(node, old_parent)
+                if new_parent is not None:
+                    self.children.setdefault(new_parent, set()).add(node)
+
+                if new_parent is not None and self._reaches(new_parent, node):
+                    self.loops_detected += 1
+                    log.warning("loop detected: {0} selected its descendant {1} as parent".format(
+                        format_addr(node), format_addr(new_parent)))
+
+            if new_parent != old_parent or node not in self.depths:
+                self._update_depths(node)
 
         self._clear_node_timeout()
 
@@ -93,9 +206,74 @@ class Topology(EventBusClient):
             for node in self.parents_last_seen.keys():
                 if self.parents_last_seen[node] < threshold:
                     if node in self.parents:
+                        self._unlink(node, self._preferred_parent(node))
                         del self.parents[node]
+                        self._update_depths(node)
                     del self.parents_last_seen[node]
 
     # ======================== private =========================================
 
+    def _register_dagroot_notif(self, sender, signal, data):
+        with self.data_lock:
+            self.dagroot = tuple(data['host'])
+
+    def _unregister_dagroot_notif(self, sender, signal, data):
+        with self.data_lock:
+            self.dagroot = None
+
     # ======================== helpers =========================================
+
+    def _preferred_parent(self, node):
+        parents = self.parents.get(node)
+        return tuple(parents[0]) if parents else None
+
+    def _unlink(self, node, parent):
+        if parent is None or parent not in self.children:
+            return
+        self.children[parent].discard(node)
+        if not self.children[parent]:
+            del self.children[parent]
+
+    def _reaches(self, start, target):
+        """ Returns True if walking up the preferred parents from start reaches target. """
+        visited = set()
+        hop = start
+        while hop is not None and hop not in visited:
+            if hop == target:
+                return True
+            visited.add(hop)
+            hop = self._preferred_parent(hop)
+        return False
+
+    def _update_depths(self, node):
+        """ Recompute the depth of node and of every node below it. """
+
+        parent = self._preferred_parent(node)
+        if parent is None:
+            depth = 0
+        elif self._reaches(parent, node):
+            depth = None
+        elif parent in self.parents:
+            depth = self.depths.get(parent)
+            depth = depth + 1 if depth is not None else None
+        else:
+            # parent is the top of the branch
+            depth = 1
+
+        if node in self.parents:
+            self.depths[node] = depth
+        else:
+            self.depths.pop(node, None)
+
+        # walk down the subtree, the visited set stops at the loop (if any)
+        visited = {node}
+        stack = [(node, depth)]
+        while stack:
+            (hop, hop_depth) = stack.pop()
+            for child in self.children.get(hop, ()):
+                if child in visited:
+                    continue
+                visited.add(child)
+                child_depth = hop_depth + 1 if hop_depth is not None else None
+                self.depths[child] = child_depth
+                stack.append((child, child_depth))
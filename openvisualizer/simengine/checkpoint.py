@@ -0,0 +1,301 @@
+#!/usr/bin/python
+# Copyright (c) 2010-2013, Regents of the University of California.
+# All rights reserved.
+#
+# Released under the BSD 3-Clause license as published at the link below.
+# https://openwsn.atlassian.net/wiki/display/OW/License
+
+"""
+Checkpoints of the simulation: the timeline, the connections and ongoing transmissions, the random generators, the
+state of the emulated hardware and BSP modules of each mote (supply, crystal drift, timers, radio, UART buffers...),
+and the memory of its firmware, saved to a file.
+
+The state of each emulated module is listed explicitly (MOTE_STATE), so that nothing is silently left out. The memory
+of the firmware is read and written through get_state() / set_state(state) on the firmware mote object: a booted
+mote whose firmware does not provide them cannot be saved, and CheckpointError is raised.
+
+A checkpoint is restored into an engine with the same motes (same IDs), created the same way. The firmware does not
+keep any state on its stack while it sleeps, so each mote is booted until it first goes to sleep, and its memory is
+then overwritten with the saved one. Checkpoints are taken and restored from the thread executing the events,
+between two of them (when the simulation is paused, or between two calls to TimeLine.run_until).
+"""
+
+import Queue
+import copy
+import cPickle as pickle
+import functools
+import heapq
+import itertools
+import logging
+import random
+
+from openvisualizer.simengine.timeline import TimeLineEvent
+
+log = logging.getLogger('Checkpoint')
+log.setLevel(logging.ERROR)
+log.addHandler(logging.NullHandler())
+
+# ============================ defines =========================================
+
+CHECKPOINT_VERSION = 6
+
+# the state of the emulated modules of a mote, the UART queue is saved apart
+MOTE_STATE = [
+    ('hw_supply', ['mote_on']),
+    ('hw_crystal', ['drift', 'period_num', 'period_den', 'ts_tick']),
+    ('bsp_board', ['is_initialized']),
+    ('bsp_debugpins', [
+        'is_initialized', 'framePinHigh', 'slotPinHigh', 'fsmPinHigh', 'taskPinHigh', 'isrPinHigh', 'radioPinHigh',
+        'kaPinHigh', 'syncPacketPinHigh', 'syncAckPinHigh', 'debugPinHigh',
+    ]),
+    ('bsp_eui64', ['is_initialized']),
+    ('bsp_leds', ['is_initialized', 'error_led_on', 'radio_led_on', 'sync_led_on', 'debug_led_on']),
+    ('bsp_sctimer', [
+        'is_initialized', 'running', 'compare_armed', 'time_last_reset', 'time_last_compare', 'int_enabled',
+    ]),
+    ('bsp_radio', [
+        'is_initialized', 'state', 'frequency', 'is_rf_on', 'tx_buf', 'rx_buf', 'rx_from', 'delay_tx', 'rssi', 'lqi',
+        'crc_passes',
+    ]),
+    ('bsp_uart', [
+        'is_initialized', 'interrupts_enabled', 'tx_interrupt_flag', 'rx_interrupt_flag', 'uart_rx_buffer',
+        'uart_tx_buffer', 'uart_tx_next', 'f_xon_xoff_escaping', 'xon_xoff_escaped_byte',
+    ]),
+]
+
+# the state of the mote handler itself
+MOTE_ATTRIBUTES = ['location', 'num_rx_commands', 'num_tx_commands']
+
+# the state of the propagation model
+PROPAGATION_STATE = [
+    'connections', 'in_flight', 'stats', 'collision_model', 'active', 'tx_channels', 'corrupted', 'link_stats',
+    'outgoing',
+]
+
+
+class CheckpointError(Exception):
+    """ The simulation cannot be saved to, or restored from, a checkpoint. """
+    pass
+
+
+# ============================ public ==========================================
+
+def save(engine, path):
+    """ Saves the state of the simulation to a file. """
+
+    state = get_state(engine)
+    with open(path, 'wb') as f:
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+
+    log.info('saved {0} motes and {1} events at {2}ns to {3}'.format(
+        len(state['motes']), len(state['timeline']['events']), state['timeline']['current_time'], path))
+
+
+def load(engine, path):
+    """ Restores the state of the simulation from a file. """
+
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+    set_state(engine, state)
+
+    log.info('restored {0} motes and {1} events at {2}ns from {3}'.format(
+        len(state['motes']), len(state['timeline']['events']), state['timeline']['current_time'], path))
+
+
+def get_state(engine):
+    """ Returns the state of the simulation, as plain (picklable) data. """
+
+    # the calls queued by other threads (frames written to the UARTs) run now, as they would before the next event
+    timeline = engine.timeline
+    if timeline.calls:
+        timeline._run_calls()
+
+    motes = {}
+    for mh in engine.moteHandlers:
+        if mh.booted and not hasattr(mh.mote, 'get_state'):
+            raise CheckpointError('the firmware memory of mote {0} cannot be saved, it has no get_state()'.format(
+                mh.get_id()))
+        motes[mh.get_id()] = {
+            'booted': mh.booted,
+            'attributes': dict((name, getattr(mh, name)) for name in MOTE_ATTRIBUTES),
+            'modules': dict((name, _get_module_state(mh, name, attributes)) for (name, attributes) in MOTE_STATE),
+            'uart_rx_queue': _get_queue(mh.bsp_uart.uart_rx_queue),
+            'firmware': mh.mote.get_state() if mh.booted else None,
+        }
+
+    return copy.deepcopy({
+        'version': CHECKPOINT_VERSION,
+        'timeline': _get_timeline_state(engine),
+        'propagation': _get_propagation_state(engine.propagation),
+        'motes': motes,
+        'random': {
+            'global': random.getstate(),
+            'propagation': engine.propagation.random.getstate(),
+            'pdr_matrix': engine.propagation.rng.get_state() if engine.propagation.rng is not None else None,
+            'location': engine.location_manager.random.getstate(),
+        },
+    })
+
+
+def set_state(engine, state):
+    """ Restores the state of the simulation, as returned by get_state. """
+
+    if state.get('version') != CHECKPOINT_VERSION:
+        raise CheckpointError('unsupported checkpoint version {0}'.format(state.get('version')))
+    state = copy.deepcopy(state)
+
+    mote_ids = sorted([mh.get_id() for mh in engine.moteHandlers])
+    if mote_ids != sorted(state['motes'].keys()):
+        raise CheckpointError('the checkpoint is for motes {0}, not {1}'.format(
+            sorted(state['motes'].keys()), mote_ids))
+    for mh in engine.moteHandlers:
+        if state['motes'][mh.get_id()]['booted'] and not hasattr(mh.mote, 'set_state'):
+            raise CheckpointError('the firmware memory of mote {0} cannot be restored, it has no set_state()'.format(
+                mh.get_id()))
+
+    # boot the motes, so that their firmware sleeps and only its memory needs to be restored
+    for mh in engine.moteHandlers:
+        if state['motes'][mh.get_id()]['booted'] and not mh.booted:
+            mh.handle_event(mh.hw_supply.switch_on)
+
+    # the events scheduled while booting are replaced by the saved ones
+    _set_timeline_state(engine, state['timeline'])
+    _set_propagation_state(engine.propagation, state['propagation'])
+
+    for mh in engine.moteHandlers:
+        saved = state['motes'][mh.get_id()]
+        for (name, value) in saved['attributes'].items():
+            setattr(mh, name, value)
+        engine.location_manager.move_mote(mh.get_id(), mh.location)
+        for (name, attributes) in saved['modules'].items():
+            _set_module_state(mh, name, attributes)
+        _set_queue(mh.bsp_uart.uart_rx_queue, saved['uart_rx_queue'])
+        if saved['firmware'] is not None:
+            mh.mote.set_state(saved['firmware'])
+
+    random.setstate(state['random']['global'])
+    engine.propagation.random.setstate(state['random']['propagation'])
+    if engine.propagation.rng is not None and state['random']['pdr_matrix'] is not None:
+        engine.propagation.rng.set_state(state['random']['pdr_matrix'])
+    engine.location_manager.random.setstate(state['random']['location'])
+
+
+# ============================ helpers =========================================
+
+def _get_timeline_state(engine):
+    timeline = engine.timeline
+
+    events = []
+    for (at_time, seq, event) in sorted(timeline.timeline):
+        if not event.cancelled:
+            events.append((at_time, seq, event.mote_id, event.desc, _encode_callback(engine, event)))
+
+    return {
+        'current_time': timeline.get_current_time_ns(),
+        'num_events': timeline.get_stats().get_num_events(),
+        'events': events,
+    }
+
+
+def _set_timeline_state(engine, state):
+    timeline = engine.timeline
+
+    events = [(at_time, seq, mote_id, desc, _decode_callback(engine, mote_id, cb))
+              for (at_time, seq, mote_id, desc, cb) in state['events']]
+
+    timeline.timeline = []
+    timeline.pending = {}
+    timeline.num_cancelled = 0
+    for (at_time, seq, mote_id, desc, cb) in events:
+        event = TimeLineEvent(mote_id, at_time, cb, desc, seq)
+        timeline.pending[(mote_id, desc)] = event
+        timeline.timeline.append((at_time, seq, event))
+    heapq.heapify(timeline.timeline)
+    timeline.seq = itertools.count(max([e[1] for e in events]) + 1 if events else 0)
+    timeline.current_time = state['current_time']
+    timeline.get_stats().numEvents = state['num_events']
+
+
+def _get_propagation_state(propagation):
+    with propagation.data_lock:
+        return dict((name, getattr(propagation, name)) for name in PROPAGATION_STATE)
+
+
+def _set_propagation_state(propagation, state):
+    with propagation.data_lock:
+        for name in PROPAGATION_STATE:
+            setattr(propagation, name, state[name])
+
+
+def _get_module_state(mh, name, attributes):
+    module = getattr(mh, name)
+    if name == 'bsp_uart':
+        with module.uart_tx_buffer_lock:
+            return dict((attribute, copy.deepcopy(getattr(module, attribute))) for attribute in attributes)
+    return dict((attribute, getattr(module, attribute)) for attribute in attributes)
+
+
+def _set_module_state(mh, name, state):
+    module = getattr(mh, name)
+    if name == 'bsp_uart':
+        with module.uart_tx_buffer_lock:
+            module.__dict__.update(state)
+    else:
+        module.__dict__.update(state)
+
+
+def _get_queue(queue):
+    with queue.mutex:
+        return list(queue.queue)
+
+
+def _set_queue(queue, items):
+    """ Replaces the contents of a queue, which other threads may be reading. """
+
+    while True:
+        try:
+            queue.get_nowait()
+        except Queue.Empty:
+            break
+    for item in items:
+        queue.put(item)
+
+
+def _encode_callback(engine, event):
+    """
+    Returns a description of the callback of an event: the name of the module of the mote (or 'propagation') which
+    owns the method to call, the name of that method, and its arguments.
+    """
+
+    cb = event.cb
+    args = ()
+    if isinstance(cb, functools.partial):
+        (cb, args) = (cb.func, cb.args)
+
+    owner = getattr(cb, 'im_self', None)
+    if owner is not None and owner is engine.propagation:
+        return 'propagation', cb.__name__, args
+
+    if owner is not None and event.mote_id is not None:
+        mh = engine.get_mote_handler_by_id(event.mote_id)
+        if owner is mh:
+            return '', cb.__name__, args
+        for (name, _) in MOTE_STATE:
+            if getattr(mh, name, None) is owner:
+                return name, cb.__name__, args
+
+    raise CheckpointError('cannot save event {0}'.format(event))
+
+
+def _decode_callback(engine, mote_id, cb):
+    (owner_name, method_name, args) = cb
+
+    if owner_name == 'propagation':
+        owner = engine.propagation
+    else:
+        owner = engine.get_mote_handler_by_id(mote_id)
+        if owner_name:
+            owner = getattr(owner, owner_name)
+
+    method = getattr(owner, method_name)
+    return functools.partial(method, *args) if args else method
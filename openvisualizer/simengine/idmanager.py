@@ -36,6 +36,15 @@ class IdManager(object):
 
         return self.current_id
 
+    def set_next_id(self, mote_id):
+        """ The next mote created gets that ID (and the following ones the IDs after it). """
+        self.current_id = mote_id - 1
+
+    @staticmethod
+    def get_eui64(mote_id):
+        """ Returns the EUI64 of the emulated mote with that ID, as a list of 8 bytes. """
+        return [0x14, 0x15, 0x92, 0xcc, 0x00, 0x00, ((mote_id >> 8) & 0xff), ((mote_id >> 0) & 0xff)]
+
     # ======================== private =========================================
 
     # ======================== helpers =========================================
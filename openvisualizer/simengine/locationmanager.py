@@ -6,11 +6,23 @@
 # https://openwsn.atlassian.net/wiki/display/OW/License
 
 import logging
+import math
 import random
 
 
 class LocationManager(object):
-    """ The module which assigns locations to the motes. """
+    """
+    The module which assigns locations to the motes.
+
+    It also keeps a spatial index of the locations of the motes, to find the motes within some distance of a point
+    without looking at all of them. The motes are placed on a grid of cubic cells, using their cartesian coordinates
+    (in km, with the center of the Earth as origin): the distance between two points in space is never longer than
+    the distance along the surface of the Earth, so the motes within some distance are all in the cells around the
+    point.
+    """
+
+    EARTH_RADIUS_km = 6367
+    CELL_SIZE_km = 1.0
 
     def __init__(self):
         # store params
@@ -18,6 +30,9 @@ class LocationManager(object):
         self.engine = simengine.SimEngine()
 
         # local variables
+        self.random = random.Random()
+        self.cells = {}  # cell -> {mote_id: coordinates}
+        self.mote_cells = {}  # mote_id -> cell
 
         # logging
         self.log = logging.getLogger('LocationManager')
@@ -26,10 +41,11 @@ class LocationManager(object):
 
     # ======================== public ==========================================
 
+    def set_random(self, rng):
+        self.random = rng
+
     def get_location(self):
-        # get random location around Cory Hall, UC Berkeley
-        lat = 37.875095 - 0.0005 + random.random() * 0.0010
-        lon = -122.257473 - 0.0005 + random.random() * 0.0010
+        (lat, lon) = self.draw_location(self.random)
 
         # debug
         if self.log.isEnabledFor(logging.DEBUG):
@@ -37,6 +53,66 @@ class LocationManager(object):
 
         return lat, lon
 
+    def add_mote(self, mote_id, location):
+        """ Adds a mote to the spatial index (or moves it, if it is already indexed). """
+
+        self.remove_mote(mote_id)
+        coordinates = self._coordinates(location)
+        cell = self._cell(coordinates)
+        self.cells.setdefault(cell, {})[mote_id] = coordinates
+        self.mote_cells[mote_id] = cell
+
+    def move_mote(self, mote_id, location):
+        """ Updates the location of an indexed mote. """
+
+        if mote_id in self.mote_cells:
+            self.add_mote(mote_id, location)
+
+    def remove_mote(self, mote_id):
+        cell = self.mote_cells.pop(mote_id, None)
+        if cell is not None:
+            del self.cells[cell][mote_id]
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def get_motes_within(self, location, distance_km):
+        """
+        Returns the indexed motes which may be within distance_km of a location.
+
+        All the motes closer than distance_km are returned, some of the returned motes may be slightly farther away.
+        """
+
+        (x, y, z) = coordinates = self._coordinates(location)
+        span = int(math.ceil(distance_km / self.CELL_SIZE_km))
+        (cx, cy, cz) = self._cell(coordinates)
+
+        motes = []
+        for i in range(cx - span, cx + span + 1):
+            for j in range(cy - span, cy + span + 1):
+                for k in range(cz - span, cz + span + 1):
+                    for (mote_id, (mx, my, mz)) in self.cells.get((i, j, k), {}).items():
+                        if (mx - x) ** 2 + (my - y) ** 2 + (mz - z) ** 2 <= distance_km ** 2:
+                            motes.append(mote_id)
+        return motes
+
+    @staticmethod
+    def draw_location(rng):
+        """ Returns a random location around Cory Hall, UC Berkeley, drawn from rng. """
+        lat = 37.875095 - 0.0005 + rng.random() * 0.0010
+        lon = -122.257473 - 0.0005 + rng.random() * 0.0010
+        return lat, lon
+
     # ======================== private =========================================
 
+    def _coordinates(self, location):
+        (lat, lon) = map(math.radians, location)
+        return (
+            self.EARTH_RADIUS_km * math.cos(lat) * math.cos(lon),
+            self.EARTH_RADIUS_km * math.cos(lat) * math.sin(lon),
+            self.EARTH_RADIUS_km * math.sin(lat),
+        )
+
+    def _cell(self, coordinates):
+        return tuple([int(math.floor(c / self.CELL_SIZE_km)) for c in coordinates])
+
     # ======================== helpers =========================================
@@ -8,6 +8,11 @@
 import logging
 import threading
 
+try:
+    import greenlet
+except ImportError:
+    greenlet = None
+
 from openvisualizer.bspemulator import bspboard
 from openvisualizer.bspemulator import bspdebugpins
 from openvisualizer.bspemulator import bspeui64
@@ -55,6 +60,15 @@ def notif_id(s):
 # ============================ classes =========================================
 
 class MoteHandler(threading.Thread):
+    """
+    Runs the firmware of an emulated mote.
+
+    The firmware runs its scheduler loop until it has nothing left to do and goes to sleep (board_sleep). The timeline
+    then runs the interrupt handlers, and resumes the firmware when an interrupt kicks the scheduler. By default, the
+    firmware runs in a greenlet of the timeline thread, so handing over the CPU is a plain stack switch. Alternatively
+    (SimEngine.set_mote_threads or when greenlet is not installed), each mote runs in its own thread and the CPU is
+    handed over through the cpu_running/cpu_done locks.
+    """
 
     def __init__(self, mote, vcdlog):
 
@@ -84,6 +98,9 @@ class MoteHandler(threading.Thread):
         self.bsp_uart = bspuart.BspUart(self)
         # status
         self.booted = False
+        # execution model
+        self.inline = greenlet is not None and not self.engine.mote_threads
+        self.cpu = None
         self.cpu_running = threading.Lock()
         self.cpu_running.acquire()
         self.cpu_done = threading.Lock()
@@ -211,6 +228,8 @@ class MoteHandler(threading.Thread):
 
         # log
         self.log.info('thread initialized')
+        if greenlet is None and not self.engine.mote_threads:
+            self.log.warning('greenlet is not installed, running the mote in its own thread')
 
     def run(self):
 
@@ -232,6 +251,7 @@ class MoteHandler(threading.Thread):
 
     def set_location(self, lat, lon):
         self.location = (lat, lon)
+        self.engine.location_manager.move_mote(self.id, self.location)
 
     def handle_event(self, function_to_call):
 
@@ -242,11 +262,16 @@ class MoteHandler(threading.Thread):
             # I'm not booted
             self.booted = True
 
-            # start the thread's execution
-            self.start()
+            if self.inline:
+                # run the firmware until it goes to sleep
+                self.cpu = greenlet.greenlet(self.run)
+                self.cpu.switch()
+            else:
+                # start the thread's execution
+                self.start()
 
-            # wait for CPU to be done
-            self.cpu_done.acquire()
+                # wait for CPU to be done
+                self.cpu_done.acquire()
 
         else:
             # call the funcion (mote runs in ISR)
@@ -255,10 +280,25 @@ class MoteHandler(threading.Thread):
             assert kick_scheduler in [True, False]
 
             if kick_scheduler:
-                # release the mote's CPU (mote runs in task mode)
-                self.cpu_running.release()
+                if self.inline:
+                    # resume the firmware (mote runs in task mode) until it goes back to sleep
+                    self.cpu.switch()
+                else:
+                    # release the mote's CPU (mote runs in task mode)
+                    self.cpu_running.release()
 
-                # wait for CPU to be done
-                self.cpu_done.acquire()
+                    # wait for CPU to be done
+                    self.cpu_done.acquire()
+
+    def cpu_sleep(self):
+        """ Called by the firmware when it goes to sleep, returns when an interrupt kicks the scheduler. """
+
+        if self.inline:
+            self.cpu.parent.switch()
+        else:
+            self.cpu_done.release()
+
+            # block the mote until CPU is released by ISR
+            self.cpu_running.acquire()
 
     # ======================== private =========================================
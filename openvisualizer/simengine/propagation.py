@@ -5,16 +5,50 @@
 # Released under the BSD 3-Clause license as published at the link below.
 # https://openwsn.atlassian.net/wiki/display/OW/License
 
+import functools
 import logging
 import random
 import threading
 from math import radians, cos, sin, asin, sqrt, log10
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from openvisualizer.eventbus.eventbusclient import EventBusClient
 
 
 class Propagation(EventBusClient):
-    """ The propagation model of the engine. """
+    """
+    The propagation model of the engine.
+
+    The start and end of a transmission are indicated to the receiving motes when the transmitting mote signals them.
+
+    In a sharded simulation (set_shard), the engine only simulates some of the motes of the network, and only indicates
+    the transmissions to them. A mote commits to a transmission, and to the times of its start and end, when its radio
+    is told to send (radio_txNow), at least the lookahead before the frame starts: the transmission is then queued in
+    outgoing for the other shards simulating neighbours of the mote (announce_transmission), which schedule its start
+    and end on their own timeline (schedule_transmission). Each shard thus sees all the transmissions its motes hear,
+    at the same times as a single engine would.
+
+    The connections are kept as a sparse PDR matrix: connections[from_mote][to_mote] is the PDR of the link, absent
+    links are not stored. The matrix is copy-on-write: it is never modified in place, each edit (or bulk update,
+    update_connections) builds a new one under the data lock, which then replaces the old one at once. Readers, such as
+    the transmissions, use the current matrix without locking, and always see a consistent one. When NumPy is
+    installed, the Pister-hack PDRs of a new mote towards all the others are computed at once (compute_pdr_matrix).
+    The PDRs and the frame losses are drawn from generators of the propagation model, which can be seeded (set_random).
+
+    The receivers of each ongoing transmission are kept in in_flight[from_mote], so that the end of a transmission is
+    only indicated to the motes which received its start.
+
+    With the collision model (set_collision_model), the ongoing transmissions of each channel are kept in
+    active[channel]: they are exactly the ones overlapping a transmission which starts, so each start is only checked
+    against them. A reception is corrupted as soon as its SINR falls below the capture threshold; the received power
+    of a link is derived from its PDR by inverting the grey area of the Pister-hack model. The end of a corrupted
+    reception is indicated with a failed CRC. The transmitters which are not connected to a receiver are neglected, so
+    in a sharded simulation, the transmissions each shard sees are enough to find the same collisions.
+    """
 
     SIGNAL_WIRELESSTXSTART = 'wirelessTxStart'
     SIGNAL_WIRELESSTXEND = 'wirelessTxEnd'
@@ -24,6 +58,9 @@ class Propagation(EventBusClient):
     PISTER_HACK_LOSS = 40.0
     SENSITIVITY_dBm = -101.0
     GREY_AREA_dB = 15.0
+    NOISE_FLOOR_dBm = -105.0
+    CAPTURE_THRESHOLD_dB = 3.0
+    EARTH_RADIUS_km = 6367
 
     def __init__(self, sim_topology):
 
@@ -35,7 +72,26 @@ class Propagation(EventBusClient):
         # local variables
         self.data_lock = threading.Lock()
         self.connections = {}
-        self.pending_tx_end = []
+        self.in_flight = {}  # from_mote -> set of the motes receiving its ongoing transmission
+        self.stats = {
+            'transmissions': 0,
+            'frames_delivered': 0,
+            'frames_dropped': 0,
+            'frames_truncated': 0,
+            'frames_collided': 0,
+        }
+        self.collision_model = False
+        self.active = {}  # channel -> set of the motes transmitting on it
+        self.tx_channels = {}  # from_mote -> channel of its ongoing transmission
+        self.corrupted = set()  # (from_mote, to_mote) of the ongoing receptions which collided
+        self.link_stats = {}  # (from_mote, to_mote) -> [receptions, collisions]
+        self.shard_id = None
+        self.mote_shards = None  # mote_id -> shard_id, in a sharded simulation
+        self.lookahead = None  # minimum delay between the announcement and the start of a transmission, in ns
+        self.outgoing = []  # transmissions to forward, as (start_time, to_shard, from_mote, packet, channel, end_time)
+        self.rng = None  # NumPy generator, for the PDR matrices
+        self.random = None  # generator of the PDRs computed one at a time and of the frame losses
+        self.set_random(random.Random())
 
         # logging
         self.log = logging.getLogger('Propagation')
@@ -62,108 +118,200 @@ class Propagation(EventBusClient):
     # ======================== public ==========================================
 
     def create_connection(self, from_mote, to_mote):
+        """ Creates (or updates, or deletes) the connection between two motes, as given by the propagation model. """
+        self.update_connections([(from_mote, to_mote, self._compute_pdr(from_mote, to_mote))])
 
-        with self.data_lock:
+    def create_connections(self, from_mote, to_motes):
+        """ Creates (or updates, or deletes) the connections from a mote to several others at once. """
 
-            if not self.sim_topology:
-
-                # ===== Pister-hack model
-
-                # retrieve position
-                mh_from = self.engine.get_mote_handler_by_id(from_mote)
-                (lat_from, lon_from) = mh_from.get_location()
-                mh_to = self.engine.get_mote_handler_by_id(to_mote)
-                (lat_to, lon_to) = mh_to.get_location()
-
-                # compute distance
-                lon_from, lat_from, lon_to, lat_to = map(radians, [lon_from, lat_from, lon_to, lat_to])
-                d_lon = lon_to - lon_from
-                d_lat = lat_to - lat_from
-                a = sin(d_lat / 2) ** 2 + cos(lat_from) * cos(lat_to) * sin(d_lon / 2) ** 2
-                c = 2 * asin(sqrt(a))
-                d_km = 6367 * c
-
-                # compute reception power (first Friis, then apply Pister-hack)
-                p_rx = self.TX_POWER_dBm - (20 * log10(d_km) + 20 * log10(self.FREQUENCY_GHz) + 92.45)
-                p_rx -= self.PISTER_HACK_LOSS * random.random()
-
-                # turn into PDR
-                if p_rx < self.SENSITIVITY_dBm:
-                    pdr = 0.0
-                elif p_rx > self.SENSITIVITY_dBm + self.GREY_AREA_dB:
-                    pdr = 1.0
-                else:
-                    pdr = (p_rx - self.SENSITIVITY_dBm) / self.GREY_AREA_dB
+        to_motes = list(to_motes)
+        if not to_motes:
+            return
 
-            elif self.sim_topology == 'linear':
+        if self.sim_topology or numpy is None:
+            pdrs = [self._compute_pdr(from_mote, to_mote) for to_mote in to_motes]
+        else:
+            pdrs = self.compute_pdr_matrix([from_mote], to_motes)[0].tolist()
 
-                # linear network
-                if from_mote == to_mote + 1:
-                    pdr = 1.0
-                else:
-                    pdr = 0.0
+        self.update_connections([(from_mote, to_mote, pdr) for (to_mote, pdr) in zip(to_motes, pdrs)])
 
-            elif self.sim_topology == 'fully-meshed':
+    def update_connections(self, links):
+        """
+        Creates, updates or deletes several connections at once: the transmissions either see all the changes, or none.
 
-                pdr = 1.0
+        :param links: (from_mote, to_mote, pdr) tuples, the connections with a PDR of 0 are deleted.
+        """
 
-            else:
-
-                raise NotImplementedError('unsupported sim_topology={0}'.format(self.sim_topology))
-
-            # ==== create, update or delete connection
+        with self.data_lock:
+            self.connections = self._updated(self.connections, links)
 
-            if pdr:
-                if from_mote not in self.connections:
-                    self.connections[from_mote] = {}
-                self.connections[from_mote][to_mote] = pdr
+    def set_connections(self, connections):
+        """ Replaces all the connections at once, given as returned by retrieve_connections. """
 
-                if to_mote not in self.connections:
-                    self.connections[to_mote] = {}
-                self.connections[to_mote][from_mote] = pdr
-            else:
-                self.delete_connection(to_mote, from_mote)
+        links = [(c['fromMote'], c['toMote'], c['pdr']) for c in connections]
+        with self.data_lock:
+            self.connections = self._updated({}, links)
+
+    def compute_pdr_matrix(self, from_motes, to_motes):
+        """
+        Computes the Pister-hack PDRs between two sets of motes with NumPy (one random draw per pair).
+
+        :returns: A matrix with one row per mote of from_motes, and one column per mote of to_motes.
+        """
+
+        from_locations = numpy.radians([self.engine.get_mote_handler_by_id(m).get_location() for m in from_motes])
+        to_locations = numpy.radians([self.engine.get_mote_handler_by_id(m).get_location() for m in to_motes])
+        (lat_from, lon_from) = (from_locations[:, 0:1], from_locations[:, 1:2])
+        (lat_to, lon_to) = (to_locations[:, 0], to_locations[:, 1])
+
+        # compute distance (haversine)
+        a = numpy.sin((lat_to - lat_from) / 2) ** 2 + \
+            numpy.cos(lat_from) * numpy.cos(lat_to) * numpy.sin((lon_to - lon_from) / 2) ** 2
+        d_km = self.EARTH_RADIUS_km * 2 * numpy.arcsin(numpy.sqrt(a))
+
+        # compute reception power (first Friis, then apply Pister-hack)
+        with numpy.errstate(divide='ignore'):
+            p_rx = self.TX_POWER_dBm - (20 * numpy.log10(d_km) + 20 * log10(self.FREQUENCY_GHz) + 92.45)
+        p_rx -= self.PISTER_HACK_LOSS * self.rng.random_sample(p_rx.shape)
+
+        # turn into PDR
+        return numpy.clip((p_rx - self.SENSITIVITY_dBm) / self.GREY_AREA_dB, 0.0, 1.0)
+
+    @classmethod
+    def pister_hack_pdr(cls, location_from, location_to, draw):
+        """ Returns the PDR of the link between two locations (lat, lon), given the Pister-hack draw (in [0, 1)). """
+
+        # compute distance
+        (lat_from, lon_from, lat_to, lon_to) = map(radians, location_from + location_to)
+        d_lon = lon_to - lon_from
+        d_lat = lat_to - lat_from
+        a = sin(d_lat / 2) ** 2 + cos(lat_from) * cos(lat_to) * sin(d_lon / 2) ** 2
+        c = 2 * asin(sqrt(a))
+        d_km = cls.EARTH_RADIUS_km * c
+
+        # compute reception power (first Friis, then apply Pister-hack)
+        p_rx = cls.TX_POWER_dBm - (20 * log10(d_km) + 20 * log10(cls.FREQUENCY_GHz) + 92.45)
+        p_rx -= cls.PISTER_HACK_LOSS * draw
+
+        # turn into PDR
+        if p_rx < cls.SENSITIVITY_dBm:
+            return 0.0
+        elif p_rx > cls.SENSITIVITY_dBm + cls.GREY_AREA_dB:
+            return 1.0
+        return (p_rx - cls.SENSITIVITY_dBm) / cls.GREY_AREA_dB
+
+    def get_max_range(self):
+        """
+        Returns the distance (in km) from which the PDR of the Pister-hack model is always 0: even without the
+        Pister-hack loss, the reception power is below the sensitivity.
+        """
+        return 10 ** ((self.TX_POWER_dBm - self.SENSITIVITY_dBm - 20 * log10(self.FREQUENCY_GHz) - 92.45) / 20)
+
+    def set_random(self, rng):
+        """ Draws the PDRs and the frame losses from this generator, which also seeds the NumPy one. """
+        self.random = rng
+        if numpy is not None:
+            self.rng = numpy.random.RandomState(rng.getrandbits(32))
 
     def retrieve_connections(self):
 
-        retrieved_connections = []
+        connections = self.connections
+        retrieved_connections = set()
         return_val = []
-        with self.data_lock:
 
-            for from_mote in self.connections:
-                for to_mote in self.connections[from_mote]:
-                    if (to_mote, from_mote) not in retrieved_connections:
-                        return_val += [
-                            {
-                                'fromMote': from_mote,
-                                'toMote': to_mote,
-                                'pdr': self.connections[from_mote][to_mote],
-                            },
-                        ]
-                        retrieved_connections += [(from_mote, to_mote)]
+        for from_mote in connections:
+            for to_mote in connections[from_mote]:
+                if (to_mote, from_mote) not in retrieved_connections:
+                    return_val += [
+                        {
+                            'fromMote': from_mote,
+                            'toMote': to_mote,
+                            'pdr': connections[from_mote][to_mote],
+                        },
+                    ]
+                    retrieved_connections.add((from_mote, to_mote))
 
         return return_val
 
     def update_connection(self, from_mote, to_mote, pdr):
-
-        with self.data_lock:
-            self.connections[from_mote][to_mote] = pdr
-            self.connections[to_mote][from_mote] = pdr
+        self.update_connections([(from_mote, to_mote, pdr)])
 
     def delete_connection(self, from_mote, to_mote):
+        self.update_connections([(from_mote, to_mote, 0.0)])
+
+    def get_stats(self):
+        """
+        Returns the number of transmissions, and of frames delivered to, dropped (by the PDR draw) or truncated (by a
+        new transmission before the end of the frame) for each receiver. With the collision model, frames_collided
+        counts the frames delivered with a failed CRC.
+        """
+        return dict(self.stats)
+
+    def set_collision_model(self, enabled):
+        """ Enables or disables the collision model, and resets its statistics. """
+        self.collision_model = enabled
+        self.active = {}
+        self.tx_channels = {}
+        self.corrupted = set()
+        self.link_stats = {}
+
+    def get_collision_stats(self):
+        """ Returns, for each link which carried frames with the collision model, the receptions and collisions. """
+        return [
+            {'fromMote': from_mote, 'toMote': to_mote, 'receptions': receptions, 'collisions': collisions}
+            for ((from_mote, to_mote), (receptions, collisions)) in sorted(self.link_stats.items())
+        ]
+
+    def set_shard(self, shard_id, mote_shards, lookahead):
+        """
+        Makes this engine simulate one shard of a larger network.
+
+        :param shard_id: The shard simulated by this engine.
+        :param mote_shards: A dict mapping each mote of the network to its shard.
+        :param lookahead: Minimum delay between the announcement of a transmission and its start, in ns: the shards
+            can run that far ahead of each other.
+        """
+        assert lookahead > 0
+        self.shard_id = shard_id
+        self.mote_shards = mote_shards
+        self.lookahead = lookahead
+
+    def announce_transmission(self, from_mote, packet, channel, start_time, end_time):
+        """
+        Called by a mote when it commits to a transmission: in a sharded simulation, queues it for the other shards
+        simulating neighbours of the mote. The times are in ns.
+        """
+
+        if self.mote_shards is None:
+            return
+
+        assert start_time - self.engine.timeline.get_current_time_ns() >= self.lookahead
+
+        shards = set([self.mote_shards[to_mote] for to_mote in self.connections.get(from_mote, ())])
+        shards.discard(self.shard_id)
+        for to_shard in shards:
+            self.outgoing.append((start_time, to_shard, from_mote, list(packet), channel, end_time))
+
+    def schedule_transmission(self, start_time, from_mote, packet, channel, end_time):
+        """ Schedules the start and end of a transmission announced by another shard (times in ns). """
+
+        self.engine.timeline.schedule_event_ns(
+            start_time,
+            None,
+            functools.partial(self._indicate_tx_start, None, None, (from_mote, packet, channel)),
+            'propagation.txstart.{0}'.format(from_mote),
+        )
+        self.engine.timeline.schedule_event_ns(
+            end_time,
+            None,
+            functools.partial(self._indicate_tx_end, None, None, from_mote),
+            'propagation.txend.{0}'.format(from_mote),
+        )
 
-        with self.data_lock:
-
-            try:
-                del self.connections[from_mote][to_mote]
-                if not self.connections[from_mote]:
-                    del self.connections[from_mote]
-
-                del self.connections[to_mote][from_mote]
-                if not self.connections[to_mote]:
-                    del self.connections[to_mote]
-            except KeyError:
-                pass  # did not exist
+    def pop_outgoing(self):
+        """ Returns, and forgets, the transmissions for other shards. """
+        (outgoing, self.outgoing) = (self.outgoing, [])
+        return outgoing
 
     # ======================== indication from eventBus ========================
 
@@ -171,30 +319,171 @@ class Propagation(EventBusClient):
 
         (from_mote, packet, channel) = data
 
-        if from_mote in self.connections:
-            for (to_mote, pdr) in self.connections[from_mote].items():
-                if random.random() <= pdr:
+        if self._is_local(from_mote):
+            self.stats['transmissions'] += 1
+
+        # a transmission which did not end is cut short by the next one
+        self.stats['frames_truncated'] += len(self._end_transmission(from_mote))
+
+        if self.collision_model:
+            self._start_transmission(from_mote, channel)
+
+        links = self.connections.get(from_mote)
+        if links:
+            receivers = set()
+            for (to_mote, pdr) in links.items():
+                if not self._is_local(to_mote):
+                    # the shard of the receiver indicates the transmission
+                    continue
+                if self.random.random() <= pdr:
                     # indicate start of transmission
-                    mh = self.engine.get_mote_handler_by_id(to_mote)
-                    mh.bsp_radio.indicate_tx_start(from_mote, packet, channel)
+                    self._indicate(to_mote, 'start', (from_mote, packet, channel))
 
                     # remember to signal end of transmission
-                    self.pending_tx_end += [(from_mote, to_mote)]
+                    receivers.add(to_mote)
+                else:
+                    self.stats['frames_dropped'] += 1
+
+            if receivers:
+                self.in_flight[from_mote] = receivers
+                if self.collision_model:
+                    self._check_receptions(from_mote, receivers)
 
     def _indicate_tx_end(self, sender, signal, data):
 
         from_mote = data
 
-        if from_mote in self.connections:
-            for (to_mote, pdr) in self.connections[from_mote].items():
-                try:
-                    self.pending_tx_end.remove((from_mote, to_mote))
-                except ValueError:
-                    pass
-                else:
-                    mh = self.engine.get_mote_handler_by_id(to_mote)
-                    mh.bsp_radio.indicate_tx_end(from_mote)
+        collided = set([to_mote for (f, to_mote) in self.corrupted if f == from_mote]) if self.corrupted else ()
+        for to_mote in self._end_transmission(from_mote):
+            if to_mote in collided:
+                self._indicate(to_mote, 'end', (from_mote, False))
+                self.stats['frames_collided'] += 1
+            else:
+                self._indicate(to_mote, 'end', (from_mote,))
+            self.stats['frames_delivered'] += 1
+            if self.collision_model:
+                link = self.link_stats.setdefault((from_mote, to_mote), [0, 0])
+                link[0] += 1
+                link[1] += to_mote in collided
 
     # ======================== private =========================================
 
+    def _compute_pdr(self, from_mote, to_mote):
+        """ Returns the PDR of the link between two motes, as given by the propagation model. """
+
+        if not self.sim_topology:
+
+            # ===== Pister-hack model
+
+            # retrieve position
+            location_from = tuple(self.engine.get_mote_handler_by_id(from_mote).get_location())
+            location_to = tuple(self.engine.get_mote_handler_by_id(to_mote).get_location())
+
+            pdr = self.pister_hack_pdr(location_from, location_to, self.random.random())
+
+        elif self.sim_topology == 'linear':
+
+            # linear network
+            if from_mote == to_mote + 1:
+                pdr = 1.0
+            else:
+                pdr = 0.0
+
+        elif self.sim_topology == 'fully-meshed':
+
+            pdr = 1.0
+
+        else:
+
+            raise NotImplementedError('unsupported sim_topology={0}'.format(self.sim_topology))
+
+        return pdr
+
+    @staticmethod
+    def _updated(connections, links):
+        """ Returns a copy of the connections with the links applied, only the rows which change are copied. """
+
+        connections = dict(connections)
+        copied = set()
+        for (from_mote, to_mote, pdr) in links:
+            for (a, b) in ((from_mote, to_mote), (to_mote, from_mote)):
+                if a not in copied:
+                    connections[a] = dict(connections.get(a, {}))
+                    copied.add(a)
+                if pdr:
+                    connections[a][b] = pdr
+                else:
+                    connections[a].pop(b, None)
+        for a in copied:
+            if not connections[a]:
+                del connections[a]
+        return connections
+
+    def _start_transmission(self, from_mote, channel):
+        """ The ongoing receptions on the channel get a new interferer, some of them collide. """
+
+        active = self.active.setdefault(channel, set())
+        connections = self.connections
+        neighbours = connections.get(from_mote, {})
+        for other in active:
+            for to_mote in self.in_flight.get(other, ()):
+                if to_mote in neighbours and (other, to_mote) not in self.corrupted:
+                    if self._sinr(connections, other, to_mote, active | {from_mote}) < self.CAPTURE_THRESHOLD_dB:
+                        self.corrupted.add((other, to_mote))
+
+        active.add(from_mote)
+        self.tx_channels[from_mote] = channel
+
+    def _check_receptions(self, from_mote, receivers):
+        """ The receptions of a new transmission collide if the ongoing ones on its channel already drown it. """
+
+        active = self.active[self.tx_channels[from_mote]]
+        if len(active) < 2:
+            return
+        connections = self.connections
+        for to_mote in receivers:
+            if self._sinr(connections, from_mote, to_mote, active) < self.CAPTURE_THRESHOLD_dB:
+                self.corrupted.add((from_mote, to_mote))
+
+    def _end_transmission(self, from_mote):
+        """ Forgets an ongoing transmission, returns its receivers. """
+
+        channel = self.tx_channels.pop(from_mote, None)
+        if channel is not None:
+            self.active[channel].discard(from_mote)
+            if not self.active[channel]:
+                del self.active[channel]
+        receivers = self.in_flight.pop(from_mote, set())
+        for to_mote in receivers:
+            self.corrupted.discard((from_mote, to_mote))
+        return receivers
+
+    def _sinr(self, connections, from_mote, to_mote, transmitters):
+        """
+        Returns the SINR of a reception, in dB, with the other transmitters as interferers. The transmitters which are
+        not connected to the receiver are below its sensitivity, and neglected.
+        """
+
+        links = connections.get(to_mote, {})
+        interference_mW = 10 ** (self.NOISE_FLOOR_dBm / 10)
+        for other in transmitters:
+            if other != from_mote and other != to_mote and other in links:
+                interference_mW += 10 ** (self._pdr_to_rssi(links[other]) / 10)
+        return self._pdr_to_rssi(links.get(from_mote, 0.0)) - 10 * log10(interference_mW)
+
+    def _pdr_to_rssi(self, pdr):
+        """ Returns the received power of a link, inverting the grey area of the Pister-hack model. """
+        return self.SENSITIVITY_dBm + pdr * self.GREY_AREA_dB
+
+    def _is_local(self, mote_id):
+        """ Whether a mote is simulated by this engine. """
+        return self.mote_shards is None or self.mote_shards[mote_id] == self.shard_id
+
+    def _indicate(self, to_mote, kind, args):
+        mh = self.engine.get_mote_handler_by_id(to_mote)
+        if kind == 'start':
+            mh.bsp_radio.indicate_tx_start(*args)
+        else:
+            mh.bsp_radio.indicate_tx_end(*args)
+
     # ======================== helpers =========================================
@@ -0,0 +1,371 @@
+#!/usr/bin/python
+# Copyright (c) 2010-2013, Regents of the University of California.
+# All rights reserved.
+#
+# Released under the BSD 3-Clause license as published at the link below.
+# https://openwsn.atlassian.net/wiki/display/OW/License
+
+"""
+Sharded simulation: the motes are partitioned across worker processes, each running its own SimEngine (and its own
+copy of the firmware), so that large networks are simulated on several cores.
+
+The shards are kept in sync conservatively. A mote can only affect the motes of other shards through its
+transmissions, which it announces when its radio is told to send, BspRadio.DELAY_TX before the frame starts (see
+Propagation.announce_transmission). All the shards can thus execute, in parallel, the events of a window which ends
+that lookahead after the earliest pending event of the network: the transmissions announced during a window start
+after it. They are exchanged between the shards before the next window starts, and each shard indicates them to its
+own motes at the times a single engine would. With a single shard, the whole run is one window.
+
+Run as a script, this module is a worker: it receives its commands on stdin and answers on stdout.
+"""
+
+import cPickle as pickle
+import importlib
+import logging
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+import traceback
+
+from openvisualizer.bspemulator.bspradio import BspRadio
+from openvisualizer.simengine.locationmanager import LocationManager
+from openvisualizer.simengine.propagation import Propagation
+from openvisualizer.simengine.timeline import TimeLine
+
+log = logging.getLogger('Shard')
+log.setLevel(logging.ERROR)
+log.addHandler(logging.NullHandler())
+
+# ============================ defines =========================================
+
+# minimum delay between the announcement of a transmission and its start, in ns
+LOOKAHEAD = BspRadio.DELAY_TX
+
+
+class ShardError(Exception):
+    """ A worker process failed. """
+    pass
+
+
+# ============================ helpers =========================================
+
+def topology_connections(sim_topology, mote_ids, seed=None):
+    """
+    Returns the connections of a 'linear', 'fully-meshed' or Pister-hack ('') topology, as returned by
+    retrieve_connections.
+
+    The locations of the motes and the Pister-hack links are drawn here, from the seed, once for all the shards.
+    """
+
+    mote_ids = sorted(mote_ids)
+    if sim_topology == 'linear':
+        pairs = zip(mote_ids[1:], mote_ids[:-1])
+    elif sim_topology == 'fully-meshed':
+        pairs = [(a, b) for a in mote_ids for b in mote_ids if a > b]
+    elif not sim_topology:
+        rng = random.Random(seed)
+        locations = [(mote_id, LocationManager.draw_location(rng)) for mote_id in mote_ids]
+        connections = []
+        for (i, (a, location_a)) in enumerate(locations):
+            for (b, location_b) in locations[:i]:
+                pdr = Propagation.pister_hack_pdr(location_a, location_b, rng.random())
+                if pdr:
+                    connections.append({'fromMote': a, 'toMote': b, 'pdr': pdr})
+        return connections
+    else:
+        raise ValueError('unsupported sim_topology={0}'.format(sim_topology))
+    return [{'fromMote': a, 'toMote': b, 'pdr': 1.0} for (a, b) in pairs]
+
+
+def partition(mote_ids, num_shards):
+    """ Splits the motes in num_shards blocks of consecutive IDs, returns a dict mapping each mote to its shard. """
+
+    mote_ids = sorted(mote_ids)
+    return dict((mote_id, i * num_shards // len(mote_ids)) for (i, mote_id) in enumerate(mote_ids))
+
+
+def _import(name):
+    """ Imports a function given as 'module:function'. """
+    (module_name, function_name) = name.split(':')
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def _send(channel, msg):
+    pickle.dump(msg, channel, pickle.HIGHEST_PROTOCOL)
+    channel.flush()
+
+
+# ============================ worker ==========================================
+
+class ShardWorker(object):
+    """
+    Simulates the motes of one shard, in the SimEngine of the current process.
+
+    The motes are created by the factory, a function which is given the ID of a mote (and the factory_args, as keyword
+    arguments) and returns its mote handler, with the ID manager set so that the handler gets that ID. The collector,
+    if any, is given the engine and returns the (picklable) results of the shard.
+
+    The executed events are traced if trace is set (see TimeLine.set_trace): True for the digest only, or the path of
+    the trace file.
+    """
+
+    def __init__(self, shard_id, mote_shards, connections, factory, collector=None, factory_args=None,
+                 collision_model=False, trace=None):
+        from openvisualizer.simengine import simengine
+        self.engine = simengine.SimEngine()
+        self.shard_id = shard_id
+        self.collector = collector
+        self.num_events = 0
+        self.run_duration = 0
+
+        propagation = self.engine.propagation
+        propagation.set_shard(shard_id, mote_shards, LOOKAHEAD)
+        propagation.set_connections(connections)
+        propagation.set_collision_model(collision_model)
+        if trace:
+            self.engine.timeline.set_trace(True, None if trace is True else trace)
+
+        for mote_id in sorted([m for (m, s) in mote_shards.items() if s == shard_id]):
+            self.engine.id_manager.set_next_id(mote_id)
+            self.engine.add_mote_handler(factory(mote_id, **(factory_args or {})))
+
+    # ======================== public ==========================================
+
+    def get_next_event_time(self):
+        return self.engine.timeline.get_next_event_time_ns()
+
+    def run(self, end_time, transmissions):
+        """
+        Schedules the transmissions announced by the other shards, then executes the events before end_time (in ns).
+
+        :returns: The time of the next event (in ns), and the transmissions announced for the other shards.
+        """
+
+        start = time.time()
+        for transmission in transmissions:
+            self.engine.propagation.schedule_transmission(transmission[0], *transmission[2:])
+        self.num_events += self.engine.timeline.run_until_ns(end_time)
+        self.run_duration += time.time() - start
+
+        return self.get_next_event_time(), self.engine.propagation.pop_outgoing()
+
+    def collect(self):
+        return self.collector(self.engine) if self.collector else None
+
+    def close(self):
+        # flushes the trace file
+        self.engine.timeline.set_trace(False)
+
+    def get_stats(self):
+        return {
+            'motes': self.engine.get_num_motes(),
+            'events': self.num_events,
+            'run_duration': self.run_duration,
+        }
+
+    def handle(self, msg):
+        """ Executes a command received from the coordinator, returns the answer. """
+
+        if msg[0] == 'run':
+            return self.run(*msg[1:])
+        elif msg[0] == 'collect':
+            return self.collect()
+        elif msg[0] == 'stats':
+            return self.get_stats()
+        raise ValueError('unknown command {0}'.format(msg[0]))
+
+
+def _worker_main():
+    # keep stdin and stdout for the commands, anything printed (also by the firmware) goes to stderr
+    channel_in = os.fdopen(os.dup(0), 'rb')
+    channel_out = os.fdopen(os.dup(1), 'wb')
+    os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+    os.dup2(2, 1)
+
+    worker = None
+    while True:
+        try:
+            msg = pickle.load(channel_in)
+        except EOFError:
+            break
+
+        if msg[0] == 'stop':
+            break
+
+        try:
+            if msg[0] == 'init':
+                (shard_id, mote_shards, connections, factory, collector, factory_args, collision_model, trace) = msg[1:]
+                worker = ShardWorker(shard_id, mote_shards, connections, _import(factory),
+                                     _import(collector) if collector else None, factory_args, collision_model, trace)
+                answer = worker.get_next_event_time()
+            else:
+                answer = worker.handle(msg)
+        except Exception:
+            _send(channel_out, ('error', traceback.format_exc()))
+        else:
+            _send(channel_out, ('ok', answer))
+
+    if worker is not None:
+        worker.close()
+
+    # like a multiprocessing worker, do not wait for the threads started along with the motes (the JRC of a DAG root...)
+    logging.shutdown()
+    os._exit(0)
+
+
+# ============================ coordinator =====================================
+
+class ShardedSimulation(object):
+    """
+    Simulates a network of motes in several worker processes.
+
+    The factory and the collector (see ShardWorker) are given as 'module:function' strings, and imported by the
+    workers. The factory_args must be picklable.
+
+    The frame losses are drawn by the shard of each receiver: with links of PDR below 1, the runs with different numbers
+    of shards are the same in distribution, not event by event.
+
+    :param seed: Seeds the Pister-hack topology (see topology_connections).
+    :param collision_model: Enables the collision model of the propagation, in every shard.
+    :param trace: Traces the events of each shard: True for the digests only, or the path of the trace files, which
+        get the number of their shard as extension.
+    """
+
+    def __init__(self, factory, num_motes, num_shards=None, sim_topology='fully-meshed', connections=None,
+                 collector=None, factory_args=None, seed=None, collision_model=False, trace=None):
+
+        mote_ids = range(1, num_motes + 1)
+        num_shards = min(num_shards or multiprocessing.cpu_count(), num_motes)
+        if connections is None:
+            connections = topology_connections(sim_topology, mote_ids, seed)
+
+        # store params
+        self.mote_shards = partition(mote_ids, num_shards)
+
+        # local variables
+        self.current_time = 0  # ns
+        self.next_times = []
+        self.inboxes = [[] for _ in range(num_shards)]
+        self.num_windows = 0
+        self.num_forwarded = 0
+        self.run_duration = 0
+        self.workers = []
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        try:
+            for shard_id in range(num_shards):
+                self.workers.append(subprocess.Popen(
+                    [sys.executable, '-m', 'openvisualizer.simengine.shard'],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    env=env,
+                ))
+
+            for (shard_id, w) in enumerate(self.workers):
+                shard_trace = '{0}.{1}'.format(trace, shard_id) if trace and trace is not True else trace
+                _send(w.stdin, ('init', shard_id, self.mote_shards, connections, factory, collector, factory_args,
+                                collision_model, shard_trace))
+            self.next_times = self._answers(range(num_shards))
+        except Exception:
+            self.close()
+            raise
+
+        log.info('{0} motes in {1} shards'.format(num_motes, num_shards))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # ======================== public ==========================================
+
+    def run(self, duration):
+        """ Simulates the network for duration seconds (of simulated time). """
+
+        start = time.time()
+        end_time = self.current_time + TimeLine.to_ns(duration)
+
+        while True:
+            # the earliest event which can still happen in the network
+            pending = [t for t in self.next_times if t is not None]
+            pending += [i[0] for inbox in self.inboxes for i in inbox]
+            if not pending or min(pending) >= end_time:
+                break
+            if len(self.workers) == 1:
+                window_end = end_time
+            else:
+                window_end = min(min(pending) + LOOKAHEAD, end_time)
+
+            # only the shards with something to do in the window take part
+            active = [s for s in range(len(self.workers)) if self._next_time(s) < window_end]
+            for s in active:
+                _send(self.workers[s].stdin, ('run', window_end, self.inboxes[s]))
+                self.inboxes[s] = []
+
+            for (s, (next_time, outgoing)) in zip(active, self._answers(active)):
+                self.next_times[s] = next_time
+                for transmission in outgoing:
+                    self.inboxes[transmission[1]].append(transmission)
+                self.num_forwarded += len(outgoing)
+
+            self.num_windows += 1
+
+        self.current_time = end_time
+        self.run_duration += time.time() - start
+
+    def collect(self):
+        """ Returns the results of the collector, one per shard. """
+        return self._command(('collect',))
+
+    def get_stats(self):
+        return {
+            'shards': self._command(('stats',)),
+            'windows': self.num_windows,
+            'forwarded': self.num_forwarded,
+            'sim_time': float(self.current_time) / TimeLine.NS_PER_S,
+            'wall_time': self.run_duration,
+        }
+
+    def close(self):
+        for w in self.workers:
+            try:
+                _send(w.stdin, ('stop',))
+                w.stdin.close()
+            except (IOError, OSError):
+                pass
+            w.wait()
+        self.workers = []
+
+    # ======================== private =========================================
+
+    def _next_time(self, shard_id):
+        times = [i[0] for i in self.inboxes[shard_id]]
+        if self.next_times[shard_id] is not None:
+            times.append(self.next_times[shard_id])
+        return min(times) if times else float('inf')
+
+    def _command(self, msg):
+        for w in self.workers:
+            _send(w.stdin, msg)
+        return self._answers(range(len(self.workers)))
+
+    def _answers(self, shard_ids):
+        answers = []
+        for s in shard_ids:
+            try:
+                (status, answer) = pickle.load(self.workers[s].stdout)
+            except EOFError:
+                raise ShardError('shard {0} exited'.format(s))
+            if status == 'error':
+                raise ShardError('shard {0} failed:\n{1}'.format(s, answer))
+            answers.append(answer)
+        return answers
+
+
+if __name__ == '__main__':
+    _worker_main()
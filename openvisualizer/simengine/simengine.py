@@ -5,11 +5,13 @@
 # Released under the BSD 3-Clause license as published at the link below.
 # https://openwsn.atlassian.net/wiki/display/OW/License
 
+import hashlib
 import logging
+import random
 import threading
 import time
 
-from openvisualizer.simengine import timeline, propagation, idmanager, locationmanager
+from openvisualizer.simengine import timeline, propagation, idmanager, locationmanager, checkpoint
 
 
 class SimEngineStats(object):
@@ -35,7 +37,19 @@ class SimEngineStats(object):
 
 
 class SimEngine(object):
-    """ The main simulation engine. """
+    """
+    The main simulation engine.
+
+    By default, the timeline checks after every event whether the simulation is paused, and sleeps for the configured
+    delay. In as-fast-as-possible mode, it never sleeps and only checks every check_period events, or as soon as the
+    simulation is paused, stepped, resumed or its delay changed.
+
+    All the random draws of the simulation can be seeded at once (set_seed): each component draws from its own
+    generator (get_random), so that two runs with the same seed execute the same events, which the timeline can trace.
+    """
+
+    # number of events executed between two checks in as-fast-as-possible mode
+    CHECK_PERIOD = 1000
 
     # ======================== singleton pattern ===============================
 
@@ -63,6 +77,7 @@ class SimEngine(object):
 
         # local variables
         self.moteHandlers = []
+        self.mote_handlers_by_id = {}
         self.timeline = timeline.TimeLine()
         self.propagation = propagation.Propagation(sim_topology)
         self.id_manager = idmanager.IdManager()
@@ -71,6 +86,11 @@ class SimEngine(object):
         self.isPaused = False
         self.stopAfterSteps = None
         self.delay = 0
+        self.as_fast_as_possible = False
+        self.check_period = self.CHECK_PERIOD
+        self.check_requested = False
+        self.mote_threads = False
+        self.seed = None
         self.stats = SimEngineStats()
 
         # logging this module
@@ -98,10 +118,23 @@ class SimEngine(object):
 
     def set_delay(self, delay):
         self.delay = delay
+        self.check_requested = True
+
+    def set_as_fast_as_possible(self, enabled, check_period=None):
+        """
+        Switches the as-fast-as-possible mode on or off.
+
+        :param enabled: When True, the timeline never sleeps between events, whatever the delay.
+        :param check_period: Number of events executed between two checks for a pause (CHECK_PERIOD by default).
+        """
+        self.as_fast_as_possible = enabled
+        self.check_period = check_period if check_period else self.CHECK_PERIOD
+        self.check_requested = True
 
     def pause(self):
         if self.log.isEnabledFor(logging.DEBUG):
             self.log.debug('pause')
+        self.check_requested = True
         if not self.isPaused:
             self.pauseSem.acquire()
             self.isPaused = True
@@ -109,6 +142,7 @@ class SimEngine(object):
 
     def step(self, num_steps):
         self.stopAfterSteps = num_steps
+        self.check_requested = True
         if self.isPaused:
             self.pauseSem.release()
             self.isPaused = False
@@ -117,18 +151,24 @@ class SimEngine(object):
         if self.log.isEnabledFor(logging.DEBUG):
             self.log.debug('resume')
         self.stopAfterSteps = None
+        self.check_requested = True
         if self.isPaused:
             self.pauseSem.release()
             self.isPaused = False
             self.stats.indicate_start()
 
+    def needs_check(self):
+        """ Whether the timeline must call pause_or_delay after every event. """
+        return not self.as_fast_as_possible or self.stopAfterSteps is not None
+
     def pause_or_delay(self):
+        self.check_requested = False
         if self.isPaused:
             if self.log.isEnabledFor(logging.DEBUG):
                 self.log.debug('pauseOrDelay: pause')
             self.pauseSem.acquire()
             self.pauseSem.release()
-        else:
+        elif not self.as_fast_as_possible:
             if self.log.isEnabledFor(logging.DEBUG):
                 self.log.debug('pauseOrDelay: delay {0}'.format(self.delay))
             time.sleep(self.delay)
@@ -144,19 +184,77 @@ class SimEngine(object):
     def is_running(self):
         return not self.isPaused
 
+    # === execution model
+
+    def set_mote_threads(self, enabled):
+        """
+        Runs the firmware of each mote created from now on in its own thread, instead of in a greenlet of the timeline
+        thread.
+        """
+        self.mote_threads = enabled
+
+    # === random draws
+
+    def set_seed(self, seed):
+        """
+        Seeds the random draws of the simulation: the links and the frame losses of the propagation model, the
+        locations of the motes and the drift of their crystals. Must be called before the motes are created.
+        """
+        self.seed = seed
+        self.propagation.set_random(self.get_random('propagation'))
+        self.location_manager.set_random(self.get_random('location'))
+
+    def get_random(self, *key):
+        """
+        Returns a random generator for a component of the simulation, e.g. get_random('crystal', mote_id). Its draws
+        only depend on the seed and on the key, not on the order in which the components are created. Without a seed,
+        the generator is seeded from the system.
+        """
+        if self.seed is None:
+            return random.Random()
+        return random.Random(int(hashlib.sha1(repr((self.seed,) + key)).hexdigest(), 16))
+
     # === called from the main script
 
     def indicate_new_mote(self, new_mote_handler):
 
         # add this mote to my list of motes
-        self.moteHandlers.append(new_mote_handler)
+        self.add_mote_handler(new_mote_handler)
 
-        # create connections to already existing motes
-        for mh in self.moteHandlers[:-1]:
-            self.propagation.create_connection(
-                from_mote=new_mote_handler.get_id(),
-                to_mote=mh.get_id(),
+        if self.propagation.sim_topology:
+            to_motes = [mh.get_id() for mh in self.moteHandlers[:-1]]
+        else:
+            # with the Pister-hack model, only the motes within radio range can be connected
+            to_motes = self.location_manager.get_motes_within(
+                new_mote_handler.get_location(),
+                self.propagation.get_max_range(),
             )
+            self.location_manager.add_mote(new_mote_handler.get_id(), new_mote_handler.get_location())
+
+        # create connections to already existing motes
+        self.propagation.create_connections(
+            from_mote=new_mote_handler.get_id(),
+            to_motes=to_motes,
+        )
+
+    def add_mote_handler(self, mote_handler):
+        """ Registers a mote, without creating any connection. """
+
+        mote_id = mote_handler.get_id()
+        assert mote_id not in self.mote_handlers_by_id
+
+        self.moteHandlers.append(mote_handler)
+        self.mote_handlers_by_id[mote_id] = mote_handler
+
+    # === checkpoints
+
+    def save_checkpoint(self, path):
+        """ Saves the state of the simulation to a file, see the checkpoint module. """
+        checkpoint.save(self, path)
+
+    def load_checkpoint(self, path):
+        """ Restores the state of the simulation from a file saved by save_checkpoint. """
+        checkpoint.load(self, path)
 
     # === called from timeline
 
@@ -172,17 +270,33 @@ class SimEngine(object):
         return self.moteHandlers[rank]
 
     def get_mote_handler_by_id(self, mote_id):
-        return_val = None
-        for h in self.moteHandlers:
-            if h.get_id() == mote_id:
-                return_val = h
-                break
+        return_val = self.mote_handlers_by_id.get(mote_id)
         assert return_val
         return return_val
 
     def get_stats(self):
         return self.stats
 
+    def get_speed_stats(self):
+        """
+        Returns the number of events executed, how fast simulated time advances compared to wall-clock time, and the
+        frame counters of the propagation model.
+        """
+
+        wall_time = self.stats.get_duration_running()
+        sim_time = self.timeline.get_current_time()
+        num_events = self.timeline.get_stats().get_num_events()
+
+        return {
+            'as_fast_as_possible': self.as_fast_as_possible,
+            'events': num_events,
+            'sim_time': sim_time,
+            'wall_time': wall_time,
+            'events_per_s': num_events / wall_time if wall_time else None,
+            'speed_ratio': sim_time / wall_time if wall_time else None,
+            'propagation': self.propagation.get_stats(),
+        }
+
     # ======================== private =========================================
 
     # ======================== helpers =========================================
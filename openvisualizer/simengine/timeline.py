@@ -5,6 +5,10 @@
 # Released under the BSD 3-Clause license as published at the link below.
 # https://openwsn.atlassian.net/wiki/display/OW/License
 
+import collections
+import hashlib
+import heapq
+import itertools
 import logging
 import threading
 
@@ -23,18 +27,43 @@ class TimeLineStats(object):
 
 class TimeLineEvent(object):
 
-    def __init__(self, mote_id, at_time, cb, desc):
+    def __init__(self, mote_id, at_time, cb, desc, seq=0):
         self.at_time = at_time
         self.mote_id = mote_id
         self.desc = desc
         self.cb = cb
+        self.seq = seq
+        self.cancelled = False
 
     def __str__(self):
         return '{0} {1}: {2}'.format(self.at_time, self.mote_id, self.desc)
 
 
 class TimeLine(threading.Thread):
-    """ The timeline of the engine. """
+    """
+    The timeline of the engine.
+
+    Upcoming events are kept in a binary heap, ordered by time and, for events scheduled at the same time, by order of
+    scheduling. An index maps each (mote_id, desc) to its pending event, so that rescheduling or canceling an event
+    does not require searching the heap: the old event is only marked as cancelled, and skipped when it reaches the
+    head of the heap. Scheduling, canceling and executing an event all cost O(log n).
+
+    Time is kept as an integer number of nanoseconds, so that the events are ordered, and the simulation replayed,
+    exactly the same way on every machine. The emulated hardware schedules its events in nanoseconds
+    (schedule_event_ns); the methods taking or returning a time in seconds convert it at the API boundary.
+
+    The executed events can be traced (set_trace), one line '<time in ns> <mote_id> <desc>' per event. The lines
+    update a SHA-1 digest, and can also be written to a file: two runs with the same digest executed the same events,
+    otherwise their trace files show where they diverged.
+
+    The timeline is only accessed from the thread executing its events. Other threads (the mote probes writing to the
+    UARTs) go through call_soon: their callables run in that thread, between two events.
+    """
+
+    NS_PER_S = 1000000000
+
+    # rebuild the heap when more than this fraction of its entries are cancelled events
+    MAX_CANCELLED_RATIO = 0.5
 
     def __init__(self):
 
@@ -43,13 +72,20 @@ class TimeLine(threading.Thread):
         self.engine = simengine.SimEngine()
 
         # local variables
-        self.current_time = 0  # current time
-        self.timeline = []  # list of upcoming events
+        self.current_time = 0  # current time, in ns
+        self.timeline = []  # heap of upcoming events, as (at_time, seq, event), at_time in ns
+        self.pending = {}  # (mote_id, desc) -> pending event
+        self.num_cancelled = 0  # number of cancelled events still in the heap
+        self.seq = itertools.count()
+        self.calls = collections.deque()  # callables queued by other threads, run between two events
         self.first_event_passed = False
         self.first_event = threading.Lock()
         self.first_event.acquire()
         self.first_event_lock = threading.Lock()
         self.stats = TimeLineStats()
+        self.tracing = False
+        self.trace_digest = None
+        self.trace_file = None
 
         # logging
         self.log = logging.getLogger('Timeline')
@@ -84,19 +120,24 @@ class TimeLine(threading.Thread):
 
         # apply the delay
         self.engine.pause_or_delay()
+        events_to_check = self.engine.check_period
 
         while True:
+            # run the calls queued by other threads
+            if self.calls:
+                self._run_calls()
+
+            # pop the event at the head of the timeline
+            event = self._pop_next_event()
+
             # detect the end of the simulation
-            if len(self.timeline) == 0:
+            if event is None:
                 output = ''
                 output += 'end of simulation reached\n'
                 output += ' - current_time=' + str(self.get_current_time()) + '\n'
                 self.log.warning(output)
                 raise StopIteration(output)
 
-            # pop the event at the head of the timeline
-            event = self.timeline.pop(0)
-
             # make sure that this event is later in time than the previous
             if not self.current_time <= event.at_time:
                 self.log.critical("Current time {} exceeds event time: {}".format(self.current_time, event))
@@ -105,37 +146,45 @@ class TimeLine(threading.Thread):
             # record the current time
             self.current_time = event.at_time
 
-            # log
-            if self.log.isEnabledFor(logging.DEBUG):
-                self.log.debug('\n\nnow {0:.6f}, executing {1}@{2}'.format(event.at_time, event.desc, event.mote_id))
-
             # call the event's callback
-            self.engine.get_mote_handler_by_id(event.mote_id).handle_event(event.cb)
-
-            # update statistics
-            self.stats.increment_events()
+            self._execute(event)
 
-            # apply the delay
-            self.engine.pause_or_delay()
+            # apply the delay (in as-fast-as-possible mode, only check for a pause from time to time)
+            events_to_check -= 1
+            if events_to_check <= 0 or self.engine.check_requested or self.engine.needs_check():
+                self.engine.pause_or_delay()
+                events_to_check = self.engine.check_period
 
     # ======================== public ==========================================
 
     def get_current_time(self):
+        """ Returns the current time, in seconds. """
+        return float(self.current_time) / self.NS_PER_S
+
+    def get_current_time_ns(self):
         return self.current_time
 
+    @classmethod
+    def to_ns(cls, seconds):
+        return int(round(seconds * cls.NS_PER_S))
+
     def schedule_event(self, at_time, mote_id, cb, desc):
         """
         Add an event into the timeline
 
-        :param at_time: The time at which this event should be called.
-        :param mote_id: Mote identifier
+        :param at_time: The time at which this event should be called, in seconds.
+        :param mote_id: Mote identifier, or None for an event which does not run in the context of a mote.
         :param cb: The function to call when this event happens.
         :param desc: A unique description (a string) of this event.
         """
+        self.schedule_event_ns(self.to_ns(at_time), mote_id, cb, desc)
+
+    def schedule_event_ns(self, at_time, mote_id, cb, desc):
+        """ Add an event into the timeline, at_time is in nanoseconds (an integer). """
 
         # log
         if self.log.isEnabledFor(logging.DEBUG):
-            self.log.debug('scheduling {0}@{1} at {2:.6f}'.format(desc, mote_id, at_time))
+            self.log.debug('scheduling {0}@{1} at {2}ns'.format(desc, mote_id, at_time))
 
         # make sure that I'm scheduling an event in the future
         try:
@@ -151,25 +200,14 @@ class TimeLine(threading.Thread):
             raise
 
         # create a new event
-        new_event = TimeLineEvent(mote_id, at_time, cb, desc)
+        new_event = TimeLineEvent(mote_id, at_time, cb, desc, next(self.seq))
 
         # remove any event already in the queue with same description
-        for i in range(len(self.timeline)):
-            if (self.timeline[i].mote_id == mote_id and
-                    self.timeline[i].desc == desc):
-                self.timeline.pop(i)
-                break
-
-        # look for where to put this event
-        i = 0
-        while i < len(self.timeline):
-            if new_event.at_time > self.timeline[i].at_time:
-                i += 1
-            else:
-                break
+        self._cancel((mote_id, desc))
 
         # insert the new event
-        self.timeline.insert(i, new_event)
+        self.pending[(mote_id, desc)] = new_event
+        heapq.heappush(self.timeline, (new_event.at_time, new_event.seq, new_event))
 
         # start the timeline, if applicable
         with self.first_event_lock:
@@ -177,6 +215,14 @@ class TimeLine(threading.Thread):
                 self.first_event_passed = True
                 self.first_event.release()
 
+    def call_soon(self, cb):
+        """
+        Calls cb from the thread executing the events, before the next event (or the next call to run_until).
+
+        To be used instead of schedule_event from any other thread.
+        """
+        self.calls.append(cb)
+
     def cancel_event(self, mote_id, desc):
         """
         Cancels all events identified by their description
@@ -191,33 +237,147 @@ class TimeLine(threading.Thread):
         if self.log.isEnabledFor(logging.DEBUG):
             self.log.debug('cancelEvent {0}@{1}'.format(desc, mote_id))
 
-        # initialize return variable
-        num_events_canceled = 0
-
         # remove any event already the queue with same description
-        i = 0
-        while i < len(self.timeline):
-            if self.timeline[i].mote_id == mote_id and self.timeline[i].desc == desc:
-                self.timeline.pop(i)
-                num_events_canceled += 1
-            else:
-                i += 1
+        num_events_canceled = self._cancel((mote_id, desc))
 
         # return the number of events canceled
         return num_events_canceled
 
     def get_events(self):
-        return [[ev.at_time, ev.mote_id, ev.desc] for ev in self.timeline]
+        return [[float(ev.at_time) / self.NS_PER_S, ev.mote_id, ev.desc]
+                for (_, _, ev) in sorted(self.timeline) if not ev.cancelled]
+
+    def get_num_events(self):
+        """ Returns the number of upcoming events. """
+        return len(self.pending)
+
+    def get_next_event_time(self):
+        """ Returns the time (in seconds) of the earliest upcoming event, or None if the timeline is empty. """
+
+        next_time = self.get_next_event_time_ns()
+        return float(next_time) / self.NS_PER_S if next_time is not None else None
+
+    def get_next_event_time_ns(self):
+
+        while self.timeline and self.timeline[0][2].cancelled:
+            heapq.heappop(self.timeline)
+            self.num_cancelled -= 1
+        return self.timeline[0][0] if self.timeline else None
+
+    def run_until(self, end_time):
+        """
+        Executes, in the calling thread, all the events scheduled before end_time (in seconds, excluded).
+
+        Used instead of starting the thread when the simulation is driven from outside, one time window at a time.
+
+        :returns: The number of events executed.
+        """
+        return self.run_until_ns(self.to_ns(end_time))
+
+    def run_until_ns(self, end_time):
+        """ Executes all the events scheduled before end_time (in nanoseconds, excluded), see run_until. """
+
+        num_events = 0
+        while True:
+            if self.calls:
+                self._run_calls()
+
+            next_time = self.get_next_event_time_ns()
+            if next_time is None or next_time >= end_time:
+                return num_events
+
+            event = self._pop_next_event()
+            self.current_time = event.at_time
+            self._execute(event)
+            num_events += 1
 
     def get_stats(self):
         return self.stats
 
+    def set_trace(self, enabled, path=None):
+        """
+        Starts tracing the executed events (with a new digest), or stops it.
+
+        :param path: The file the trace is written to, if any.
+        """
+
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
+
+        if enabled:
+            self.trace_digest = hashlib.sha1()
+            if path:
+                self.trace_file = open(path, 'w')
+        self.tracing = enabled
+
+    def get_trace_digest(self):
+        """ Returns the digest (in hex) of the events traced so far, or None if the events were never traced. """
+        return self.trace_digest.hexdigest() if self.trace_digest is not None else None
+
     # ======================== private =========================================
 
+    def _execute(self, event):
+        """ Calls the callback of an event, in the context of its mote (events without a mote are called directly). """
+
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug('\n\nnow {0}ns, executing {1}@{2}'.format(event.at_time, event.desc, event.mote_id))
+
+        if self.tracing:
+            self._trace(event)
+
+        if event.mote_id is None:
+            event.cb()
+        else:
+            self.engine.get_mote_handler_by_id(event.mote_id).handle_event(event.cb)
+
+        self.stats.increment_events()
+
+    def _run_calls(self):
+        while self.calls:
+            self.calls.popleft()()
+
+    def _trace(self, event):
+        line = '{0} {1} {2}\n'.format(event.at_time, event.mote_id, event.desc)
+        self.trace_digest.update(line)
+        if self.trace_file is not None:
+            self.trace_file.write(line)
+
+    def _pop_next_event(self):
+        """ Removes the earliest event from the timeline and returns it, or None if the timeline is empty. """
+
+        while self.timeline:
+            (_, _, event) = heapq.heappop(self.timeline)
+            if event.cancelled:
+                self.num_cancelled -= 1
+                continue
+            del self.pending[(event.mote_id, event.desc)]
+            return event
+        return None
+
+    def _cancel(self, key):
+        """ Marks the pending event with that (mote_id, desc) as cancelled, returns the number of events cancelled. """
+
+        event = self.pending.pop(key, None)
+        if event is None:
+            return 0
+
+        event.cancelled = True
+        self.num_cancelled += 1
+
+        # drop the cancelled events once they make up most of the heap
+        if self.num_cancelled > self.MAX_CANCELLED_RATIO * len(self.timeline):
+            self.timeline = [entry for entry in self.timeline if not entry[2].cancelled]
+            heapq.heapify(self.timeline)
+            self.num_cancelled = 0
+
+        return 1
+
     def _print_timeline(self):
         output = ''
-        for event in self.timeline:
-            output += '\n' + str(event)
+        for (_, _, event) in sorted(self.timeline):
+            if not event.cancelled:
+                output += '\n' + str(event)
         return output
 
     # ======================== helpers =========================================
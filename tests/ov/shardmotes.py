@@ -0,0 +1,112 @@
+#!/usr/bin/env python2
+
+""" Fake motes for the sharded simulation tests, created in the worker processes. """
+
+from openvisualizer.bspemulator.bspradio import BspRadio
+
+# ============================ defines =========================================
+
+NUM_MOTES = 8
+TX_PERIOD = 10000000  # ns
+TX_DURATION = 4000000  # ns
+
+# the motes of the speedup measurement wake up at the start of each slot, and work as long as a mote handling it
+SLOT_DURATION = 10000000  # ns
+SLOTFRAME_LENGTH = 16
+SLOT_WORK = 5000
+
+
+# ============================ classes =========================================
+
+class FakeRadio(object):
+    def __init__(self, engine):
+        self.engine = engine
+        self.received = []
+
+    def indicate_tx_start(self, from_mote, packet, channel):
+        self.received.append((self.engine.timeline.get_current_time_ns(), 'start', from_mote, packet, channel))
+
+    def indicate_tx_end(self, from_mote, crc_passes=True):
+        self.received.append((self.engine.timeline.get_current_time_ns(), 'end', from_mote, crc_passes))
+
+
+class FakeMote(object):
+    """ Transmits a frame every TX_PERIOD, shifted by its ID so that the transmissions of the motes overlap. """
+
+    def __init__(self):
+        from openvisualizer.simengine.simengine import SimEngine
+        self.engine = SimEngine()
+        self.id = self.engine.id_manager.get_id()
+        self.bsp_radio = FakeRadio(self.engine)
+        self.num_tx = 0
+        self._start()
+
+    def get_id(self):
+        return self.id
+
+    @staticmethod
+    def handle_event(cb):
+        cb()
+
+    def _start(self):
+        self.engine.timeline.schedule_event_ns(self.id * TX_DURATION // NUM_MOTES, self.id, self._tx_now, 'tx_now')
+
+    def _tx_now(self):
+        now = self.engine.timeline.get_current_time_ns()
+        self.engine.timeline.schedule_event_ns(now + TX_PERIOD, self.id, self._tx_now, 'tx_now')
+        self._transmit(TX_DURATION)
+
+    def _transmit(self, duration):
+        """ Transmits a frame as the radio does: announced right away, started DELAY_TX later. """
+
+        now = self.engine.timeline.get_current_time_ns()
+        self.num_tx += 1
+        (packet, channel) = ([self.id, self.num_tx], 11 + self.id % 2)
+        start_time = now + BspRadio.DELAY_TX
+
+        self.engine.propagation.announce_transmission(self.id, packet, channel, start_time, start_time + duration)
+        self.engine.timeline.schedule_event_ns(start_time, self.id, lambda: self._tx_start(packet, channel),
+                                               'tx_start')
+        self.engine.timeline.schedule_event_ns(start_time + duration, self.id, self._tx_end, 'tx_end')
+
+    def _tx_start(self, packet, channel):
+        self.engine.propagation._indicate_tx_start(None, None, (self.id, packet, channel))
+
+    def _tx_end(self):
+        self.engine.propagation._indicate_tx_end(None, None, self.id)
+
+
+class SlotMote(FakeMote):
+    """
+    Wakes up at the start of every slot, all the motes at the same time, and spends SLOT_WORK iterations of CPU work
+    (as the firmware handling the slot would). Transmits once per slotframe, in the slot of its ID.
+    """
+
+    def _start(self):
+        self.engine.timeline.schedule_event_ns(0, self.id, self._slot, 'slot')
+
+    def _slot(self):
+        now = self.engine.timeline.get_current_time_ns()
+        self.engine.timeline.schedule_event_ns(now + SLOT_DURATION, self.id, self._slot, 'slot')
+
+        sum(xrange(SLOT_WORK))
+        if (now // SLOT_DURATION) % SLOTFRAME_LENGTH == self.id % SLOTFRAME_LENGTH:
+            self._transmit(TX_DURATION)
+
+
+# ============================ functions =======================================
+
+def create_fake_mote(mote_id):
+    mote = FakeMote()
+    assert mote.get_id() == mote_id
+    return mote
+
+
+def create_slot_mote(mote_id):
+    mote = SlotMote()
+    assert mote.get_id() == mote_id
+    return mote
+
+
+def collect_receptions(engine):
+    return dict((mh.get_id(), mh.bsp_radio.received) for mh in engine.moteHandlers)
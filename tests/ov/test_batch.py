@@ -0,0 +1,125 @@
+#!/usr/bin/env python2
+
+import functools
+import json
+import logging.handlers
+import re
+import sys
+
+import pytest
+
+from openvisualizer import batch
+from openvisualizer.batch import BatchError, BatchSimulation, ShardedBatchSimulation
+from openvisualizer.simengine import motehandler
+
+# ============================ logging =========================================
+
+LOGFILE_NAME = 'test_batch.log'
+
+log = logging.getLogger('test_batch')
+log.setLevel(logging.ERROR)
+log.addHandler(logging.NullHandler())
+
+log_handler = logging.handlers.RotatingFileHandler(LOGFILE_NAME, backupCount=5, mode='w')
+log_handler.setFormatter(logging.Formatter("%(asctime)s [%(name)s:%(levelname)s] %(message)s"))
+for logger_name in ['test_batch']:
+    temp = logging.getLogger(logger_name)
+    temp.setLevel(logging.DEBUG)
+    temp.addHandler(log_handler)
+
+# ============================ defines =========================================
+
+NUM_MOTES = 4
+
+# firmware which sleeps forever, and counts the bytes received on its UART
+FAKE_OOS_OPENWSN = '''
+from openvisualizer.simengine.motehandler import notif_id
+
+
+class OpenMote(object):
+    def __init__(self):
+        self.callbacks = {}
+        self.uart_rx_bytes = 0
+
+    def set_callback(self, notif, cb):
+        self.callbacks[notif] = cb
+
+    def supply_on(self):
+        while True:
+            self.callbacks[notif_id('board_sleep')]()
+
+    def uart_isr_rx(self):
+        self.uart_rx_bytes += 1
+'''
+
+
+# ============================ fixtures ========================================
+
+@pytest.fixture()
+def fw_path(tmpdir):
+    """ Firmware tree with the files the batch simulation reads, and the fake module in front of the Python path. """
+
+    notifs = re.findall(r"notif_id\('(\w+)'\)", open(motehandler.__file__.replace('.pyc', '.py')).read())
+
+    tmpdir.join('inc', 'opendefs.h').write('', ensure=True)
+    tmpdir.join('openstack', '02b-MAChigh', 'sixtop.h').write('', ensure=True)
+    tmpdir.join('bsp', 'boards', 'python', 'openwsnmodule_obj.h').write(
+        ''.join(['    MOTE_NOTIF_{0},\n'.format(n) for n in notifs]), ensure=True)
+    tmpdir.join('build', 'python_gcc', 'projects', 'common', 'oos_openwsn.so').write('', ensure=True)
+    tmpdir.join('fake', 'oos_openwsn.py').write(FAKE_OOS_OPENWSN, ensure=True)
+
+    old_path = list(sys.path)
+    sys.path.insert(0, str(tmpdir.join('fake')))
+    yield str(tmpdir)
+    sys.path[:] = old_path
+
+
+@pytest.fixture()
+def topo_file(tmpdir):
+    motes = [{'id': i} for i in range(1, NUM_MOTES + 1)]
+    connections = [{'fromMote': i, 'toMote': i + 1, 'pdr': 1.0} for i in range(1, NUM_MOTES)]
+    path = tmpdir.join('topology.json')
+    path.write(json.dumps({'motes': motes, 'connections': connections}))
+    return str(path)
+
+
+# ============================ tests ===========================================
+
+def test_batch_shards(fw_path, topo_file, tmpdir):
+    trace = tmpdir.join('trace')
+    simulation = ShardedBatchSimulation(topo_file, fw_path, 2, sim_collisions=True, seed=1, trace=str(trace))
+    try:
+        simulation.run(2 * batch.BOOT_DURATION)
+        results = simulation.get_results()
+    finally:
+        simulation.close()
+
+    log.info(results)
+
+    assert [s['motes'] for s in results['shards']] == [NUM_MOTES / 2, NUM_MOTES / 2]
+    # only the shard of the DAG root computes the KPIs, the fake firmware never sends any packet
+    assert [s['kpis'] for s in results['shards']] == [{}, None]
+    assert results['motes'] == {}
+    # the motes are switched on, then the DAG root command is written to the UART of the root
+    assert results['events'] == NUM_MOTES + 2
+    assert results['forwarded'] == 0
+
+    # each worker traces its events to its own file
+    for (shard_id, shard) in enumerate(results['shards']):
+        assert len(tmpdir.join('trace.{0}'.format(shard_id)).readlines()) == shard['events']
+        assert shard['trace_digest']
+
+
+@pytest.mark.parametrize('simulation_type', [BatchSimulation, functools.partial(ShardedBatchSimulation, shards=2)])
+def test_batch_mote_ids(fw_path, tmpdir, simulation_type):
+    path = tmpdir.join('topology.json')
+    path.write(json.dumps({'motes': [{'id': 1}, {'id': 3}], 'connections': []}))
+
+    with pytest.raises(BatchError):
+        simulation_type(str(path), fw_path)
+
+
+@pytest.mark.parametrize('simulation_type', [BatchSimulation, functools.partial(ShardedBatchSimulation, shards=2)])
+def test_batch_unknown_root(fw_path, topo_file, simulation_type):
+    with pytest.raises(BatchError):
+        simulation_type(topo_file, fw_path, root=NUM_MOTES + 1)
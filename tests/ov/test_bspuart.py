@@ -0,0 +1,149 @@
+#!/usr/bin/env python2
+
+import logging.handlers
+import threading
+
+import mock
+import pytest
+
+from openvisualizer.bspemulator.bspuart import BspUart
+from openvisualizer.simengine.simengine import SimEngine
+from openvisualizer.simengine.timeline import TimeLine
+
+# ============================ logging =========================================
+
+LOGFILE_NAME = 'test_bspuart.log'
+
+log = logging.getLogger('test_bspuart')
+log.setLevel(logging.ERROR)
+log.addHandler(logging.NullHandler())
+
+log_handler = logging.handlers.RotatingFileHandler(LOGFILE_NAME, backupCount=5, mode='w')
+log_handler.setFormatter(logging.Formatter("%(asctime)s [%(name)s:%(levelname)s] %(message)s"))
+for logger_name in ['test_bspuart']:
+    temp = logging.getLogger(logger_name)
+    temp.setLevel(logging.DEBUG)
+    temp.addHandler(log_handler)
+
+# ============================ defines =========================================
+
+MOTE_ID = 1
+
+FRAME_1 = '\x7e\x01\x02\x03\x7e'
+FRAME_2 = '\x7e\x04\x05\x7e'
+
+
+# ============================ fixtures ========================================
+
+class FakeMote(object):
+    """ Firmware which reads each byte signaled by its UART. """
+
+    def __init__(self):
+        self.handler = None
+        self.received = []
+        self.num_tx_interrupts = 0
+
+    def uart_isr_rx(self):
+        self.received.append((self.handler.engine.timeline.get_current_time_ns(),
+                              self.handler.bsp_uart.cmd_read_byte()))
+
+    def uart_isr_tx(self):
+        self.num_tx_interrupts += 1
+
+
+class FakeMoteHandler(object):
+    def __init__(self):
+        self.engine = SimEngine()
+        self.mote = FakeMote()
+        self.mote.handler = self
+        self.bsp_uart = BspUart(self)
+
+    def get_id(self):
+        return MOTE_ID
+
+    @staticmethod
+    def handle_event(cb):
+        cb()
+
+
+@pytest.fixture()
+def mote_handler():
+    engine = SimEngine()
+    with mock.patch.object(engine, 'timeline', TimeLine()), \
+            mock.patch.object(engine, 'moteHandlers', []), \
+            mock.patch.object(engine, 'mote_handlers_by_id', {}), \
+            mock.patch.object(engine, 'pause'), \
+            mock.patch.object(engine, 'resume'):
+        mh = FakeMoteHandler()
+        engine.add_mote_handler(mh)
+        yield mh
+
+
+# ============================ tests ===========================================
+
+def test_bspuart_write_frames(mote_handler):
+    """ Each frame written to the mote is received in one event, once all its bytes went through the UART. """
+
+    uart = mote_handler.bsp_uart
+    assert uart.write(FRAME_1) == len(FRAME_1)
+    assert uart.write(FRAME_2) == len(FRAME_2)
+    num_events = mote_handler.engine.timeline.run_until(1.0)
+
+    end_1 = -(-len(FRAME_1) * 1000000000 // BspUart.BAUDRATE)
+    end_2 = end_1 + -(-len(FRAME_2) * 1000000000 // BspUart.BAUDRATE)
+    assert num_events == 2
+    assert mote_handler.mote.received == [(end_1, ord(b)) for b in FRAME_1] + [(end_2, ord(b)) for b in FRAME_2]
+
+
+def test_bspuart_write_from_thread(mote_handler):
+    """ A frame written by another thread is scheduled by the thread running the events, without pausing the engine. """
+
+    uart = mote_handler.bsp_uart
+    timeline = mote_handler.engine.timeline
+
+    writer = threading.Thread(target=uart.write, args=(FRAME_1,))
+    writer.start()
+    writer.join()
+    assert timeline.get_num_events() == 0
+
+    assert timeline.run_until(1.0) == 1
+    assert [byte for (_, byte) in mote_handler.mote.received] == [ord(b) for b in FRAME_1]
+    assert not mote_handler.engine.pause.called
+    assert not mote_handler.engine.resume.called
+
+
+def test_bspuart_read_frames(mote_handler):
+    """ The bytes written by the mote are handed to the mote probe by frame, XON/XOFF escaped. """
+
+    uart = mote_handler.bsp_uart
+    for byte in [0x7e, 0x01, BspUart.XON]:
+        uart.cmd_write_byte(byte)
+        mote_handler.engine.timeline.run_until(mote_handler.engine.timeline.get_next_event_time() + 0.0001)
+    assert uart.uart_rx_queue.empty()
+
+    uart.cmd_write_byte(0x7e)
+    uart.cmd_set_cts(False)
+    uart.uart_write_buffer_by_len_fastsim([0x7e, BspUart.XOFF, 0x7e])
+
+    assert uart.read() == [chr(b) for b in [0x7e, 0x01, BspUart.XONXOFF_ESCAPE, BspUart.XON ^ BspUart.XONXOFF_MASK,
+                                            0x7e, BspUart.XOFF, 0x7e, BspUart.XONXOFF_ESCAPE,
+                                            BspUart.XOFF ^ BspUart.XONXOFF_MASK, 0x7e]]
+    assert uart.uart_rx_queue.empty()
+    assert mote_handler.mote.num_tx_interrupts == 3
+
+
+def test_bspuart_frame_handler(mote_handler):
+    """ With a frame handler, each frame is handed over as soon as it is written, instead of being queued. """
+
+    uart = mote_handler.bsp_uart
+    frames = []
+    uart.set_frame_handler(frames.append)
+
+    uart.cmd_write_byte(0x7e)
+    uart.cmd_write_byte(0x01)
+    assert frames == []
+    uart.cmd_write_byte(0x7e)
+    uart.cmd_set_cts(True)
+
+    assert frames == [['\x7e', '\x01', '\x7e'], [chr(BspUart.XON)]]
+    assert uart.uart_rx_queue.empty()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python2
+
+import logging.handlers
+import random
+
+import mock
+import pytest
+
+from openvisualizer.bspemulator import hwsupply, hwcrystal, bspboard, bspdebugpins, bspeui64, bspleds, bspsctimer
+from openvisualizer.bspemulator import bspradio, bspuart
+from openvisualizer.simengine import checkpoint
+from openvisualizer.simengine.simengine import SimEngine
+from openvisualizer.simengine.timeline import TimeLine
+
+# ============================ logging =========================================
+
+LOGFILE_NAME = 'test_checkpoint.log'
+
+log = logging.getLogger('test_checkpoint')
+log.setLevel(logging.ERROR)
+log.addHandler(logging.NullHandler())
+
+log_handler = logging.handlers.RotatingFileHandler(LOGFILE_NAME, backupCount=5, mode='w')
+log_handler.setFormatter(logging.Formatter("%(asctime)s [%(name)s:%(levelname)s] %(message)s"))
+for logger_name in ['test_checkpoint', 'Checkpoint']:
+    temp = logging.getLogger(logger_name)
+    temp.setLevel(logging.DEBUG)
+    temp.addHandler(log_handler)
+
+# ============================ defines =========================================
+
+MOTE_IDS = [1, 2, 3]
+CHANNEL = 11
+CHECKPOINT_TIME = 0.5
+END_TIME = 1.0
+
+# the state of the propagation model and of the location manager, restored by each test
+ENGINE_STATE = {
+    'propagation': checkpoint.PROPAGATION_STATE + ['random', 'rng'],
+    'location_manager': ['random', 'cells', 'mote_cells'],
+}
+
+
+# ============================ fixtures ========================================
+
+class FakeFirmware(object):
+    """ Counts its interrupts in its memory, and traces the frames its radio receives. """
+
+    def __init__(self, mote):
+        self.mote = mote
+        self.memory = {'interrupts': 0, 'uart_tx': 0, 'ticks': 0}
+
+    def get_state(self):
+        return dict(self.memory)
+
+    def set_state(self, state):
+        self.memory = dict(state)
+
+    def radio_isr_startFrame(self, counter_val):
+        self.mote.trace.append((self.mote.engine.timeline.get_current_time_ns(), self.mote.get_id(), 'start',
+                                self.mote.bsp_radio.rx_from, self.mote.bsp_radio.rx_buf, counter_val))
+
+    def radio_isr_endFrame(self, counter_val):
+        self.mote.trace.append((self.mote.engine.timeline.get_current_time_ns(), self.mote.get_id(), 'end',
+                                counter_val, self.mote.bsp_radio.crc_passes))
+
+    def uart_isr_tx(self):
+        self.memory['uart_tx'] += 1
+
+
+class FakeMoteHandler(object):
+    """
+    A mote handler with the emulated modules of a mote, whose firmware ticks at random intervals: each tick writes a
+    frame to its UART, and every few ticks it transmits a frame.
+    """
+
+    def __init__(self, mote_id, trace):
+        self.engine = SimEngine()
+        self.id = mote_id
+        self.mote = FakeFirmware(self)
+        self.booted = True
+        self.location = (0.0, 0.0)
+        self.num_rx_commands = 0
+        self.num_tx_commands = 0
+        self.trace = trace
+        self.hw_supply = hwsupply.HwSupply(self)
+        self.hw_crystal = hwcrystal.HwCrystal(self)
+        self.bsp_board = bspboard.BspBoard(self)
+        self.bsp_debugpins = bspdebugpins.BspDebugPins(self, False)
+        self.bsp_eui64 = bspeui64.BspEui64(self)
+        self.bsp_leds = bspleds.BspLeds(self)
+        self.bsp_sctimer = bspsctimer.BspSctimer(self)
+        self.bsp_radio = bspradio.BspRadio(self)
+        self.bsp_uart = bspuart.BspUart(self)
+
+    def get_id(self):
+        return self.id
+
+    def handle_event(self, cb):
+        if cb():
+            self.mote.memory['interrupts'] += 1
+
+    def start(self):
+        self.hw_crystal.start()
+        self.bsp_sctimer.cmd_init()
+        self.bsp_radio.cmd_init()
+        self.bsp_radio.cmd_set_frequency(CHANNEL)
+        self.bsp_radio.cmd_rx_enable()
+        self.engine.timeline.schedule_event(random.uniform(0, 0.01), self.id, self.tick, 'tick')
+
+    def tick(self):
+        now = self.engine.timeline.get_current_time()
+        self.mote.memory['ticks'] += 1
+        ticks = self.mote.memory['ticks']
+        self.trace.append((now, self.id, 'tick', self.mote.get_state()))
+        self.bsp_uart.cmd_write_circular_buffer_fastsim([0x7e, self.id, ticks % 256, 0x7e])
+        if ticks % 5 == 0:
+            self.engine.propagation._indicate_tx_start(None, None, (self.id, [ticks], CHANNEL))
+            self.engine.propagation._indicate_tx_end(None, None, self.id)
+        self.engine.timeline.schedule_event(now + random.uniform(0.001, 0.01), self.id, self.tick, 'tick')
+        return True
+
+
+@pytest.fixture()
+def engine():
+    engine = SimEngine()
+    trace = []
+    patches = [mock.patch.object(engine, 'timeline', TimeLine()),
+               mock.patch.object(engine, 'moteHandlers', []),
+               mock.patch.object(engine, 'mote_handlers_by_id', {})]
+    for (component, names) in ENGINE_STATE.items():
+        patches += [mock.patch.object(getattr(engine, component), name, getattr(getattr(engine, component), name))
+                    for name in names]
+
+    for patch in patches:
+        patch.start()
+    try:
+        engine.propagation.set_random(random.Random(1))
+        engine.propagation.set_collision_model(False)
+        engine.propagation.connections = dict((m, dict((o, 0.5) for o in MOTE_IDS if o != m)) for m in MOTE_IDS)
+        for mote_id in MOTE_IDS:
+            engine.add_mote_handler(FakeMoteHandler(mote_id, trace))
+        yield engine, trace
+    finally:
+        for patch in reversed(patches):
+            patch.stop()
+
+
+# ============================ tests ===========================================
+
+def test_checkpoint_restore(engine, tmpdir):
+    (engine, trace) = engine
+    path = str(tmpdir.join('checkpoint'))
+
+    random.seed(1)
+    for mh in engine.moteHandlers:
+        mh.start()
+    engine.timeline.run_until(CHECKPOINT_TIME)
+    engine.save_checkpoint(path)
+    num_events = engine.timeline.get_stats().get_num_events()
+    uart_frames = [list(mh.bsp_uart.uart_rx_queue.queue) for mh in engine.moteHandlers]
+    assert all(uart_frames)
+
+    del trace[:]
+    engine.timeline.run_until(END_TIME)
+    expected = list(trace)
+    assert [t for t in expected if t[2] == 'start']
+    assert engine.propagation.get_stats()['frames_delivered']
+
+    # going back to the checkpoint replays exactly the same simulation
+    del trace[:]
+    engine.load_checkpoint(path)
+    assert engine.timeline.get_current_time() < CHECKPOINT_TIME
+    assert engine.timeline.get_stats().get_num_events() == num_events
+    assert [list(mh.bsp_uart.uart_rx_queue.queue) for mh in engine.moteHandlers] == uart_frames
+    engine.timeline.run_until(END_TIME)
+    assert trace == expected
+
+
+def test_checkpoint_unsupported_event(engine):
+    (engine, _) = engine
+
+    engine.timeline.schedule_event(1.0, 1, lambda: True, 'lambda')
+    with pytest.raises(checkpoint.CheckpointError):
+        checkpoint.get_state(engine)
+
+
+def test_checkpoint_firmware_without_hooks(engine):
+    """ The memory of a booted firmware which does not expose it cannot be saved. """
+
+    (engine, _) = engine
+
+    mh = engine.get_mote_handler_by_id(MOTE_IDS[0])
+    with mock.patch.object(mh, 'mote', object()):
+        with pytest.raises(checkpoint.CheckpointError):
+            checkpoint.get_state(engine)
+
+        # until it boots, the mote has no firmware memory to save
+        mh.booted = False
+        assert checkpoint.get_state(engine)['motes'][mh.get_id()]['firmware'] is None
@@ -1,6 +1,7 @@
 #!/usr/bin/env python2
 
 import logging.handlers
+import threading
 from random import randint, shuffle
 
 import pytest
@@ -30,6 +31,9 @@ NUM_OF_TEST_VECTORS = 100
 MAX_PAYLOAD_SIZE = 1280
 MIN_PAYLOAD_SIZE = 0
 
+NUM_OF_DISPATCH_THREADS = 4
+NUM_OF_PACKETS_PER_THREAD = 500
+
 # ============================ fixtures ========================================
 TEST_VECTORS = []
 
@@ -95,3 +99,35 @@ def test_fragment_packet(random_6lwp_fragments):
         log.debug(list(bytearray(raw(reassembled[1]))))
         log.debug(ip_pkt)
         assert ip_pkt == list(bytearray(raw(reassembled[1])))
+
+
+def test_fragment_tags_concurrent():
+    log.debug("test_fragment_tags_concurrent")
+
+    fragmentor = sixlowpan_frag.Fragmentor()
+    ip_pkt = [0x60] + [0] * 299
+    tags = [[] for _ in range(NUM_OF_DISPATCH_THREADS)]
+
+    def dispatch(thread_tags):
+        for _ in range(NUM_OF_PACKETS_PER_THREAD):
+            frags = fragmentor.do_fragment(ip_pkt)
+            # all the fragments of a packet carry the same tag
+            assert len(set(tuple(f[2:4]) for f in frags)) == 1
+            thread_tags.append(tuple(frags[0][2:4]))
+
+    threads = [threading.Thread(target=dispatch, args=(t,)) for t in tags]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    all_tags = [tag for thread_tags in tags for tag in thread_tags]
+    assert len(all_tags) == NUM_OF_DISPATCH_THREADS * NUM_OF_PACKETS_PER_THREAD
+    assert len(set(all_tags)) == len(all_tags)
+
+
+def test_fragment_tag_wraps():
+    fragmentor = sixlowpan_frag.Fragmentor(tag=0xffff)
+
+    assert fragmentor.do_fragment([0x60] + [0] * 299)[0][2:4] == [0xff, 0xff]
+    assert fragmentor.do_fragment([0x60] + [0] * 299)[0][2:4] == [0x00, 0x00]
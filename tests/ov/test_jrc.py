@@ -0,0 +1,219 @@
+#!/usr/bin/env python2
+
+import json
+import logging.handlers
+import threading
+
+import mock
+import pytest
+from coap import coapDefines as Defs, coapMessage, coapOption
+
+from openvisualizer.jrc.jrc import CoapServer, CoapSession, ContextHandler, JoinResource, WriteBehindSecurityContext
+from openvisualizer.utils import format_ipv6_addr
+
+# ============================ logging =========================================
+
+LOGFILE_NAME = 'test_jrc.log'
+
+log = logging.getLogger('test_jrc')
+log.setLevel(logging.ERROR)
+log.addHandler(logging.NullHandler())
+
+log_handler = logging.handlers.RotatingFileHandler(LOGFILE_NAME, backupCount=5, mode='w')
+log_handler.setFormatter(logging.Formatter("%(asctime)s [%(name)s:%(levelname)s] %(message)s"))
+for logger_name in ['test_jrc', 'JRC']:
+    temp = logging.getLogger(logger_name)
+    temp.setLevel(logging.DEBUG)
+    temp.addHandler(log_handler)
+
+# ============================ defines =========================================
+
+PREFIX = [0xbb, 0xbb, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
+DAGROOT = [0x14, 0x15, 0x92, 0xcc, 0x00, 0x00, 0x00, 0x01]
+
+NUM_PLEDGES = 300
+
+EUI64_A = '\x14\x15\x92\xcc\x00\x00\x00\x02'
+EUI64_B = '\x14\x15\x92\xcc\x00\x00\x00\x03'
+
+
+# ============================ fixtures ========================================
+
+@pytest.fixture()
+def server():
+    coap_server = CoapServer(JoinResource())
+    coap_server.dagroot_eui64 = DAGROOT
+    yield coap_server
+    coap_server.close()
+
+
+# ============================ helpers =========================================
+
+def _pledge_address(i):
+    return PREFIX + [0x14, 0x15, 0x92, 0xcc, 0x00, 0x00, (i >> 8) & 0xff, i & 0xff]
+
+
+def _join_request(message_id):
+    return coapMessage.buildMessage(
+        msgtype=Defs.TYPE_CON,
+        token=message_id & 0xff,
+        code=Defs.METHOD_POST,
+        messageId=message_id,
+        options=[coapOption.UriPath(path='j')],
+    )
+
+
+# ============================ tests ===========================================
+
+def test_jrc_session_reuse(server):
+    with mock.patch.object(server, 'dispatch') as dispatch:
+        server._receive_from_mesh(None, None, (_pledge_address(1), _join_request(1)))
+        server._receive_from_mesh(None, None, (_pledge_address(1), _join_request(2)))
+
+    assert dispatch.call_count == 2
+    assert len(server.sessions) == 1
+
+
+def test_jrc_session_idle_timeout(server):
+    with mock.patch.object(server, 'dispatch'):
+        server._receive_from_mesh(None, None, (_pledge_address(1), _join_request(1)))
+        server._receive_from_mesh(None, None, (_pledge_address(2), _join_request(2)))
+
+    # pretend the first session has been idle for longer than the timeout, without any other traffic since
+    server.sessions[format_ipv6_addr(_pledge_address(1))].last_used -= 2 * CoapServer.SESSION_IDLE_TIMEOUT
+    with mock.patch.object(CoapSession, 'close', autospec=True, side_effect=CoapSession.close) as close:
+        server._purge_sessions()
+
+    assert close.call_count == 1
+    assert server.sessions.keys() == [format_ipv6_addr(_pledge_address(2))]
+
+
+def test_jrc_concurrent_joins(server):
+    """ Hundreds of pledges send their join request at the same time, each must get its own response. """
+
+    start = threading.Event()
+    responses = []
+
+    def pledge(i):
+        start.wait()
+        server._receive_from_mesh(None, None, (_pledge_address(i), _join_request(i)))
+
+    pledges = [threading.Thread(target=pledge, args=(i,)) for i in range(NUM_PLEDGES)]
+
+    # record the responses with list.append, which (unlike the mock call counters) is atomic
+    with mock.patch.object(server, 'dispatch', side_effect=lambda signal, data: responses.append((signal, data))):
+        for p in pledges:
+            p.start()
+        start.set()
+        for p in pledges:
+            p.join()
+
+    assert len(responses) == NUM_PLEDGES
+    assert len(server.sessions) == NUM_PLEDGES
+
+    # every response is addressed to the pledge which sent the request, with the matching message ID
+    destinations = set()
+    for (signal, ip) in responses:
+        assert signal == 'v6ToMesh'
+        dst = ip[24:40]
+        message_id = (ip[48 + 2] << 8) | ip[48 + 3]
+        assert dst == _pledge_address(message_id)
+        destinations.add(tuple(dst))
+
+    assert len(destinations) == NUM_PLEDGES
+
+
+def _join(join_resource, eui64, context):
+    with mock.patch('openvisualizer.jrc.jrc.Oscoap.objectSecurityOptionLookUp') as lookup:
+        lookup.return_value.kidContext = [ord(b) for b in eui64]
+        lookup.return_value.context = context
+        return join_resource.POST(options=[])[0]
+
+
+def test_jrc_context_cache(tmpdir):
+    join_resource = JoinResource()
+    context_handler = ContextHandler(join_resource)
+
+    with mock.patch('openvisualizer.jrc.jrc.user_data_dir', return_value=str(tmpdir)):
+        # the context of a pledge is only cached once it joined
+        tentative = context_handler.security_context_lookup('', EUI64_A)
+        context = context_handler.security_context_lookup('', EUI64_A)
+        assert context is not tentative
+
+        assert _join(join_resource, EUI64_A, context) == Defs.COAP_RC_2_04_CHANGED
+        assert context_handler.security_context_lookup('', EUI64_A) is context
+
+        # the end of the block of sequence numbers is written to disk before the first one is used
+        assert context.getSequenceNumber() == 1
+        assert json.load(open(context.securityContextFilePath))['sequenceNumber'] == \
+            WriteBehindSecurityContext.SEQUENCE_NUMBER_BLOCK
+
+        # the replay window is only written to disk when the context is flushed
+        context.replayWindowUpdate(5)
+        assert json.load(open(context.securityContextFilePath))['replayWindow'] == [0]
+        context_handler.flush()
+        assert json.load(open(context.securityContextFilePath))['replayWindow'] == [0, 5]
+
+        context.replayWindowUpdate(6)
+        context_handler.close()
+
+    assert json.load(open(context.securityContextFilePath))['replayWindow'] == [0, 5, 6]
+    assert context_handler.get_stats()['context_cache_hits'] == 1
+    assert context_handler.get_stats()['context_cache_misses'] == 2
+
+
+def test_jrc_sequence_number_blocks(tmpdir):
+    file_path = str(tmpdir.join('context.json'))
+    ContextHandler.security_context_create_overwrite(file_path, '01', '', ContextHandler.master_secret, '01', '')
+
+    context = WriteBehindSecurityContext(file_path)
+    numbers = [context.getSequenceNumber() for _ in range(WriteBehindSecurityContext.SEQUENCE_NUMBER_BLOCK + 1)]
+    assert numbers == range(1, WriteBehindSecurityContext.SEQUENCE_NUMBER_BLOCK + 2)
+    assert json.load(open(file_path))['sequenceNumber'] == 2 * WriteBehindSecurityContext.SEQUENCE_NUMBER_BLOCK
+
+    # without being persisted (crash), a reloaded context starts after the numbers reserved before
+    reloaded = WriteBehindSecurityContext(file_path)
+    assert reloaded.getSequenceNumber() == 2 * WriteBehindSecurityContext.SEQUENCE_NUMBER_BLOCK + 1
+
+
+def test_jrc_context_eviction(tmpdir):
+    join_resource = JoinResource()
+    context_handler = ContextHandler(join_resource)
+
+    with mock.patch('openvisualizer.jrc.jrc.user_data_dir', return_value=str(tmpdir)), \
+            mock.patch.object(ContextHandler, 'CONTEXT_CACHE_SIZE', 1):
+        context = context_handler.security_context_lookup('', EUI64_A)
+        context.getSequenceNumber()
+        assert _join(join_resource, EUI64_A, context) == Defs.COAP_RC_2_04_CHANGED
+
+        # another node joining evicts (and persists) the context of the first one, which is then reloaded
+        assert _join(join_resource, EUI64_B, context_handler.security_context_lookup('', EUI64_B)) == \
+            Defs.COAP_RC_2_04_CHANGED
+        reloaded = context_handler.security_context_lookup('', EUI64_A)
+
+        assert reloaded is not context
+        assert reloaded.getSequenceNumber() == WriteBehindSecurityContext.SEQUENCE_NUMBER_BLOCK + 1
+
+        context_handler.close()
+
+    stats = join_resource.get_stats()
+    assert stats['joined_nodes'] == 2
+    assert stats['joins'] == 2
+
+
+def test_jrc_join_latency(tmpdir):
+    join_resource = JoinResource()
+    context_handler = ContextHandler(join_resource)
+
+    with mock.patch('openvisualizer.jrc.jrc.user_data_dir', return_value=str(tmpdir)), \
+            mock.patch('openvisualizer.jrc.jrc.time') as clock:
+        clock.time.side_effect = [100.0, 105.0, 110.0]
+
+        # the latency is measured from the first join request of the pledge, not from its last one
+        context_handler.security_context_lookup('', EUI64_A)
+        context = context_handler.security_context_lookup('', EUI64_A)
+        _join(join_resource, EUI64_A, context)
+
+    context_handler.close()
+
+    assert join_resource.get_stats()['join_latency'] == {'min': 10.0, 'max': 10.0, 'avg': 10.0}
@@ -0,0 +1,83 @@
+#!/usr/bin/env python2
+
+import logging.handlers
+import time
+
+import mock
+import pytest
+
+from openvisualizer.simengine import motehandler
+from openvisualizer.simengine.simengine import SimEngine
+
+# ============================ logging =========================================
+
+LOGFILE_NAME = 'test_motehandler.log'
+
+log = logging.getLogger('test_motehandler')
+log.setLevel(logging.ERROR)
+log.addHandler(logging.NullHandler())
+
+log_handler = logging.handlers.RotatingFileHandler(LOGFILE_NAME, backupCount=5, mode='w')
+log_handler.setFormatter(logging.Formatter("%(asctime)s [%(name)s:%(levelname)s] %(message)s"))
+for logger_name in ['test_motehandler']:
+    temp = logging.getLogger(logger_name)
+    temp.setLevel(logging.DEBUG)
+    temp.addHandler(log_handler)
+
+# ============================ defines =========================================
+
+NUM_EVENTS = 5000
+
+
+# ============================ fixtures ========================================
+
+class FakeMote(object):
+    """ Firmware which counts how many times its scheduler is kicked. """
+
+    def __init__(self):
+        self.handler = None
+        self.wakeups = 0
+
+    def set_callback(self, notif, cb):
+        pass
+
+    def supply_on(self):
+        while True:
+            self.handler.bsp_board.cmd_sleep()
+            self.wakeups += 1
+
+
+@pytest.fixture(params=['inline', 'threads'])
+def mote_handler(request):
+    engine = SimEngine()
+    engine.set_mote_threads(request.param == 'threads')
+
+    mote = FakeMote()
+    with mock.patch('openvisualizer.simengine.motehandler.notif_id', return_value=0):
+        mote.handler = motehandler.MoteHandler(mote, vcdlog=False)
+
+    yield mote.handler
+    engine.set_mote_threads(False)
+
+
+# ============================ tests ===========================================
+
+def test_mote_handler_cpu_handover(mote_handler):
+    mote = mote_handler.mote
+
+    # the firmware runs until it goes to sleep
+    mote_handler.handle_event(mote_handler.hw_supply.switch_on)
+    assert mote.wakeups == 0
+
+    # interrupts which do not kick the scheduler leave the firmware asleep
+    mote_handler.handle_event(lambda: False)
+    assert mote.wakeups == 0
+
+    start = time.time()
+    for _ in range(NUM_EVENTS):
+        mote_handler.handle_event(lambda: True)
+    duration = time.time() - start
+
+    assert mote.wakeups == NUM_EVENTS
+    assert mote_handler.inline == (not SimEngine().mote_threads)
+    log.info('{0}: {1:.0f} events/s'.format('inline' if mote_handler.inline else 'threads', NUM_EVENTS / duration))
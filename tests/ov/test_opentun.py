@@ -0,0 +1,262 @@
+#!/usr/bin/env python2
+
+import json
+import logging.handlers
+import os
+import socket
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from openvisualizer.opentun.opentunlinux import TunDispatchThread, TunReadThread, TunWriteThread
+
+# ============================ logging =========================================
+
+LOGFILE_NAME = 'test_opentun.log'
+
+log = logging.getLogger('test_opentun')
+log.setLevel(logging.ERROR)
+log.addHandler(logging.NullHandler())
+
+log_handler = logging.handlers.RotatingFileHandler(LOGFILE_NAME, backupCount=5, mode='w')
+log_handler.setFormatter(logging.Formatter("%(asctime)s [%(name)s:%(levelname)s] %(message)s"))
+for logger_name in ['test_opentun', 'OpenTunLinux']:
+    temp = logging.getLogger(logger_name)
+    temp.setLevel(logging.DEBUG)
+    temp.addHandler(log_handler)
+
+# ============================ defines =========================================
+
+TUN_HEADER = [0x00, 0x00, 0x86, 0xdd]
+
+NUM_PACKETS = 200
+
+# configures a TUN interface in a fresh network namespace, configures it again and prints the resulting state
+NETNS_SCRIPT = """
+import json
+from openvisualizer.opentun.netlink import RtNetlink
+from openvisualizer.opentun.opentun import OpenTun
+
+def state(nl, index):
+    return {
+        'addresses': sorted([[list(bytearray(a)), p] for (a, p) in nl.get_addresses(index)]),
+        'routes': sorted([[list(bytearray(d)), p] for (d, p) in nl.get_routes(index)]),
+    }
+
+tun = OpenTun.create(opentun=True)
+result = {'tun_if': tun.tun_if}
+if tun.tun_if:
+    with RtNetlink() as nl:
+        result['before'] = state(nl, tun.if_index)
+        tun._configure_prefix(OpenTun.IPV6PREFIX)
+        result['after'] = state(nl, tun.if_index)
+
+    tun.close()
+    result['threads_alive'] = [t.name for t in tun.tun_read_threads if t.isAlive()]
+
+    # the interface can be created again right away
+    tun = OpenTun.create(opentun=True)
+    result['restarted'] = tun.tun_if is not None
+    tun.close()
+print(json.dumps(result))
+"""
+
+# sends UDP bursts to several motes through a multi-queue TUN interface, each burst followed by an 'end' datagram, and
+# prints what reached the EventBus once the 'end' datagrams of all the motes did
+NETNS_MULTI_QUEUE_SCRIPT = """
+import json
+import socket
+import threading
+from openvisualizer.opentun.opentun import OpenTun
+
+tun = OpenTun.create(opentun=True, queues=4)
+received = []
+ends = []
+done = threading.Event()
+
+def dispatch(signal, data):
+    received.append(data)
+    if str(bytearray(data[48:])) == 'end':
+        ends.append(data)
+        if len(ends) == 8:
+            done.set()
+
+tun.dispatch = dispatch
+result = {'tun_if': tun.tun_if, 'queues': len(tun.tun_queues)}
+if tun.tun_if:
+    sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+    for i in range(100):
+        for mote in range(8):
+            sock.sendto(str(i), ('bbbb::1415:9200:0:{0}'.format(mote + 2), 5683))
+    for mote in range(8):
+        sock.sendto('end', ('bbbb::1415:9200:0:{0}'.format(mote + 2), 5683))
+
+    # the datagrams of a mote are all read by one thread, in order: after its 'end', none of them is still queued
+    result['completed'] = done.wait(60)
+    result['stats'] = tun.get_stats()
+    tun.close()
+result['received'] = received
+print(json.dumps(result))
+"""
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='requires unix sockets')
+
+
+# ============================ fixtures ========================================
+
+@pytest.fixture()
+def tun():
+    """ A datagram socket pair stands in for the TUN interface: it keeps the packet boundaries. """
+    (host, tun_if) = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    yield host, tun_if
+    host.close()
+    tun_if.close()
+
+
+# ============================ helpers =========================================
+
+def _run_in_netns(script):
+    try:
+        output = subprocess.check_output(['unshare', '-rn', sys.executable, '-c', script],
+                                         cwd=os.path.join(os.path.dirname(__file__), '..', '..'))
+    except (OSError, subprocess.CalledProcessError) as err:
+        pytest.skip('cannot run in a network namespace ({0})'.format(err))
+    return json.loads(output.splitlines()[-1])
+
+
+def _ipv6_packet(i, payload_length=8, dst=None):
+    dst = [i & 0xff] * 16 if dst is None else dst
+    return [0x60, 0x00, 0x00, 0x00, 0x00, payload_length, 0x11, 0x40] + [i & 0xff] * 16 + dst + \
+        [0xaa] * payload_length
+
+
+# ============================ tests ===========================================
+
+def test_tun_read_batches(tun):
+    (host, tun_if) = tun
+
+    received = []
+    done = threading.Event()
+
+    def callback(packets):
+        received.extend(packets)
+        if len(received) >= NUM_PACKETS:
+            done.set()
+
+    reader = TunReadThread(tun_if.fileno(), callback)
+    try:
+        # packets which are not IPv6 are discarded
+        host.send(str(bytearray(TUN_HEADER + [0x45] * 40)))
+        for i in range(NUM_PACKETS):
+            # trailing bytes beyond the IPv6 payload length are cut
+            host.send(str(bytearray(TUN_HEADER + _ipv6_packet(i) + [0x00] * 3)))
+
+        assert done.wait(5)
+    finally:
+        reader.close()
+        reader.join(1)
+
+    # closing wakes the reader up immediately
+    assert not reader.isAlive()
+    assert received == [_ipv6_packet(i) for i in range(NUM_PACKETS)]
+
+    stats = reader.get_stats()
+    assert stats['rx_packets'] == NUM_PACKETS + 1
+    assert stats['rx_batches'] <= NUM_PACKETS + 1
+    assert stats['rx_dropped'] == 0
+
+
+def test_tun_read_flows(tun):
+    """ With several dispatch threads, the packets to one destination are all handled by one thread, in order. """
+
+    (host, tun_if) = tun
+
+    received = {}
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def callback(packets):
+        with lock:
+            for p in packets:
+                received.setdefault(threading.current_thread().name, []).append(p)
+            if sum([len(v) for v in received.values()]) >= NUM_PACKETS:
+                done.set()
+
+    dispatch_threads = [TunDispatchThread(callback, 'TunDispatchThread{0}'.format(i)) for i in range(4)]
+    reader = TunReadThread(tun_if.fileno(), dispatch_threads=dispatch_threads)
+    try:
+        for i in range(NUM_PACKETS):
+            host.send(str(bytearray(TUN_HEADER + _ipv6_packet(i, dst=[i % 8] * 16))))
+        assert done.wait(5)
+    finally:
+        reader.close()
+        reader.join()
+        for t in dispatch_threads:
+            t.close()
+
+    handled_by = {}
+    for (name, packets) in received.items():
+        for p in packets:
+            assert handled_by.setdefault(p[24], name) == name
+        assert [p[8] for p in packets] == sorted([p[8] for p in packets])
+    assert len(handled_by) == 8
+
+
+def test_tun_write(tun):
+    (host, tun_if) = tun
+
+    writer = TunWriteThread(tun_if.fileno())
+    for i in range(NUM_PACKETS):
+        assert writer.write(str(bytearray(TUN_HEADER + _ipv6_packet(i))))
+
+    for i in range(NUM_PACKETS):
+        assert list(bytearray(os.read(host.fileno(), 1500))) == TUN_HEADER + _ipv6_packet(i)
+
+    writer.close()
+    writer.join()
+
+    stats = writer.get_stats()
+    assert stats['tx_packets'] == NUM_PACKETS
+    assert stats['tx_errors'] == 0
+
+
+def test_tun_netlink_configuration():
+    result = _run_in_netns(NETNS_SCRIPT)
+    if not result['tun_if']:
+        pytest.skip('cannot create a tun interface in a network namespace')
+
+    host = [0xbb, 0xbb] + [0x00] * 13 + [0x01]
+    route = [0xbb, 0xbb] + [0x00] * 6 + [0x14, 0x15, 0x92] + [0x00] * 5
+
+    assert [host, 64] in result['before']['addresses']
+    assert [route, 96] in result['before']['routes']
+
+    # configuring the interface again has no effect
+    assert result['after'] == result['before']
+    assert result['after']['routes'].count([route, 96]) == 1
+
+    # closing does not need any traffic on the interface: the read threads wait without timeout, only the wakeup pipe
+    # can stop them
+    assert result['threads_alive'] == []
+    assert result['restarted']
+
+
+def test_tun_multi_queue():
+    result = _run_in_netns(NETNS_MULTI_QUEUE_SCRIPT)
+    if not result['tun_if']:
+        pytest.skip('cannot create a tun interface in a network namespace')
+
+    assert result['queues'] == 4
+    assert result['completed']
+    assert result['stats']['kernel_dropped'] == 0
+    assert result['stats']['rx_dropped'] == 0
+
+    # the UDP datagrams to each mote arrive in the order they were sent
+    udp = [p for p in result['received']
+           if p[6] == 17 and p[32:35] == [0x14, 0x15, 0x92] and str(bytearray(p[48:])) != 'end']
+    assert len(udp) == 800
+    for mote in range(8):
+        payloads = [int(str(bytearray(p[48:]))) for p in udp if p[39] == mote + 2]
+        assert payloads == range(100)
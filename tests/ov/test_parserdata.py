@@ -0,0 +1,49 @@
+#!/usr/bin/env python2
+
+import logging.handlers
+
+import pytest
+
+from openvisualizer.motehandler.moteconnector.openparser.parserdata import ParserData
+
+# ============================ logging =========================================
+
+LOGFILE_NAME = 'test_parserdata.log'
+
+log = logging.getLogger('test_parserdata')
+log.setLevel(logging.ERROR)
+log.addHandler(logging.NullHandler())
+
+log_handler = logging.handlers.RotatingFileHandler(LOGFILE_NAME, backupCount=5, mode='w')
+log_handler.setFormatter(logging.Formatter("%(asctime)s [%(name)s:%(levelname)s] %(message)s"))
+for logger_name in ['test_parserdata', 'ParserData']:
+    temp = logging.getLogger(logger_name)
+    temp.setLevel(logging.DEBUG)
+    temp.addHandler(log_handler)
+
+
+# ============================ tests ===========================================
+
+def test_parserdata_kpis():
+    parser_data = ParserData(None, 'emulated1')
+    parser_data.avg_kpi['0002'] = {
+        'counter': [4, 1, 2],
+        'latency': [10, 20, 30],
+        'numCellsUsedTx': [32, 32, 32],
+        'numCellsUsedRx': [1, 1, 1],
+        'dutyCycle': [0.25, 0.5, 0.75],
+        'avg_cellsUsage': 0.0,
+        'avg_latency': 0.0,
+        'avg_pdr': 0.0,
+    }
+
+    # packet 3 was lost
+    assert parser_data.get_kpis() == {
+        '0002': {
+            'received': 3,
+            'pdr': 0.75,
+            'avg_latency': 20,
+            'avg_cells_usage': 0.5,
+            'avg_duty_cycle': pytest.approx(0.5),
+        },
+    }
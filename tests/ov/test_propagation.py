@@ -0,0 +1,314 @@
+#!/usr/bin/env python2
+
+import logging.handlers
+import random
+import time
+from math import radians, cos, sin, asin, sqrt, log10
+
+import mock
+import pytest
+
+from openvisualizer.simengine import propagation
+from openvisualizer.simengine.simengine import SimEngine
+
+# ============================ logging =========================================
+
+LOGFILE_NAME = 'test_propagation.log'
+
+log = logging.getLogger('test_propagation')
+log.setLevel(logging.ERROR)
+log.addHandler(logging.NullHandler())
+
+log_handler = logging.handlers.RotatingFileHandler(LOGFILE_NAME, backupCount=5, mode='w')
+log_handler.setFormatter(logging.Formatter("%(asctime)s [%(name)s:%(levelname)s] %(message)s"))
+for logger_name in ['test_propagation']:
+    temp = logging.getLogger(logger_name)
+    temp.setLevel(logging.DEBUG)
+    temp.addHandler(log_handler)
+
+# ============================ defines =========================================
+
+NUM_MOTES = 300
+
+pytestmark = pytest.mark.skipif(propagation.numpy is None, reason='requires numpy')
+
+
+# ============================ fixtures ========================================
+
+class FakeMoteHandler(object):
+    def __init__(self, mote_id, location):
+        self.id = mote_id
+        self.location = location
+
+    def get_id(self):
+        return self.id
+
+    def get_location(self):
+        return self.location
+
+
+@pytest.fixture()
+def engine():
+    engine = SimEngine()
+    rng = random.Random(1)
+    motes = [FakeMoteHandler(i, (37.875 + rng.uniform(-0.005, 0.005), -122.257 + rng.uniform(-0.005, 0.005)))
+             for i in range(1, NUM_MOTES + 1)]
+    with mock.patch.object(engine.propagation, 'connections', {}), \
+            mock.patch.object(engine.propagation, 'sim_topology', ''), \
+            mock.patch.object(engine, 'moteHandlers', []), \
+            mock.patch.object(engine, 'mote_handlers_by_id', {}), \
+            mock.patch.object(engine.location_manager, 'cells', {}), \
+            mock.patch.object(engine.location_manager, 'mote_cells', {}):
+        yield engine, motes
+    engine.propagation.set_random(random.Random())
+
+
+# ============================ helpers =========================================
+
+def _pister_hack_pdr(location_from, location_to, draw):
+    """ The PDR of one link, as computed by Propagation.create_connection. """
+
+    lon_from, lat_from, lon_to, lat_to = map(radians, [location_from[1], location_from[0], location_to[1],
+                                                       location_to[0]])
+    a = sin((lat_to - lat_from) / 2) ** 2 + cos(lat_from) * cos(lat_to) * sin((lon_to - lon_from) / 2) ** 2
+    d_km = 6367 * 2 * asin(sqrt(a))
+    p_rx = 0.0 - (20 * log10(d_km) + 20 * log10(2.4) + 92.45) - 40.0 * draw
+    return min(max((p_rx + 101.0) / 15.0, 0.0), 1.0)
+
+
+def _distance(mh_from, mh_to):
+    (lat_from, lon_from, lat_to, lon_to) = map(radians, mh_from.location + mh_to.location)
+    a = sin((lat_to - lat_from) / 2) ** 2 + cos(lat_from) * cos(lat_to) * sin((lon_to - lon_from) / 2) ** 2
+    return 6367 * 2 * asin(sqrt(a))
+
+
+def _build(engine, motes):
+    for mh in motes:
+        engine.indicate_new_mote(mh)
+    return dict((k, dict(v)) for (k, v) in engine.propagation.connections.items())
+
+
+# ============================ tests ===========================================
+
+def test_propagation_pdr_matrix(engine):
+    (engine, motes) = engine
+    for mh in motes[:10]:
+        engine.add_mote_handler(mh)
+
+    engine.propagation.set_random(random.Random(42))
+    matrix = engine.propagation.compute_pdr_matrix([1, 2], range(1, 11))
+    draws = propagation.numpy.random.RandomState(random.Random(42).getrandbits(32)).random_sample((2, 10))
+
+    assert matrix.shape == (2, 10)
+    for (i, mh_from) in enumerate(motes[:2]):
+        for (j, mh_to) in enumerate(motes[:10]):
+            if mh_from is not mh_to:
+                assert matrix[i][j] == pytest.approx(_pister_hack_pdr(mh_from.location, mh_to.location, draws[i][j]))
+
+
+def test_propagation_build_topology(engine):
+    """ Building a topology is fast, and reproducible with a seed. """
+
+    (engine, motes) = engine
+
+    engine.propagation.set_random(random.Random(7))
+    start = time.time()
+    connections = _build(engine, motes)
+    duration = time.time() - start
+    log.info('{0} motes connected in {1:.3f}s'.format(NUM_MOTES, duration))
+
+    # links are symmetric, only the links with a PDR are kept
+    num_links = 0
+    for (from_mote, links) in connections.items():
+        for (to_mote, pdr) in links.items():
+            assert connections[to_mote][from_mote] == pdr
+            assert 0 < pdr <= 1
+            num_links += 1
+    assert 0 < num_links < NUM_MOTES * (NUM_MOTES - 1)
+
+    with mock.patch.object(engine.propagation, 'connections', {}), \
+            mock.patch.object(engine, 'moteHandlers', []), \
+            mock.patch.object(engine, 'mote_handlers_by_id', {}), \
+            mock.patch.object(engine.location_manager, 'cells', {}), \
+            mock.patch.object(engine.location_manager, 'mote_cells', {}):
+        engine.propagation.set_random(random.Random(7))
+        assert _build(engine, motes) == connections
+
+
+def test_propagation_neighbour_pruning(engine):
+    """ In a network spread over a city, only the motes within radio range of a new mote are evaluated. """
+
+    (engine, _) = engine
+    rng = random.Random(2)
+    motes = [FakeMoteHandler(i, (37.8 + rng.uniform(0, 0.2), -122.3 + rng.uniform(0, 0.2)))
+             for i in range(1, NUM_MOTES + 1)]
+    max_range = engine.propagation.get_max_range()
+    assert 1.0 < max_range < 1.2
+
+    with mock.patch.object(engine.propagation, 'compute_pdr_matrix',
+                           wraps=engine.propagation.compute_pdr_matrix) as compute_pdr_matrix:
+        for mh in motes:
+            engine.indicate_new_mote(mh)
+
+    num_evaluated = sum([len(c[0][1]) for c in compute_pdr_matrix.call_args_list])
+    log.info('{0} links evaluated for {1} motes'.format(num_evaluated, NUM_MOTES))
+    assert num_evaluated < NUM_MOTES * (NUM_MOTES - 1) / 2 / 10
+
+    # no link within radio range is missed
+    for mh in motes:
+        in_range = set([m.get_id() for m in motes if m is not mh and _distance(mh, m) < max_range])
+        assert set(engine.location_manager.get_motes_within(mh.location, max_range)) - {mh.get_id()} >= in_range
+        assert set(engine.propagation.connections.get(mh.get_id(), {}).keys()) <= in_range
+
+    # the index follows the motes which are moved or removed
+    engine.location_manager.move_mote(1, (0.0, 0.0))
+    assert engine.location_manager.get_motes_within((0.0, 0.0), 1.0) == [1]
+    engine.location_manager.remove_mote(1)
+    assert engine.location_manager.get_motes_within((0.0, 0.0), 1.0) == []
+
+
+def test_propagation_connection_table(engine):
+    (engine, motes) = engine
+    for mh in motes[:4]:
+        engine.add_mote_handler(mh)
+    propagation_model = engine.propagation
+
+    # a link without PDR is deleted, without deadlocking on the data lock
+    with mock.patch.object(propagation_model, 'sim_topology', 'linear'):
+        propagation_model.create_connections(2, [1, 3])
+        propagation_model.create_connection(3, 2)
+    assert propagation_model.connections == {1: {2: 1.0}, 2: {1: 1.0, 3: 1.0}, 3: {2: 1.0}}
+    propagation_model.delete_connection(3, 2)
+    propagation_model.delete_connection(3, 2)
+    assert propagation_model.connections == {1: {2: 1.0}, 2: {1: 1.0}}
+
+    # the edits replace the table: a snapshot taken before is not modified
+    snapshot = propagation_model.connections
+    propagation_model.update_connections([(1, 2, 0.5), (3, 4, 0.25), (1, 2, 0.0), (2, 4, 1.0)])
+    assert snapshot == {1: {2: 1.0}, 2: {1: 1.0}}
+    assert propagation_model.connections == {2: {4: 1.0}, 3: {4: 0.25}, 4: {2: 1.0, 3: 0.25}}
+
+    propagation_model.set_connections([{'fromMote': 1, 'toMote': 3, 'pdr': 0.75}])
+    assert propagation_model.retrieve_connections() == [{'fromMote': 1, 'toMote': 3, 'pdr': 0.75}]
+
+
+def test_propagation_in_flight(engine):
+    (engine, motes) = engine
+    received = []
+    for mh in motes[:4]:
+        mh.bsp_radio = mock.Mock()
+        mh.bsp_radio.indicate_tx_start.side_effect = lambda f, p, c, mote_id=mh.get_id(): received.append(
+            (mote_id, 'start', f))
+        mh.bsp_radio.indicate_tx_end.side_effect = lambda f, mote_id=mh.get_id(): received.append((mote_id, 'end', f))
+        engine.add_mote_handler(mh)
+
+    propagation_model = engine.propagation
+    propagation_model.connections.update({1: {2: 1.0, 3: 0.0001, 4: 1.0}, 2: {1: 1.0}, 3: {1: 0.0001}, 4: {1: 1.0}})
+
+    with mock.patch.object(propagation_model, 'stats', dict.fromkeys(propagation_model.stats, 0)), \
+            mock.patch.object(propagation_model, 'in_flight', {}), \
+            mock.patch.object(propagation_model.random, 'random', return_value=0.5):
+        propagation_model._indicate_tx_start(None, None, (1, [0x00], 11))
+        propagation_model._indicate_tx_end(None, None, 1)
+        assert sorted(received) == [(2, 'end', 1), (2, 'start', 1), (4, 'end', 1), (4, 'start', 1)]
+
+        # a frame is cut short by the next one
+        propagation_model._indicate_tx_start(None, None, (1, [0x01], 11))
+        propagation_model._indicate_tx_start(None, None, (1, [0x02], 11))
+        propagation_model._indicate_tx_end(None, None, 1)
+
+        # only the receivers of the frame get the end of transmission
+        propagation_model._indicate_tx_end(None, None, 1)
+        propagation_model._indicate_tx_end(None, None, 3)
+
+        assert propagation_model.get_stats() == {
+            'transmissions': 3,
+            'frames_delivered': 4,
+            'frames_dropped': 3,
+            'frames_truncated': 2,
+            'frames_collided': 0,
+        }
+        assert propagation_model.in_flight == {}
+
+
+def test_propagation_collisions(engine):
+    (engine, motes) = engine
+    received = []
+    for mh in motes[:4]:
+        mh.bsp_radio = mock.Mock()
+        mh.bsp_radio.indicate_tx_end.side_effect = lambda f, crc_passes=True, mote_id=mh.get_id(): received.append(
+            (mote_id, f, crc_passes))
+        engine.add_mote_handler(mh)
+
+    # mote 2 hears motes 1 and 3 as loud as each other, mote 4 about 6dB lower
+    propagation_model = engine.propagation
+    propagation_model.connections.update({1: {2: 1.0}, 2: {1: 1.0, 3: 1.0, 4: 0.6}, 3: {2: 1.0}, 4: {2: 0.6}})
+
+    with mock.patch.object(propagation_model, 'stats', dict.fromkeys(propagation_model.stats, 0)), \
+            mock.patch.object(propagation_model, 'in_flight', {}), \
+            mock.patch.object(propagation_model.random, 'random', return_value=0.5):
+        propagation_model.set_collision_model(True)
+
+        # the frame of mote 1 is captured over the weaker one of mote 4
+        propagation_model._indicate_tx_start(None, None, (1, [0x00], 11))
+        propagation_model._indicate_tx_start(None, None, (4, [0x01], 11))
+        propagation_model._indicate_tx_end(None, None, 4)
+        propagation_model._indicate_tx_end(None, None, 1)
+        assert received == [(2, 4, False), (2, 1, True)]
+
+        # a transmission on another channel does not interfere, one as loud on the same channel does
+        del received[:]
+        propagation_model._indicate_tx_start(None, None, (1, [0x02], 11))
+        propagation_model._indicate_tx_start(None, None, (3, [0x03], 26))
+        propagation_model._indicate_tx_end(None, None, 3)
+        propagation_model._indicate_tx_start(None, None, (3, [0x04], 11))
+        propagation_model._indicate_tx_end(None, None, 1)
+        propagation_model._indicate_tx_end(None, None, 3)
+        assert received == [(2, 3, True), (2, 1, False), (2, 3, False)]
+
+        assert propagation_model.get_stats()['frames_collided'] == 3
+        assert propagation_model.get_collision_stats() == [
+            {'fromMote': 1, 'toMote': 2, 'receptions': 2, 'collisions': 1},
+            {'fromMote': 3, 'toMote': 2, 'receptions': 2, 'collisions': 1},
+            {'fromMote': 4, 'toMote': 2, 'receptions': 1, 'collisions': 1},
+        ]
+        assert propagation_model.active == {} and propagation_model.corrupted == set()
+
+        propagation_model.set_collision_model(False)
+
+
+def test_propagation_seed(engine):
+    """ With the same seed, the same frames are lost. """
+
+    (engine, motes) = engine
+    received = []
+    for mh in motes[:4]:
+        mh.bsp_radio = mock.Mock()
+        mh.bsp_radio.indicate_tx_start.side_effect = lambda f, p, c, mote_id=mh.get_id(): received.append((mote_id, p))
+        engine.add_mote_handler(mh)
+
+    propagation_model = engine.propagation
+    propagation_model.connections.update({1: {2: 0.5, 3: 0.5, 4: 0.5}, 2: {1: 0.5}, 3: {1: 0.5}, 4: {1: 0.5}})
+
+    def _transmit(seed):
+        engine.set_seed(seed)
+        del received[:]
+        for i in range(100):
+            propagation_model._indicate_tx_start(None, None, (1, [i], 11))
+            propagation_model._indicate_tx_end(None, None, 1)
+        return list(received)
+
+    with mock.patch.object(propagation_model, 'stats', dict.fromkeys(propagation_model.stats, 0)), \
+            mock.patch.object(propagation_model, 'in_flight', {}):
+        frames = _transmit(3)
+        assert 0 < len(frames) < 300
+        assert _transmit(3) == frames
+        assert _transmit(4) != frames
+
+    assert engine.get_random('crystal', 1).random() == engine.get_random('crystal', 1).random()
+    assert engine.get_random('crystal', 1).random() != engine.get_random('crystal', 2).random()
+
+    # the components draw from distinct streams of the seed
+    engine.set_seed(3)
+    assert engine.propagation.random.random() != engine.location_manager.random.random()
+    engine.set_seed(None)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python2
+
+import logging.handlers
+import os
+
+import mock
+
+from openvisualizer.rpl.daojournal import DaoJournal
+from openvisualizer.rpl.daostats import DaoStats
+from openvisualizer.rpl.rpl import RPL
+from openvisualizer.rpl.topology import Topology
+
+# ============================ logging =========================================
+
+LOGFILE_NAME = 'test_rpl.log'
+
+log = logging.getLogger('test_rpl')
+log.setLevel(logging.ERROR)
+log.addHandler(logging.NullHandler())
+
+log_handler = logging.handlers.RotatingFileHandler(LOGFILE_NAME, backupCount=5, mode='w')
+log_handler.setFormatter(logging.Formatter("%(asctime)s [%(name)s:%(levelname)s] %(message)s"))
+for logger_name in ['test_rpl', 'RPL']:
+    temp = logging.getLogger(logger_name)
+    temp.setLevel(logging.DEBUG)
+    temp.addHandler(log_handler)
+
+# ============================ defines =========================================
+
+PREFIX = [0xbb, 0xbb, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
+SOURCE = [0x14, 0x15, 0x92, 0xcc, 0x00, 0x00, 0x00, 0x02]
+PARENT = [0x14, 0x15, 0x92, 0xcc, 0x00, 0x00, 0x00, 0x01]
+
+DAO_HEADER = [0x00, 0x00, 0x00, 0x2a] + [0xaa] * 16
+TARGET_OPTION = [0x05, 0x12, 0x00, 0x80] + PREFIX + SOURCE
+TRANSIT_OPTION = [0x06, 0x14, 0x00, 0x00, 0x00, 0xaa] + PREFIX + PARENT
+
+
+# ============================ helpers =========================================
+
+def _create_rpl(tmpdir):
+    rpl = RPL()
+    rpl.network_prefix = PREFIX
+    rpl.dao_journal = DaoJournal(os.path.join(str(tmpdir), 'dao_sequence.txt'), buffer_records=1)
+    return rpl
+
+
+# ============================ tests ===========================================
+
+def test_dao_parents(tmpdir):
+    rpl = _create_rpl(tmpdir)
+
+    with mock.patch.object(rpl, 'dispatch', return_value=[]) as dispatch:
+        rpl._indicate_dao((PREFIX + SOURCE, DAO_HEADER + TARGET_OPTION + TRANSIT_OPTION))
+
+    assert dispatch.call_args_list == [
+        mock.call(signal='updateParents', data=(tuple(SOURCE), [PARENT])),
+        mock.call(signal='getDepth', data=tuple(SOURCE)),
+    ]
+    assert list(rpl.parents_dao_seq.values()[0]) == [0x2a]
+
+    rpl.close()
+    with open(os.path.join(str(tmpdir), 'dao_sequence.txt')) as f:
+        lines = f.readlines()
+    assert len(lines) == 1
+    assert lines[0].split()[1] == '42'
+
+
+def test_dao_depth(tmpdir):
+    rpl = _create_rpl(tmpdir)
+    topo = Topology()
+
+    topo.dagroot = (0x01,) * 8
+
+    # the depth is read from the index of the topology, the (unroutable) route is not looked up
+    rpl._indicate_dao((PREFIX + SOURCE, DAO_HEADER + TARGET_OPTION + TRANSIT_OPTION))
+
+    assert rpl.get_dao_stats().values()[0]['depth'] == 1
+    assert topo.get_stats()['unroutable_lookups'] == 0
+    rpl.close()
+
+
+def test_dao_truncated_option(tmpdir):
+    rpl = _create_rpl(tmpdir)
+
+    with mock.patch.object(rpl, 'dispatch') as dispatch:
+        rpl._indicate_dao((SOURCE, DAO_HEADER + TARGET_OPTION + TRANSIT_OPTION[:-1]))
+        rpl._indicate_dao((SOURCE, DAO_HEADER[:-1]))
+        rpl._indicate_dao((SOURCE, DAO_HEADER + [0x07, 0x00]))
+
+    assert not dispatch.called
+    rpl.close()
+
+
+def test_dao_sequence_history_is_bounded(tmpdir):
+    rpl = _create_rpl(tmpdir)
+
+    with mock.patch.object(rpl, 'dispatch', return_value=[]):
+        for seq in range(RPL.DAO_SEQ_HISTORY + 10):
+            header = DAO_HEADER[:3] + [seq % 256] + DAO_HEADER[4:]
+            rpl._indicate_dao((SOURCE, header + TRANSIT_OPTION))
+
+    assert len(rpl.parents_dao_seq.values()[0]) == RPL.DAO_SEQ_HISTORY
+    rpl.close()
+
+
+def test_dao_journal_rotation(tmpdir):
+    filename = os.path.join(str(tmpdir), 'journal.txt')
+    journal = DaoJournal(filename, max_bytes=100, backup_count=2, buffer_records=1)
+
+    for seq in range(50):
+        journal.record('bbbb::2', seq, 0.0)
+    journal.close()
+
+    assert os.path.exists(filename + '.1')
+    assert os.path.exists(filename + '.2')
+    assert not os.path.exists(filename + '.3')
+    assert os.path.getsize(filename) <= 100
+
+
+def test_dao_stats():
+    stats = DaoStats()
+
+    stats.update(seq=10, parent=(1,), depth=1, timestamp=100.0)
+    stats.update(seq=11, parent=(1,), depth=1, timestamp=110.0)
+    stats.update(seq=14, parent=(2,), depth=2, timestamp=130.0)
+    stats.update(seq=14, parent=(2,), depth=2, timestamp=131.0)
+
+    summary = stats.to_dict()
+    assert summary['rx'] == 4
+    assert summary['missed'] == 2
+    assert summary['duplicates'] == 1
+    assert summary['parent_changes'] == 1
+    assert summary['depth'] == 2
+    assert summary['inter_arrival']['max'] == 20.0
+    assert summary['parent_change_rate'] == 3600.0 / 31
+
+
+def test_dao_stats_sequence_wrap():
+    stats = DaoStats()
+
+    stats.update(seq=254, parent=None, depth=None, timestamp=0.0)
+    stats.update(seq=1, parent=None, depth=None, timestamp=1.0)
+
+    assert stats.to_dict()['missed'] == 2
+
+
+def test_dao_stats_window_is_bounded():
+    stats = DaoStats()
+
+    for i in range(10 * DaoStats.WINDOW):
+        stats.update(seq=i % 256, parent=(i % 2,), depth=1, timestamp=float(i))
+
+    assert len(stats.inter_arrivals) == DaoStats.WINDOW
+    assert len(stats.parent_changed) == DaoStats.WINDOW
+    assert stats.to_dict()['rx'] == 10 * DaoStats.WINDOW
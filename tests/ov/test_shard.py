@@ -0,0 +1,141 @@
+#!/usr/bin/env python2
+
+import logging.handlers
+import multiprocessing
+
+import pytest
+
+from openvisualizer.simengine.shard import ShardedSimulation, partition, topology_connections
+from tests.ov.shardmotes import NUM_MOTES, SLOT_DURATION, TX_PERIOD
+
+# ============================ logging =========================================
+
+LOGFILE_NAME = 'test_shard.log'
+
+log = logging.getLogger('test_shard')
+log.setLevel(logging.ERROR)
+log.addHandler(logging.NullHandler())
+
+log_handler = logging.handlers.RotatingFileHandler(LOGFILE_NAME, backupCount=5, mode='w')
+log_handler.setFormatter(logging.Formatter("%(asctime)s [%(name)s:%(levelname)s] %(message)s"))
+for logger_name in ['test_shard']:
+    temp = logging.getLogger(logger_name)
+    temp.setLevel(logging.DEBUG)
+    temp.addHandler(log_handler)
+
+# ============================ defines =========================================
+
+SIM_DURATION = 1.0
+
+# the fake motes are imported by the worker processes
+FACTORY = 'tests.ov.shardmotes:create_fake_mote'
+COLLECTOR = 'tests.ov.shardmotes:collect_receptions'
+
+# speedup measurement
+SLOT_FACTORY = 'tests.ov.shardmotes:create_slot_mote'
+NUM_SLOT_MOTES = 128
+NUM_SLOTS = 50
+
+
+# ============================ helpers =========================================
+
+def _simulate(num_shards, collision_model=False):
+    with ShardedSimulation(FACTORY, NUM_MOTES, num_shards=num_shards, collector=COLLECTOR,
+                           collision_model=collision_model) as simulation:
+        # the simulation can be run in several steps
+        simulation.run(SIM_DURATION / 2)
+        simulation.run(SIM_DURATION / 2)
+
+        receptions = {}
+        for r in simulation.collect():
+            receptions.update(r)
+        stats = simulation.get_stats()
+
+    log.info('{0} shards: {1}'.format(num_shards, stats))
+    return receptions, stats
+
+
+def _mote_events(stats):
+    """ The events executed by the motes, without the start and end of the transmissions forwarded to a shard. """
+    return sum([s['events'] for s in stats['shards']]) - 2 * stats['forwarded']
+
+
+def _measure(num_shards):
+    with ShardedSimulation(SLOT_FACTORY, NUM_SLOT_MOTES, num_shards=num_shards) as simulation:
+        simulation.run(float(NUM_SLOTS * SLOT_DURATION) / 10 ** 9)
+        stats = simulation.get_stats()
+
+    log.info('{0} motes in {1} shards: {2}'.format(NUM_SLOT_MOTES, num_shards, stats))
+    return stats
+
+
+# ============================ tests ===========================================
+
+def test_shard_partition():
+    assert partition(range(1, 9), 3) == {1: 0, 2: 0, 3: 0, 4: 1, 5: 1, 6: 1, 7: 2, 8: 2}
+    assert topology_connections('linear', [1, 2, 3]) == [
+        {'fromMote': 2, 'toMote': 1, 'pdr': 1.0},
+        {'fromMote': 3, 'toMote': 2, 'pdr': 1.0},
+    ]
+    assert len(topology_connections('fully-meshed', range(1, 9))) == 8 * 7 / 2
+    with pytest.raises(ValueError):
+        topology_connections('ring', [1, 2, 3])
+
+    # the Pister-hack links only depend on the seed
+    links = topology_connections('', range(1, 51), seed=3)
+    assert links == topology_connections('', range(1, 51), seed=3)
+    assert links != topology_connections('', range(1, 51), seed=4)
+    assert 0 < len(links) < 50 * 49 / 2
+    assert all([0 < link['pdr'] <= 1 for link in links])
+
+
+def test_shard_same_results():
+    """ The receptions of all the motes do not depend on the number of shards. """
+
+    (single, single_stats) = _simulate(1)
+    (sharded, sharded_stats) = _simulate(4)
+
+    assert sharded == single
+
+    # each mote hears the start and end of every frame of the other motes
+    num_frames = int(SIM_DURATION * 10 ** 9 / TX_PERIOD)
+    for (mote_id, received) in single.items():
+        assert set([r[2] for r in received]) == set(range(1, NUM_MOTES + 1)) - {mote_id}
+        assert len(received) >= 2 * (NUM_MOTES - 1) * (num_frames - 1)
+        assert [r[0] for r in received] == sorted([r[0] for r in received])
+
+    # with one shard, the run is a single window
+    assert single_stats['forwarded'] == 0
+    assert single_stats['windows'] == 2
+    assert sharded_stats['forwarded'] > 0
+    assert [s['motes'] for s in sharded_stats['shards']] == [2, 2, 2, 2]
+    assert _mote_events(sharded_stats) == _mote_events(single_stats)
+
+    # the windows are as long as the TX delay: a few per frame
+    assert sharded_stats['windows'] < 8 * NUM_MOTES * num_frames
+
+
+def test_shard_collisions():
+    """ The shards see all the transmissions their motes hear, they find the same collisions as a single engine. """
+
+    (single, _) = _simulate(1, collision_model=True)
+    (sharded, _) = _simulate(4, collision_model=True)
+
+    assert sharded == single
+    assert [r for received in single.values() for r in received if r[1] == 'end' and not r[3]]
+
+
+def test_shard_speedup():
+    """ Several shards simulate a network of 100+ motes faster than one, given as many cores. """
+
+    num_shards = max(2, min(multiprocessing.cpu_count(), 4))
+    single = _measure(1)
+    sharded = _measure(num_shards)
+
+    log.info('{0} motes, {1} slots: {2:.3f}s in 1 shard, {3:.3f}s in {4} shards ({5} windows)'.format(
+        NUM_SLOT_MOTES, NUM_SLOTS, single['wall_time'], sharded['wall_time'], num_shards, sharded['windows']))
+
+    assert _mote_events(sharded) == _mote_events(single)
+    if multiprocessing.cpu_count() < 2:
+        pytest.skip('a single CPU, the shards cannot run in parallel')
+    assert sharded['wall_time'] < single['wall_time']
@@ -83,3 +83,55 @@ def test_source_route(expected_source_route):
         log.debug(output)
 
     assert calculated_route == expected_route
+
+
+def test_source_route_loop():
+    """
+    This tests a loop created when MOTE_B selects its descendant MOTE_D as parent
+
+    MOTE_A    MOTE_B <- MOTE_C <- MOTE_D <- MOTE_B
+    """
+
+    source_route = SourceRoute()
+    topo = topology.Topology()
+
+    source_route.dispatch(signal='updateParents', data=(tuple(MOTE_B), [MOTE_A]))
+    source_route.dispatch(signal='updateParents', data=(tuple(MOTE_C), [MOTE_B]))
+    source_route.dispatch(signal='updateParents', data=(tuple(MOTE_D), [MOTE_C]))
+    assert topo.depths[tuple(MOTE_D)] == 3
+
+    source_route.dispatch(signal='updateParents', data=(tuple(MOTE_B), [MOTE_D]))
+
+    for mote in [MOTE_B, MOTE_C, MOTE_D]:
+        assert topo.get_route(None, None, mote) == []
+    assert topo.get_stats()['loops_detected'] == 1
+    assert topo.get_stats()['looped_nodes'] == 3
+
+    # breaking the loop makes the nodes routable again
+    source_route.dispatch(signal='updateParents', data=(tuple(MOTE_B), [MOTE_A]))
+
+    assert topo.get_route(None, None, MOTE_D) == [MOTE_D, MOTE_C, MOTE_B, MOTE_A]
+    assert topo.get_stats()['looped_nodes'] == 0
+    assert topo.get_stats()['max_depth'] == 3
+
+
+def test_source_route_detached_from_dagroot():
+    """
+    This tests a route which does not end at the DAG root
+
+    MOTE_A (DAG root)    MOTE_B <- MOTE_C
+    """
+
+    source_route = SourceRoute()
+    topo = topology.Topology()
+
+    source_route.dispatch(signal='registerDagRoot', data={'prefix': [0xbb] * 8, 'host': MOTE_A})
+    source_route.dispatch(signal='updateParents', data=(tuple(MOTE_C), [MOTE_B]))
+
+    assert topo.get_route(None, None, MOTE_C) == []
+
+    source_route.dispatch(signal='updateParents', data=(tuple(MOTE_B), [MOTE_A]))
+
+    assert topo.get_route(None, None, MOTE_C) == [MOTE_C, MOTE_B, MOTE_A]
+
+    source_route.dispatch(signal='unregisterDagRoot', data={'prefix': [0xbb] * 8, 'host': MOTE_A})
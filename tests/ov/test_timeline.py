@@ -0,0 +1,232 @@
+#!/usr/bin/env python2
+
+import hashlib
+import logging.handlers
+
+import mock
+import pytest
+
+from openvisualizer.bspemulator.hwcrystal import HwCrystal
+from openvisualizer.simengine.simengine import SimEngine
+from openvisualizer.simengine.timeline import TimeLine
+
+# ============================ logging =========================================
+
+LOGFILE_NAME = 'test_timeline.log'
+
+log = logging.getLogger('test_timeline')
+log.setLevel(logging.ERROR)
+log.addHandler(logging.NullHandler())
+
+log_handler = logging.handlers.RotatingFileHandler(LOGFILE_NAME, backupCount=5, mode='w')
+log_handler.setFormatter(logging.Formatter("%(asctime)s [%(name)s:%(levelname)s] %(message)s"))
+for logger_name in ['test_timeline']:
+    temp = logging.getLogger(logger_name)
+    temp.setLevel(logging.DEBUG)
+    temp.addHandler(log_handler)
+
+# ============================ defines =========================================
+
+SMALL_TIMELINE = 10 ** 3
+LARGE_TIMELINE = 10 ** 5
+NUM_OPERATIONS = 2000
+
+
+# ============================ fixtures ========================================
+
+class FakeMoteHandler(object):
+    def __init__(self, mote_id):
+        self.id = mote_id
+
+    def get_id(self):
+        return self.id
+
+    @staticmethod
+    def handle_event(cb):
+        cb()
+
+
+class CountingTime(int):
+    """ Event time which counts the comparisons made by the heap of the timeline. """
+
+    comparisons = 0
+
+    def __eq__(self, other):
+        CountingTime.comparisons += 1
+        return int(self) == int(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        CountingTime.comparisons += 1
+        return int(self) < int(other)
+
+
+@pytest.fixture()
+def engine():
+    engine = SimEngine()
+    with mock.patch.object(engine, 'moteHandlers', []), mock.patch.object(engine, 'mote_handlers_by_id', {}):
+        engine.add_mote_handler(FakeMoteHandler(1))
+        yield engine
+    engine.set_as_fast_as_possible(False)
+    engine.set_delay(0)
+    engine.set_seed(None)
+
+
+# ============================ helpers =========================================
+
+def _cb():
+    pass
+
+
+def _create_timeline(num_events):
+    timeline = TimeLine()
+    timeline.log.setLevel(logging.INFO)
+    for i in range(num_events):
+        timeline.schedule_event_ns(CountingTime((i * 7919) % num_events), i % 100, _cb, 'event{0}'.format(i))
+    return timeline
+
+
+def _run_traced(engine, seed, path=None):
+    """ Runs random events drawn from a seed, returns the digest of their trace. """
+
+    engine.set_seed(seed)
+    rng = engine.get_random('events')
+    timeline = TimeLine()
+    timeline.set_trace(True, path)
+    for i in range(100):
+        timeline.schedule_event_ns(rng.randint(0, 10 ** 9), 1, _cb, 'event{0}'.format(rng.randint(0, 9)))
+    timeline.run_until(1.0)
+    timeline.set_trace(False)
+    return timeline.get_trace_digest()
+
+
+def _count_comparisons(timeline):
+    """ Number of comparisons between event times needed to reschedule, cancel and pop events in a timeline. """
+
+    start = CountingTime.comparisons
+    for i in range(NUM_OPERATIONS):
+        timeline.schedule_event_ns(CountingTime(timeline.current_time + i), i % 100, _cb, 'bench{0}'.format(i % 10))
+        timeline.cancel_event(i % 100, 'bench{0}'.format((i + 5) % 10))
+    for _ in range(NUM_OPERATIONS / 10):
+        timeline.current_time = timeline._pop_next_event().at_time
+    return CountingTime.comparisons - start
+
+
+# ============================ tests ===========================================
+
+def test_timeline_order():
+    timeline = TimeLine()
+
+    timeline.schedule_event(2.0, 1, _cb, 'a')
+    timeline.schedule_event(1.0, 1, _cb, 'b')
+    timeline.schedule_event(1.0, 2, _cb, 'c')
+    timeline.schedule_event(3.0, 2, _cb, 'd')
+
+    # rescheduling replaces the pending event with the same description
+    timeline.schedule_event(1.0, 1, _cb, 'a')
+    assert timeline.cancel_event(2, 'd') == 1
+    assert timeline.cancel_event(2, 'd') == 0
+
+    # events at the same time run in the order they were scheduled
+    assert timeline.get_events() == [[1.0, 1, 'b'], [1.0, 2, 'c'], [1.0, 1, 'a']]
+    assert timeline.get_num_events() == 3
+
+    assert [timeline._pop_next_event().desc for _ in range(3)] == ['b', 'c', 'a']
+    assert timeline._pop_next_event() is None
+
+
+def test_timeline_scales_logarithmically():
+    """ Operating on a timeline with 10^5 pending events costs not much more than on one with 10^3. """
+
+    small = _count_comparisons(_create_timeline(SMALL_TIMELINE))
+    large_timeline = _create_timeline(LARGE_TIMELINE)
+    large = _count_comparisons(large_timeline)
+
+    log.info('{0} pending events: {1} comparisons, {2} pending events: {3} comparisons'.format(
+        SMALL_TIMELINE, small, LARGE_TIMELINE, large))
+
+    # log2(10^5) / log2(10^3) ~ 1.7, a linear timeline would need ~100 times more comparisons
+    assert large < 3 * small
+
+    # cancelled events do not accumulate in the heap
+    assert len(large_timeline.timeline) <= 2 * large_timeline.get_num_events()
+
+
+def test_timeline_as_fast_as_possible(engine):
+    timeline = TimeLine()
+    executed = []
+
+    # the delay is ignored in as-fast-as-possible mode
+    engine.set_delay(10)
+    engine.set_as_fast_as_possible(True, check_period=100)
+
+    for i in range(1000):
+        timeline.schedule_event(i * 0.01, 1, lambda: executed.append(1), 'event{0}'.format(i))
+
+    with mock.patch.object(engine, 'pause_or_delay', wraps=engine.pause_or_delay) as pause_or_delay:
+        with pytest.raises(StopIteration):
+            timeline.run()
+
+    assert len(executed) == 1000
+    assert timeline.get_stats().get_num_events() == 1000
+    # once before the first event, then every check period
+    assert pause_or_delay.call_count == 1 + 1000 / 100
+
+
+def test_timeline_mote_index(engine):
+    mote = FakeMoteHandler(2)
+    engine.add_mote_handler(mote)
+
+    assert engine.get_mote_handler_by_id(2) is mote
+    assert engine.get_mote_handler(1) is mote
+    assert engine.get_num_motes() == 2
+
+    # a mote ID is only registered once
+    with pytest.raises(AssertionError):
+        engine.add_mote_handler(FakeMoteHandler(2))
+
+
+@pytest.mark.parametrize('drift', [0, 30.5])
+def test_timeline_crystal_ticks(engine, drift):
+    """ The crystal ticks are aligned on integer nanoseconds, with no accumulated error even after a long time. """
+
+    timeline = TimeLine()
+    with mock.patch.object(engine, 'timeline', timeline), mock.patch.object(HwCrystal, 'MAXDRIFT', drift):
+        crystal = HwCrystal(FakeMoteHandler(1))
+        timeline.current_time = 123
+        crystal.start()
+    period = 1e9 / HwCrystal.FREQUENCY * (1 + crystal.drift / 1e6)
+
+    for num_ticks in [1, 3, 32768, 2 ** 32]:
+        timeline.current_time = 123
+        tick_time = crystal.get_time_in(num_ticks)
+        assert isinstance(tick_time, (int, long))
+        assert tick_time - 123 == pytest.approx(num_ticks * period, abs=1)
+
+        # anywhere around the tick, it is the nearest one
+        for offset in [-int(period / 3), 0, int(period / 3)]:
+            timeline.current_time = tick_time + offset
+            assert crystal.get_time_last_tick() == tick_time
+            assert crystal.get_ticks_since(123) == num_ticks
+            assert crystal.get_time_in(1) - tick_time == pytest.approx(period, abs=1)
+
+
+def test_timeline_trace(engine, tmpdir):
+    """ Two runs with the same seed execute the same events, the trace file is what the digest is computed from. """
+
+    path = str(tmpdir.join('trace'))
+    digest = _run_traced(engine, 1, path)
+
+    assert _run_traced(engine, 1) == digest
+    assert _run_traced(engine, 2) != digest
+    with open(path) as f:
+        trace = f.read()
+    assert hashlib.sha1(trace).hexdigest() == digest
+
+    # one line per event, in the order of execution
+    lines = [line.split(' ') for line in trace.splitlines()]
+    assert 0 < len(lines) <= 100
+    assert [int(line[0]) for line in lines] == sorted([int(line[0]) for line in lines])
+    assert set([line[1] for line in lines]) == {'1'}
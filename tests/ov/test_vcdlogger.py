@@ -0,0 +1,88 @@
+#!/usr/bin/env python2
+
+import logging.handlers
+
+import mock
+import pytest
+
+from openvisualizer.bspemulator.vcdlogger import VcdLogger
+
+# ============================ logging =========================================
+
+LOGFILE_NAME = 'test_vcdlogger.log'
+
+log = logging.getLogger('test_vcdlogger')
+log.setLevel(logging.ERROR)
+log.addHandler(logging.NullHandler())
+
+log_handler = logging.handlers.RotatingFileHandler(LOGFILE_NAME, backupCount=5, mode='w')
+log_handler.setFormatter(logging.Formatter("%(asctime)s [%(name)s:%(levelname)s] %(message)s"))
+for logger_name in ['test_vcdlogger']:
+    temp = logging.getLogger(logger_name)
+    temp.setLevel(logging.DEBUG)
+    temp.addHandler(log_handler)
+
+# ============================ defines =========================================
+
+NUM_MOTES = 100
+
+
+# ============================ fixtures ========================================
+
+@pytest.fixture()
+def vcd_logger(tmpdir):
+    with mock.patch.object(VcdLogger, '_instance', None), \
+            mock.patch.object(VcdLogger, 'FILENAME', str(tmpdir.join('debugpins.vcd'))), \
+            mock.patch.object(VcdLogger, 'FILENAME_SWAP', str(tmpdir.join('debugpins.vcd.swap'))):
+        vcd_logger = VcdLogger()
+        yield vcd_logger
+        vcd_logger.close()
+
+
+# ============================ helpers =========================================
+
+def _parse(path):
+    """ Returns the variables declared in a VCD file, and its value changes as (time, value, variable). """
+
+    variables = {}
+    changes = []
+    ts = None
+    with open(path) as f:
+        for line in f:
+            if line.startswith('$var'):
+                (_, _, _, identifier, name, _) = line.split()
+                assert identifier not in variables
+                variables[identifier] = name
+            elif line.startswith('#'):
+                ts = int(line[1:])
+            elif line[0] in '01':
+                changes.append((ts, int(line[0]), variables[line[1:-1]]))
+    return variables, changes
+
+
+# ============================ tests ===========================================
+
+def test_vcdlogger_many_motes(vcd_logger):
+    """ The motes declared before the first toggle, and the ones which log later, all get their variables. """
+
+    for mote in range(1, NUM_MOTES + 1):
+        vcd_logger.add_mote(mote)
+
+    vcd_logger.log(0.001, 1, 'frame', True)
+    vcd_logger.log(0.002, NUM_MOTES, 'debug', True)
+    vcd_logger.log(0.002, NUM_MOTES, 'debug', False)
+    vcd_logger.log(0.003, NUM_MOTES + 1, 'isr', True)
+    vcd_logger.log(0.004, 1, 'frame', False)
+    vcd_logger.close()
+
+    (variables, changes) = _parse(VcdLogger.FILENAME)
+    assert len(variables) == (NUM_MOTES + 1) * len(VcdLogger.SIGNAMES)
+    assert max([len(identifier) for identifier in variables]) == 2
+    assert [c for c in changes if c[0] != 0] == [
+        (1000000, 1, '1_frame'),
+        (2000000, 1, '{0}_debug'.format(NUM_MOTES)),
+        (2001000, 0, '{0}_debug'.format(NUM_MOTES)),
+        (3000000, 1, '{0}_isr'.format(NUM_MOTES + 1)),
+        (4000000, 0, '1_frame'),
+    ]
+    assert sorted([c[2] for c in changes if c[0] == 0]) == sorted(variables.values())